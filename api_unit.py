@@ -0,0 +1,91 @@
+"""
+Tests for the streaming JSON API
+"""
+
+import json
+import unittest
+
+from webtest import TestApp
+
+import interface
+import main
+from database import COMP249Db
+
+
+class IterPostsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.db = COMP249Db(':memory:')
+        self.db.create_tables()
+        self.db.sample_data(random=False)
+
+    def test_batches(self):
+        """Batches join up to the whole timeline in order"""
+
+        batches = list(interface.iter_posts(self.db, batch_size=3))
+        self.assertEqual([3, 3, 3, 1], [len(batch) for batch in batches])
+        self.assertEqual(interface.post_list(self.db), [post for batch in batches for post in batch])
+
+        # a full last batch is followed by an empty query, not an empty batch
+        self.assertEqual([5, 5], [len(batch) for batch in interface.iter_posts(self.db, batch_size=5)])
+
+    def test_bounds(self):
+        """Posts are limited by count and by cursors"""
+
+        posts = interface.post_list(self.db)
+        found = [post for batch in interface.iter_posts(self.db, limit=4, batch_size=3) for post in batch]
+        self.assertEqual(posts[:4], found)
+
+        before = interface.parse_cursor(interface.page_cursor(posts[2]))
+        after = interface.parse_cursor(interface.page_cursor(posts[7]))
+        found = [post for batch in interface.iter_posts(self.db, before=before, after=after, batch_size=2)
+                 for post in batch]
+        self.assertEqual(posts[3:7], found)
+
+        mentions = [post for batch in interface.iter_posts(self.db, mentions='Contrary') for post in batch]
+        self.assertEqual(interface.post_list_mentions(self.db, 'Contrary'), mentions)
+        by_user = [post for batch in interface.iter_posts(self.db, usernick='Mandible') for post in batch]
+        self.assertEqual(interface.post_list(self.db, usernick='Mandible'), by_user)
+
+
+class RouteTests(unittest.TestCase):
+
+    def setUp(self):
+        self.db = COMP249Db()
+        self.db.create_tables()
+        self.db.sample_data(random=False)
+        self.app = TestApp(main.application)
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_ndjson(self):
+        """Each post is a line of JSON, cursors continue where a response stopped"""
+
+        response = self.app.get('/api/posts?limit=4')
+        self.assertEqual('application/x-ndjson', response.content_type)
+        posts = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual([1, 2, 3, 4], [post['id'] for post in posts])
+        self.assertEqual('Mandible', posts[0]['user'])
+
+        response = self.app.get('/api/posts', {'before': posts[-1]['cursor']})
+        self.assertEqual(list(range(5, 11)), [json.loads(line)['id'] for line in response.text.splitlines()])
+
+        response = self.app.get('/api/users/Mandible/posts')
+        self.assertEqual([1, 5, 6], [json.loads(line)['id'] for line in response.text.splitlines()])
+        response = self.app.get('/api/mentions/Contrary', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual([2, 5], [json.loads(line)['id'] for line in response.text.splitlines()])
+
+        self.app.get('/api/users/Nobody/posts', status=404)
+        self.app.get('/api/posts?limit=x', status=400)
+
+    def test_json(self):
+        """format=json gives one array"""
+
+        posts = self.app.get('/api/posts?format=json').json
+        self.assertEqual(10, len(posts))
+        self.assertEqual([], self.app.get('/api/mentions/Mandible?format=json').json)
+
+
+if __name__ == '__main__':
+    unittest.main()
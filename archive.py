@@ -0,0 +1,258 @@
+"""
+Old posts moved out of the live database into monthly archive files.
+
+Posts older than config.ARCHIVE_AGE days are moved, with their
+mentions, tags and votes, into a database file for the month they were
+made in (comp249-archive-2015-02.db next to comp249.db), so that the
+live database and its indexes stay the size of the recent posts.  Their
+other rows (vote counts, ranking, timelines) and the hourly tag counts
+older than that are deleted.  The archives table in the live database
+lists each month archived and the range of timestamps in it.
+
+The post listings in interface read the live database first and only
+when that doesn't fill the page, ie. the reader has paged past the
+recent posts, continue into the archives that can hold the posts
+wanted, newest first.  Each archive is ATTACHed to the connection
+reading it when first needed, up to config.ARCHIVE_ATTACHED of them at
+once.  Home timelines, votes and the top posts ranking only cover the
+live database, archived posts can't be voted for.
+
+Posts are moved config.ARCHIVE_BATCH at a time: each batch is copied
+into its archive and committed there before being deleted from the live
+database, so a crash in between leaves a post in both rather than in
+neither, and the next run finishes the move.  An Archiver thread, run by
+server.py, moves them every config.ARCHIVE_INTERVAL seconds, or run
+
+    python archive.py [dbname]
+"""
+
+import os
+import sys
+import time
+
+import config
+import indexing
+import jobs
+
+ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS {schema}.posts (
+    id integer primary key,
+    timestamp text,
+    usernick text,
+    content text);
+CREATE INDEX IF NOT EXISTS {schema}.posts_timestamp ON posts (timestamp, id);
+CREATE INDEX IF NOT EXISTS {schema}.posts_usernick_timestamp ON posts (usernick, timestamp, id);
+CREATE TABLE IF NOT EXISTS {schema}.mentions (
+    post_id integer,
+    usernick text,
+    timestamp text);
+CREATE INDEX IF NOT EXISTS {schema}.mentions_usernick_timestamp ON mentions (usernick, timestamp, post_id);
+CREATE TABLE IF NOT EXISTS {schema}.tags (
+    post_id integer,
+    tag text,
+    timestamp text);
+CREATE INDEX IF NOT EXISTS {schema}.tags_tag_timestamp ON tags (tag, timestamp, post_id);
+CREATE TABLE IF NOT EXISTS {schema}.votes (
+    post integer,
+    usernick text);
+CREATE UNIQUE INDEX IF NOT EXISTS {schema}.votes_post_usernick ON votes (post, usernick);
+"""
+
+# tables in the live database with rows for each post, and the column holding its id
+POST_TABLES = [('mentions', 'post_id'), ('tags', 'post_id'), ('timelines', 'post_id'),
+               ('post_html', 'post_id'), ('votes', 'post'), ('vote_counts', 'post_id'),
+               ('vote_changes', 'post_id'), ('top_posts', 'post_id'), ('posts', 'id')]
+
+
+def path(dbname, month):
+    """Return the file name of the archive of dbname for month ('YYYY-MM')"""
+
+    return '%s-archive-%s.db' % (os.path.splitext(dbname)[0], month)
+
+
+def partitions(db):
+    """Return a list of the archived months as tuples (month, oldest
+    timestamp, newest timestamp), newest first"""
+
+    cursor = db.cursor()
+    cursor.execute("SELECT month, oldest, newest FROM archives ORDER BY month DESC")
+    return cursor.fetchall()
+
+
+def attach(db, month):
+    """Attach the archive for month to db's connection if it isn't
+    already, detaching the one attached first if there are
+    config.ARCHIVE_ATTACHED already.  Return its schema name"""
+
+    schema = 'archive_' + month.replace('-', '_')
+    cursor = db.cursor()
+    cursor.execute("PRAGMA database_list")
+    attached = [row[1] for row in cursor.fetchall() if row[1].startswith('archive_')]
+    if schema in attached:
+        return schema
+    if len(attached) >= config.ARCHIVE_ATTACHED:
+        cursor.execute('DETACH DATABASE "%s"' % attached[0])
+    cursor.execute('ATTACH DATABASE ? AS "%s"' % schema, (path(db.dbname, month),))
+    return schema
+
+
+def timeline(db, rows, query, limit, before, after):
+    """Continue rows, a page of up to limit posts read from the live
+    database by interface._timeline, into the archives.  query(schema,
+    limit) runs the same query on the tables of the given schema.
+    Return the page as _timeline would have if every post were live"""
+
+    # pages of posts newer than after keep the oldest posts, so the
+    # archives are read oldest first
+    oldest_first = after is not None and before is None
+
+    if len(rows) >= limit and not oldest_first:
+        # the common case, a full page of recent posts; an archive
+        # could only hold posts newer than these between archive runs
+        newest = _newest(db)
+        if newest is None or newest < rows[-1][1]:
+            return rows
+
+    months = partitions(db)
+    if oldest_first:
+        months.reverse()
+
+    for month, oldest, newest in months:
+        if before is not None and oldest > before[0]:
+            continue
+        if after is not None and newest < after[0]:
+            continue
+        full = len(rows) >= limit
+        if full and not oldest_first and newest < rows[-1][1]:
+            break
+        if full and oldest_first and oldest > rows[0][1]:
+            break
+        rows = _merge(rows, query(attach(db, month), limit), limit, oldest_first)
+    return rows
+
+
+def _newest(db):
+    cursor = db.cursor()
+    cursor.execute("SELECT max(newest) FROM archives")
+    return cursor.fetchone()[0]
+
+
+def _merge(rows, more, limit, oldest_first):
+    """Return the limit posts of rows and more, both newest first,
+    nearest the start of the page, without any post twice"""
+
+    posts = {post[0]: post for post in rows + more}
+    merged = sorted(posts.values(), key=lambda post: (post[1], post[0]), reverse=True)
+    return merged[-limit:] if oldest_first else merged[:limit]
+
+
+def archive(db, age=None, batch_size=None, now=None):
+    """Move the posts of db made more than age (default
+    config.ARCHIVE_AGE) days before now (default the current time) into
+    the monthly archives.  Return the number of posts moved"""
+
+    if db.dbname == ':memory:':
+        return 0
+    if age is None:
+        age = config.ARCHIVE_AGE
+    if batch_size is None:
+        batch_size = config.ARCHIVE_BATCH
+    if now is None:
+        now = time.time()
+    cutoff = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(now - age * 86400))
+
+    cursor = db.cursor()
+    moved = 0
+    while True:
+        cursor.execute("SELECT id, timestamp FROM posts WHERE timestamp < ? ORDER BY timestamp LIMIT ?",
+                       (cutoff, batch_size))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        months = {}
+        for post_id, timestamp in rows:
+            months.setdefault(timestamp[:7], []).append((post_id, timestamp))
+        for month, posts in sorted(months.items()):
+            _move(db, month, posts)
+        moved += len(rows)
+
+    # imported here as database imports this module
+    import writer
+    bucket = indexing.tag_bucket(cutoff)
+    writer.write(db, lambda cursor: cursor.execute("DELETE FROM tag_counts WHERE bucket < ?", (bucket,)))
+    return moved
+
+
+def _move(db, month, posts):
+    """Move posts, a list of (id, timestamp) made in month, into its archive"""
+
+    ids = [post_id for post_id, timestamp in posts]
+    marks = ','.join('?' * len(ids))
+    schema = attach(db, month)
+    cursor = db.cursor()
+
+    cursor.execute("SELECT 1 FROM archives WHERE month = ?", (month,))
+    new = cursor.fetchone() is None
+    if new:
+        cursor.execute('PRAGMA "%s".journal_mode=WAL' % schema)
+    # every time, for archives made before a table was added
+    for statement in ARCHIVE_SCHEMA.format(schema='"%s"' % schema).split(';'):
+        if statement.strip():
+            cursor.execute(statement)
+    if new:
+        # left over from a database since made again
+        for table in ('posts', 'mentions', 'tags', 'votes'):
+            cursor.execute('DELETE FROM "%s".%s' % (schema, table))
+
+    cursor.execute('INSERT OR REPLACE INTO "%s".posts SELECT id, timestamp, usernick, content '
+                   'FROM main.posts WHERE id IN (%s)' % (schema, marks), ids)
+    for table, column in (('mentions', 'usernick'), ('tags', 'tag')):
+        cursor.execute('DELETE FROM "%s".%s WHERE post_id IN (%s)' % (schema, table, marks), ids)
+        cursor.execute('INSERT INTO "%s".%s SELECT post_id, %s, timestamp FROM main.%s WHERE post_id IN (%s)'
+                       % (schema, table, column, table, marks), ids)
+    cursor.execute('INSERT OR IGNORE INTO "%s".votes SELECT CAST(post AS integer), usernick '
+                   'FROM main.votes WHERE post IN (%s)' % (schema, marks), ids)
+    db.commit()
+
+    oldest = min(timestamp for post_id, timestamp in posts)
+    newest = max(timestamp for post_id, timestamp in posts)
+
+    def remove(cursor):
+        for table, column in POST_TABLES:
+            cursor.execute('DELETE FROM %s WHERE %s IN (%s)' % (table, column, marks), ids)
+        cursor.execute("""INSERT INTO archives (month, oldest, newest, posts) VALUES (?, ?, ?, ?)
+                          ON CONFLICT (month) DO UPDATE SET oldest = min(oldest, excluded.oldest),
+                                                            newest = max(newest, excluded.newest),
+                                                            posts = posts + excluded.posts""",
+                       (month, oldest, newest, len(ids)))
+
+    # imported here as database imports this module
+    import writer
+    writer.write(db, remove)
+
+
+def clear(cursor):
+    """Forget every archive, their files are emptied when next used"""
+
+    cursor.execute("DELETE FROM archives")
+
+
+class Archiver(jobs.PeriodicJob):
+    """A background thread that runs archive every interval seconds
+    (default config.ARCHIVE_INTERVAL) until stop() is called"""
+
+    def __init__(self, dbname=config.DB_NAME, interval=None):
+
+        super().__init__('archiver', archive, dbname,
+                         config.ARCHIVE_INTERVAL if interval is None else interval)
+
+
+if __name__ == '__main__':
+    from database import COMP249Db
+
+    dbname = sys.argv[1] if len(sys.argv) > 1 else config.DB_NAME
+    db = COMP249Db(dbname)
+    print("archived %d posts" % archive(db))
+    for month, oldest, newest in partitions(db):
+        print("%s  %s - %s  %s" % (month, oldest, newest, path(dbname, month)))
+    db.close()
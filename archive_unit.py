@@ -0,0 +1,148 @@
+"""
+Tests for the monthly post archives
+"""
+
+import glob
+import os
+import unittest
+
+import archive
+import config
+import indexing
+import interface
+import votes
+import writer
+from database import COMP249Db
+
+
+def walk(db, limit, backwards=False, **kwargs):
+    """Return the ids of every post listed by post_list with kwargs,
+    following before cursors (after cursors if backwards) limit at a time"""
+
+    ids = []
+    cursor = None
+    while True:
+        if backwards:
+            page = interface.post_list(db, limit=limit, after=cursor, **kwargs)
+        else:
+            page = interface.post_list(db, limit=limit, before=cursor, **kwargs)
+        if not page:
+            return ids
+        if backwards:
+            ids = [post[0] for post in page] + ids
+            cursor = (page[0][1], page[0][0])
+        else:
+            ids.extend(post[0] for post in page)
+            cursor = (page[-1][1], page[-1][0])
+
+
+def attached(db):
+    cursor = db.cursor()
+    cursor.execute("PRAGMA database_list")
+    return [row[1] for row in cursor.fetchall() if row[1].startswith('archive_')]
+
+
+class ArchiveTests(unittest.TestCase):
+
+    def setUp(self):
+        self.db = COMP249Db()
+        self.db.create_tables()
+        self.db.sample_data(random=False)
+        # an older month, and some posts made now
+        post = (11, '2014-12-01 12:00:00', 'Bean', 'long ago @Contrary #ox')
+        self.db.cursor().execute("INSERT INTO posts (id, timestamp, usernick, content) VALUES (?, ?, ?, ?)", post)
+        indexing.index_posts(self.db.cursor(), [post])
+        self.db.commit()
+        for i in range(4):
+            interface.post_add(self.db, 'Mandible', 'recent %d @Contrary #ox' % i)
+
+    def tearDown(self):
+        self.db.close()
+        for name in glob.glob(archive.path(config.DB_NAME, '*')):
+            os.remove(name)
+
+    def listings(self):
+        """Return what the post listings show"""
+
+        return {
+            'all': interface.post_list(self.db, limit=100),
+            'user': interface.post_list(self.db, usernick='Mandible', limit=100),
+            'mentions': interface.post_list_mentions(self.db, 'Contrary', limit=100),
+            'tag': interface.post_list_tag(self.db, 'ox', limit=100),
+            'pages': walk(self.db, 3),
+            'pages backwards': walk(self.db, 3, backwards=True),
+            'export': [post for batch in interface.iter_posts(self.db, batch_size=4) for post in batch],
+        }
+
+    def test_archive(self):
+        """Old posts are moved and still listed as before"""
+
+        expected = self.listings()
+        self.assertEqual(11, archive.archive(self.db, age=30))
+        self.assertEqual(0, archive.archive(self.db, age=30))
+
+        cursor = self.db.cursor()
+        cursor.execute("SELECT count(*) FROM posts")
+        self.assertEqual(4, cursor.fetchone()[0])
+        cursor.execute("SELECT count(*) FROM mentions WHERE post_id <= 11")
+        self.assertEqual(0, cursor.fetchone()[0])
+        self.assertEqual(['2015-02', '2014-12'], [month for month, oldest, newest in archive.partitions(self.db)])
+        self.assertTrue(os.path.exists(archive.path(config.DB_NAME, '2015-02')))
+
+        self.assertEqual(expected, self.listings())
+
+        # a page of recent posts only reads the live database
+        db = COMP249Db()
+        self.assertEqual(3, len(interface.post_list(db, limit=3)))
+        self.assertEqual([], attached(db))
+        self.assertEqual(5, len(interface.post_list(db, limit=5)))
+        self.assertEqual(['archive_2015_02'], attached(db))
+        db.close()
+
+    def test_votes_and_tag_counts(self):
+        """Votes go with their posts, their counts and the old tag counts are dropped"""
+
+        recent = interface.post_list(self.db, limit=1)[0][0]
+        for post_id in (1, 11, recent):
+            interface.vote_add(self.db, post_id, 'Bean')
+        writer.write(self.db, votes.refresh)
+
+        archive.archive(self.db, age=30)
+
+        cursor = self.db.cursor()
+        for table, column in (('votes', 'post'), ('vote_counts', 'post_id'), ('top_posts', 'post_id')):
+            cursor.execute("SELECT %s FROM %s" % (column, table))
+            self.assertEqual([recent], [int(row[0]) for row in cursor.fetchall()], table)
+        cursor.execute('SELECT post, usernick FROM "%s".votes' % archive.attach(self.db, '2014-12'))
+        self.assertEqual([(11, 'Bean')], cursor.fetchall())
+
+        cursor.execute("SELECT DISTINCT bucket FROM tag_counts")
+        self.assertEqual({indexing.tag_bucket(post[1]) for post in interface.post_list(self.db, limit=4)},
+                         {row[0] for row in cursor.fetchall()})
+
+    def test_attached(self):
+        """Archives are detached when too many are attached"""
+
+        limit = config.ARCHIVE_ATTACHED
+        config.ARCHIVE_ATTACHED = 1
+        try:
+            archive.archive(self.db, age=30)
+            self.assertEqual(['archive_2015_02'], attached(self.db))
+            self.assertEqual(15, len(interface.post_list(self.db, limit=100)))
+            self.assertEqual(['archive_2014_12'], attached(self.db))
+        finally:
+            config.ARCHIVE_ATTACHED = limit
+
+    def test_new_database(self):
+        """Archives of an earlier database aren't mixed into a new one"""
+
+        archive.archive(self.db, age=30)
+        self.db.create_tables()
+        self.db.sample_data(random=False)
+        self.assertEqual(10, len(interface.post_list(self.db, limit=100)))
+        archive.archive(self.db, age=30)
+        self.assertEqual(list(range(1, 11)), [post[0] for post in interface.post_list(self.db, limit=100)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+"""
+Static files served from memory under content-hashed names.
+
+When the application starts every file under the static directory is
+read into memory and given a fingerprinted name containing a hash of
+its contents, eg. style.css is also served as style.1a2b3c4d5e.css.
+Templates link to files with static_url('style.css'), which gives the
+fingerprinted URL, so browsers can cache them forever: when a file
+changes so does its URL.
+
+Compressed copies are made when the site is built, run
+
+    python assets.py [directory]
+
+to write a .gz file next to each compressible file (default static).
+Any that are missing or out of date are compressed when the files are
+loaded instead.
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import sys
+
+from compress import compressible
+
+# bodies smaller than this are sent as they are
+MIN_COMPRESS_SIZE = 256
+
+
+def fingerprint(name, digest):
+    """Return name with digest added before the extension"""
+
+    base, ext = os.path.splitext(name)
+    return '%s.%s%s' % (base, digest, ext)
+
+
+def compress(body):
+    """Return body gzipped, always the same for the same body"""
+
+    return gzip.compress(body, 9, mtime=0)
+
+
+class Asset():
+    """One static file held in memory"""
+
+    def __init__(self, name, body, content_type, compressed=None):
+
+        self.name = name
+        self.body = body
+        self.content_type = content_type
+        self.digest = hashlib.sha1(body).hexdigest()[:10]
+        self.etag = '"%s"' % self.digest
+        self.url_name = fingerprint(name, self.digest)
+        # only kept if it is worth sending
+        if compressed is not None and len(compressed) >= len(body):
+            compressed = None
+        self.compressed = compressed
+
+
+def files(root):
+    """Generate the paths relative to root of the files to serve,
+    with / separators"""
+
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.endswith('.gz') or filename.startswith('.'):
+                continue
+            path = os.path.relpath(os.path.join(dirpath, filename), root)
+            yield path.replace(os.sep, '/')
+
+
+class Assets():
+    """The static files under root, by name and fingerprinted name"""
+
+    def __init__(self, root):
+
+        self.root = root
+        self.load()
+
+    def load(self):
+        """(Re)read every file under root"""
+
+        by_name = {}
+        by_url = {}
+        for name in files(self.root):
+            path = os.path.join(self.root, name)
+            with open(path, 'rb') as f:
+                body = f.read()
+            content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+            if content_type.startswith('text/'):
+                content_type += '; charset=utf-8'
+
+            compressed = None
+            if compressible(content_type) and len(body) >= MIN_COMPRESS_SIZE:
+                compressed = self._read_compressed(path + '.gz', body)
+                if compressed is None:
+                    compressed = compress(body)
+
+            asset = Asset(name, body, content_type, compressed)
+            by_name[name] = asset
+            by_url[asset.url_name] = asset
+
+        self.by_name = by_name
+        self.by_url = by_url
+        digest = hashlib.sha1()
+        for name in sorted(by_name):
+            digest.update(('%s %s\n' % (name, by_name[name].digest)).encode())
+        # changes when any file does
+        self.version = digest.hexdigest()
+
+    @staticmethod
+    def _read_compressed(path, body):
+        """Return the contents of the gzip file at path if it holds body"""
+
+        try:
+            with open(path, 'rb') as f:
+                compressed = f.read()
+            if gzip.decompress(compressed) == body:
+                return compressed
+        except (OSError, EOFError):
+            pass
+        return None
+
+    def url(self, name):
+        """Return the fingerprinted URL of the file name, or its plain
+        URL if it isn't known"""
+
+        asset = self.by_name.get(name)
+        if asset is None:
+            return '/static/' + name
+        return '/static/' + asset.url_name
+
+    def get(self, name):
+        """Return (asset, fingerprinted) for a name from a URL, either
+        fingerprinted or plain, or (None, False) if there is no such file"""
+
+        asset = self.by_url.get(name)
+        if asset is not None:
+            return asset, True
+        return self.by_name.get(name), False
+
+
+def build(root):
+    """Write a .gz file next to each compressible file under root,
+    return the number written"""
+
+    written = 0
+    for name in files(root):
+        path = os.path.join(root, name)
+        content_type = mimetypes.guess_type(name)[0] or ''
+        if not compressible(content_type):
+            continue
+        with open(path, 'rb') as f:
+            body = f.read()
+        if len(body) < MIN_COMPRESS_SIZE or Assets._read_compressed(path + '.gz', body) is not None:
+            continue
+        with open(path + '.gz', 'wb') as f:
+            f.write(compress(body))
+        written += 1
+    return written
+
+
+if __name__ == '__main__':
+    root = sys.argv[1] if len(sys.argv) > 1 else 'static'
+    print("compressed %d files" % build(root))
@@ -0,0 +1,123 @@
+"""
+Tests for fingerprinted static files
+"""
+
+import gzip
+import os
+import tempfile
+import unittest
+
+from webtest import TestApp
+
+import assets
+import main
+from database import COMP249Db
+
+
+CSS = b"body {\n    font-family: sans-serif;\n}\n" * 20
+
+
+class AssetTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        os.mkdir(os.path.join(self.dir.name, 'img'))
+        with open(os.path.join(self.dir.name, 'style.css'), 'wb') as f:
+            f.write(CSS)
+        with open(os.path.join(self.dir.name, 'img', 'logo.png'), 'wb') as f:
+            f.write(b'\x89PNG not really')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_names(self):
+        """Files are found by plain and fingerprinted names"""
+
+        static = assets.Assets(self.dir.name)
+        url = static.url('style.css')
+        self.assertRegex(url, r'^/static/style\.[0-9a-f]{10}\.css$')
+        self.assertRegex(static.url('img/logo.png'), r'^/static/img/logo\.[0-9a-f]{10}\.png$')
+        self.assertEqual('/static/missing.js', static.url('missing.js'))
+
+        asset, fingerprinted = static.get(url[len('/static/'):])
+        self.assertTrue(fingerprinted)
+        self.assertEqual(CSS, asset.body)
+        self.assertEqual('text/css; charset=utf-8', asset.content_type)
+        self.assertEqual((asset, False), static.get('style.css'))
+        self.assertEqual((None, False), static.get('nothere.css'))
+
+    def test_compression(self):
+        """Text is compressed, other files aren't, built copies are used"""
+
+        static = assets.Assets(self.dir.name)
+        self.assertEqual(CSS, gzip.decompress(static.by_name['style.css'].compressed))
+        self.assertIsNone(static.by_name['img/logo.png'].compressed)
+
+        self.assertEqual(1, assets.build(self.dir.name))
+        self.assertEqual(0, assets.build(self.dir.name))
+        path = os.path.join(self.dir.name, 'style.css.gz')
+        with open(path, 'rb') as f:
+            built = f.read()
+        self.assertEqual(built, assets.Assets(self.dir.name).by_name['style.css'].compressed)
+        self.assertNotIn('style.css.gz', static.by_name)
+
+        # an out of date copy is ignored
+        with open(os.path.join(self.dir.name, 'style.css'), 'ab') as f:
+            f.write(b'h1 {}\n')
+        self.assertEqual(CSS + b'h1 {}\n', gzip.decompress(assets.Assets(self.dir.name).by_name['style.css'].compressed))
+
+
+class RouteTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        with open(os.path.join(self.dir.name, 'style.css'), 'wb') as f:
+            f.write(CSS)
+        self.saved = main.static_assets
+        main.static_assets = assets.Assets(self.dir.name)
+        self.app = TestApp(main.application)
+
+    def tearDown(self):
+        main.static_assets = self.saved
+        self.dir.cleanup()
+
+    def test_fingerprinted(self):
+        """Fingerprinted URLs can be cached forever and are sent compressed if possible"""
+
+        url = main.static_assets.url('style.css')
+        response = self.app.get(url)
+        self.assertEqual(CSS, response.body)
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        self.assertNotIn('Content-Encoding', response.headers)
+
+        # webtest decodes the body and drops Content-Encoding, the ETag
+        # shows which copy was sent
+        response = self.app.get(url, headers={'Accept-Encoding': 'gzip'})
+        self.assertTrue(response.headers['ETag'].endswith('-gzip"'))
+        self.assertEqual(CSS, response.body)
+        self.assertEqual('Accept-Encoding', response.headers['Vary'])
+
+        self.app.get(url, headers={'Accept-Encoding': 'gzip', 'If-None-Match': response.headers['ETag']}, status=304)
+
+    def test_plain(self):
+        """Plain names are still served but must be revalidated"""
+
+        response = self.app.get('/static/style.css')
+        self.assertEqual(CSS, response.body)
+        self.assertEqual('public, no-cache', response.headers['Cache-Control'])
+        self.app.get('/static/nothere.css', status=404)
+
+    def test_template_link(self):
+        """Pages link to the fingerprinted stylesheet"""
+
+        db = COMP249Db()
+        db.create_tables()
+        db.sample_data(random=False)
+        db.close()
+        main.static_assets = self.saved
+        response = self.app.get('/')
+        self.assertIn(self.saved.url('style.css'), response)
+
+
+if __name__ == '__main__':
+    unittest.main()
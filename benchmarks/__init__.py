@@ -0,0 +1,6 @@
+"""
+Performance benchmarks for the Psst application.
+
+Each module can be run from the top level directory of the project,
+eg.  python -m benchmarks.pool
+"""
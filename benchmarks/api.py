@@ -0,0 +1,75 @@
+"""
+Time to the first byte, total time and peak memory of exporting every
+post through /api/posts, compared with reading them all with post_list
+
+    python -m benchmarks.api [posts]
+"""
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from wsgiref.util import setup_testing_defaults
+
+# puts the project on the import path
+import benchmarks.util
+
+import interface
+import loadgen
+import main
+from database import COMP249Db
+
+
+def export():
+    """Request /api/posts, return (seconds to first chunk, total seconds, bytes)"""
+
+    environ = {'PATH_INFO': '/api/posts', 'QUERY_STRING': ''}
+    setup_testing_defaults(environ)
+    start = time.perf_counter()
+    body = main.application(environ, lambda status, headers, exc_info=None: None)
+    first = None
+    size = 0
+    for chunk in body:
+        if first is None:
+            first = time.perf_counter() - start
+        size += len(chunk)
+    if hasattr(body, 'close'):
+        body.close()
+    return first, time.perf_counter() - start, size
+
+
+def peak(func, *args):
+    """Call func, return (its result, peak MB traced)"""
+
+    tracemalloc.start()
+    result = func(*args)
+    memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, memory / 2**20
+
+
+def benchmark(posts=100000):
+
+    with tempfile.TemporaryDirectory(prefix='psstbench') as dirname:
+        path = os.path.join(dirname, 'api.db')
+        loadgen.generate(path, posts, build_timelines=False)
+        main.db_plugin.dbname = path
+
+        first, elapsed, size = export()
+        print("%d posts, %.1fMB of NDJSON" % (posts, size / 2**20))
+        print("first byte %.1fms, all %.2fs" % (first * 1000, elapsed))
+        # tracing slows allocation, so memory is measured separately
+        print("peak memory streaming %.1fMB" % peak(export)[1])
+
+        db = COMP249Db(path)
+        start = time.perf_counter()
+        interface.post_list(db, limit=posts)
+        elapsed = time.perf_counter() - start
+        print("post_list of all posts %.2fs, peak memory %.1fMB"
+              % (elapsed, peak(interface.post_list, db, None, posts)[1]))
+        db.close()
+
+
+if __name__ == '__main__':
+    benchmark(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,83 @@
+"""
+Moving a year of posts into monthly archives: how long it takes, how
+much smaller the live database gets and the cost of listing posts
+from the live database and from the archives
+
+    python -m benchmarks.archive [posts]
+"""
+
+import calendar
+import os
+import sys
+import tempfile
+import time
+
+# puts the project on the import path
+import benchmarks.util
+
+import archive
+import interface
+import loadgen
+from database import COMP249Db
+
+# loadgen's posts end here
+END = calendar.timegm(time.strptime('2026-01-01', '%Y-%m-%d'))
+
+
+def live_size(db):
+    """Return the MB of pages in use in the live database"""
+
+    cursor = db.cursor()
+    cursor.execute("PRAGMA page_count")
+    pages = cursor.fetchone()[0]
+    cursor.execute("PRAGMA freelist_count")
+    pages -= cursor.fetchone()[0]
+    cursor.execute("PRAGMA page_size")
+    return pages * cursor.fetchone()[0] / 2**20
+
+
+def timed(func, repeat=50):
+    """Return the mean milliseconds of func()"""
+
+    func()
+    start = time.perf_counter()
+    for i in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def report(db, user, deep):
+    for name, func in [
+        ("first page", lambda: interface.post_list(db)),
+        ("user page", lambda: interface.post_list(db, usernick=user)),
+        ("mentions page", lambda: interface.post_list_mentions(db, user)),
+        ("page from six months ago", lambda: interface.post_list(db, before=deep)),
+    ]:
+        print("  %-28s %8.3f ms" % (name, timed(func)))
+
+
+def benchmark(posts=200000):
+
+    with tempfile.TemporaryDirectory(prefix='psstbench') as dirname:
+        path = os.path.join(dirname, 'archive.db')
+        loadgen.generate(path, posts, build_timelines=False)
+        db = COMP249Db(path)
+        user = loadgen.Generator().nicks[0]
+        deep = (time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(END - 180 * 86400)), 0)
+
+        print("%d posts over a year, %.1fMB" % (posts, live_size(db)))
+        report(db, user, deep)
+
+        start = time.perf_counter()
+        moved = archive.archive(db, age=30, now=END)
+        elapsed = time.perf_counter() - start
+        print("archived %d posts older than 30 days in %.1fs, %d posts/s"
+              % (moved, elapsed, moved / elapsed))
+        print("live database %.1fMB in use, %d archives"
+              % (live_size(db), len(archive.partitions(db))))
+        report(db, user, deep)
+        db.close()
+
+
+if __name__ == '__main__':
+    benchmark(*[int(a) for a in sys.argv[1:]])
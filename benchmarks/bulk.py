@@ -0,0 +1,47 @@
+"""
+Posts written per second by post_add one at a time and by post_add_many
+
+    python -m benchmarks.bulk [posts] [batch_size]
+"""
+
+import sys
+import time
+
+from benchmarks.util import make_database
+
+import interface
+from database import COMP249Db, gentext
+
+
+def generate(count):
+    """Generate count (usernick, timestamp, content) tuples"""
+
+    nicks = ['Bobalooba', 'Jimbulator', 'Contrary', 'Bean', 'Mandible', 'Barfoo']
+    mentions = ['@' + nick for nick in nicks]
+    for i in range(count):
+        nick = nicks[i % len(nicks)]
+        yield nick, None, gentext(nick, mentions)[:interface.MAX_POST_LENGTH]
+
+
+def benchmark(count=20000, batch_size=5000):
+
+    posts = list(generate(count))
+
+    db = COMP249Db(make_database())
+    start = time.perf_counter()
+    for usernick, timestamp, content in posts[:count // 10]:
+        interface.post_add(db, usernick, content)
+    rate = count // 10 / (time.perf_counter() - start)
+    print("post_add       %10.0f posts/s" % rate)
+    db.close()
+
+    db = COMP249Db(make_database())
+    start = time.perf_counter()
+    interface.post_add_many(db, posts, batch_size)
+    rate = count / (time.perf_counter() - start)
+    print("post_add_many  %10.0f posts/s  (batches of %d)" % (rate, batch_size))
+    db.close()
+
+
+if __name__ == '__main__':
+    benchmark(*[int(a) for a in sys.argv[1:]])
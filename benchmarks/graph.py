@@ -0,0 +1,106 @@
+"""
+Loading time, memory and query times for the in-memory follow graph
+on a generated graph, compared with friend-of-friend suggestions in SQL
+
+    python -m benchmarks.graph [users] [follows]
+
+The defaults make about a million follows.
+"""
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# puts the project on the import path
+import benchmarks.util
+
+import graph
+import loadgen
+from database import COMP249Db
+
+
+def make_graph(path, users, follows):
+    """Create a database at path with users users following about
+    follows others each, return the number of follows"""
+
+    generator = loadgen.Generator(users=users, follows=follows)
+    db = COMP249Db(path)
+    db.create_tables()
+    db.conn.execute("PRAGMA synchronous=OFF")
+    cursor = db.cursor()
+    cursor.executemany("INSERT INTO users (nick, password, avatar) VALUES (?, ?, ?)", generator.user_rows())
+    cursor.executemany("INSERT INTO follows (follower, followed) VALUES (?, ?)", generator.follow_rows())
+    db.commit()
+    cursor.execute("SELECT count(*) FROM follows WHERE follower != followed")
+    count = cursor.fetchone()[0]
+    db.close()
+    return count, generator.nicks
+
+
+def timed(func, args):
+    """Call func with each of args, return the mean and worst milliseconds"""
+
+    times = []
+    for arg in args:
+        start = time.perf_counter()
+        func(arg)
+        times.append(time.perf_counter() - start)
+    return sum(times) / len(times) * 1000, max(times) * 1000
+
+
+def sql_suggestions(cursor, nick, limit=10):
+    cursor.execute("""SELECT f2.followed, count(*) AS n FROM follows f1
+                      JOIN follows f2 ON f2.follower = f1.followed
+                      WHERE f1.follower = ? AND f1.followed != ? AND f2.followed != ?
+                            AND f2.followed NOT IN (SELECT followed FROM follows WHERE follower = ?)
+                      GROUP BY f2.followed ORDER BY n DESC LIMIT ?""", (nick, nick, nick, nick, limit))
+    return cursor.fetchall()
+
+
+def benchmark(users=10000, follows=170):
+
+    with tempfile.TemporaryDirectory(prefix='psstbench') as dirname:
+        path = os.path.join(dirname, 'graph.db')
+        edges, nicks = make_graph(path, users, follows)
+        db = COMP249Db(path)
+        cursor = db.cursor()
+
+        start = time.perf_counter()
+        graph.FollowGraph().load(cursor)
+        elapsed = time.perf_counter() - start
+
+        # tracing slows allocation, so memory is measured on a second load
+        tracemalloc.start()
+        follows_graph = graph.FollowGraph()
+        follows_graph.load(cursor)
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        print("%d users, %d follows" % (len(nicks), edges))
+        print("load %.2fs, arrays %.1fMB, all of the graph %.1fMB"
+              % (elapsed, follows_graph.nbytes() / 2**20, memory / 2**20))
+
+        sample = nicks[::max(1, len(nicks) // 200)]
+        popular = nicks[0]
+        print("%-28s %10s %10s" % ("", "mean ms", "worst ms"))
+        for name, func in [
+            ("follower_count", follows_graph.follower_count),
+            ("follows", lambda nick: follows_graph.follows(nick, popular)),
+            ("mutual", lambda nick: follows_graph.mutual(nick, popular)),
+            ("suggestions", follows_graph.suggestions),
+            ("suggestions (SQL)", lambda nick: sql_suggestions(cursor, nick)),
+            ("follow and unfollow", lambda nick: (follows_graph.follow(nick, nicks[-1]),
+                                                  follows_graph.unfollow(nick, nicks[-1]))),
+        ]:
+            print("%-28s %10.3f %10.3f" % ((name,) + timed(func, sample)))
+
+        start = time.perf_counter()
+        follows_graph.following = follows_graph.following.compact(len(follows_graph.nicks))
+        print("compact %.2fs" % (time.perf_counter() - start))
+        db.close()
+
+
+if __name__ == '__main__':
+    benchmark(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,59 @@
+"""
+Bytes sent and CPU time per request for the home page at each
+gzip compression level (0 is no compression), rendering every page,
+with the page cache, and with compressed pages kept as well
+
+    python -m benchmarks.gzip [requests]
+"""
+
+import sys
+import time
+
+from benchmarks.util import make_database, wsgi_get
+
+import main
+import pagecache
+
+
+def run(count):
+    """Fetch the home page count times, return (bytes, CPU us per request, requests/s)"""
+
+    headers = {'Accept-Encoding': 'gzip'}
+    wsgi_get(main.application, '/', headers)
+
+    cpu = time.process_time()
+    start = time.perf_counter()
+    for i in range(count):
+        status, response_headers, body = wsgi_get(main.application, '/', headers)
+    cpu = time.process_time() - cpu
+    elapsed = time.perf_counter() - start
+    return len(body), cpu / count * 1e6, count / elapsed
+
+
+def benchmark(count=1000):
+
+    main.db_plugin.dbname = make_database()
+    # the compressor sits inside the metrics middleware
+    compressor = main.application.wsgi.app
+    page_cache_size = pagecache.pages.maxsize
+    gzip_cache_size = compressor.cache.maxsize
+
+    print("%-6s %-12s %10s %12s %12s" % ("level", "caching", "bytes", "CPU us/req", "requests/s"))
+    for level in (0, 1, 6, 9):
+        compressor.level = level
+        for caching, page_cache, gzip_cache in (("none", 0, 0), ("pages", page_cache_size, 0),
+                                                ("pages+gzip", page_cache_size, gzip_cache_size)):
+            if level == 0 and gzip_cache:
+                continue
+            pagecache.pages.maxsize = page_cache
+            pagecache.pages.clear()
+            compressor.cache.maxsize = gzip_cache
+            compressor.cache.clear()
+            print("%-6s %-12s %10d %12.0f %12.0f" % ((level, caching) + run(count)))
+
+    pagecache.pages.maxsize = page_cache_size
+    compressor.cache.maxsize = gzip_cache_size
+
+
+if __name__ == '__main__':
+    benchmark(*[int(a) for a in sys.argv[1:]])
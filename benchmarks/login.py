@@ -0,0 +1,56 @@
+"""
+Login throughput against the cost of the password hash, with
+concurrent clients sharing the password worker pool
+
+    python -m benchmarks.login [clients] [logins]
+"""
+
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.util import make_database
+
+import config
+import passwords
+import users
+from database import COMP249Db
+
+
+def benchmark(clients=8, count=40):
+
+    path = make_database()
+    db = COMP249Db(path)
+    password, nick = 'bob', 'Bobalooba'
+
+    print("%-14s %10s %12s %12s" % ("hasher", "cost", "ms/check", "logins/s"))
+    for method, costs in (('pbkdf2_sha256', (10000, 100000, 200000, 400000)),
+                          ('scrypt', (2 ** 12, 2 ** 14, 2 ** 15))):
+        for cost in costs:
+            stored = passwords.hash_password(password, method, cost)
+            cursor = db.cursor()
+            cursor.execute("UPDATE users SET password = ? WHERE nick = ?", (stored, nick))
+            db.commit()
+            config.PASSWORD_HASHER = method
+            config.PBKDF2_ITERATIONS = config.SCRYPT_N = cost
+
+            start = time.perf_counter()
+            passwords.check_password(password, stored)
+            single = (time.perf_counter() - start) * 1000
+
+            def login(i):
+                client = COMP249Db(path)
+                assert users.check_login(client, nick, password)
+                client.close()
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(clients) as executor:
+                list(executor.map(login, range(count)))
+            rate = count / (time.perf_counter() - start)
+            print("%-14s %10d %12.1f %12.1f" % (method, cost, single, rate))
+
+    print("with %d password workers and %d clients" % (config.LOGIN_WORKERS, clients))
+
+
+if __name__ == '__main__':
+    benchmark(*[int(a) for a in sys.argv[1:]])
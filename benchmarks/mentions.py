@@ -0,0 +1,58 @@
+"""
+Latency of post_list_mentions as the posts table grows, compared with
+searching the content of posts for the mention
+
+    python -m benchmarks.mentions [size ...]
+"""
+
+import sys
+import time
+
+from benchmarks.util import make_database, add_posts
+
+import interface
+from database import COMP249Db
+
+
+def like_scan(db, usernick, limit=50):
+    """The alternative to the mentions table, a pattern match on content"""
+
+    cursor = db.cursor()
+    cursor.execute("""SELECT posts.id, posts.timestamp, posts.usernick, users.avatar, posts.content
+                      FROM posts JOIN users ON posts.usernick = users.nick
+                      WHERE posts.content LIKE ?
+                      ORDER BY posts.timestamp DESC LIMIT ?""", ('%@' + usernick + '%', limit))
+    return cursor.fetchall()
+
+
+def latency(func, db, usernick, repeat=50):
+    """Return the mean time in milliseconds to list mentions of a user"""
+
+    start = time.perf_counter()
+    for i in range(repeat):
+        func(db, usernick)
+    return (time.perf_counter() - start) * 1000 / repeat
+
+
+def benchmark(sizes):
+
+    # a user mentioned in many posts fills a page quickly whatever the
+    # method, one never mentioned makes the pattern match read every post
+    print("%10s %14s %14s %14s %14s" % ("posts", "common index", "common LIKE", "rare index", "rare LIKE"))
+    path = make_database()
+    total = 0
+    for size in sizes:
+        add_posts(path, size - total)
+        total = size
+        db = COMP249Db(path)
+        print("%10d %14.3f %14.3f %14.3f %14.3f" % (
+            size,
+            latency(interface.post_list_mentions, db, 'Contrary'),
+            latency(like_scan, db, 'Contrary', repeat=5),
+            latency(interface.post_list_mentions, db, 'Nobody'),
+            latency(like_scan, db, 'Nobody', repeat=5)))
+        db.close()
+
+
+if __name__ == '__main__':
+    benchmark([int(a) for a in sys.argv[1:]] or [1000, 10000, 100000])
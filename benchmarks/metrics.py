@@ -0,0 +1,67 @@
+"""
+Cost of recording request metrics: the fixed cost of the middleware
+around an application that does nothing, then requests per second for
+some pages with metrics turned off and on
+
+    python -m benchmarks.metrics [requests] [rounds]
+
+Off and on are timed alternately over several rounds and the best
+round of each kept, so that drift in the speed of the machine
+doesn't count as overhead.
+"""
+
+import sys
+
+from benchmarks.util import make_database, wsgi_get, rate
+
+import config
+import main
+import metrics
+
+
+def empty_app(environ, start_response):
+    start_response('200 OK', [])
+    return [b'']
+
+
+def middleware_cost(count=100000):
+    """Return the microseconds added to each request by the middleware"""
+
+    app = metrics.MetricsMiddleware(empty_app)
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/'}
+
+    def get():
+        app(environ, lambda status, headers, exc_info=None: None)
+
+    best = [0, 0]
+    for i in range(5):
+        for enabled in (0, 1):
+            config.METRICS = enabled
+            best[enabled] = max(best[enabled], rate(get, count))
+    return (1 / best[1] - 1 / best[0]) * 1e6
+
+
+def benchmark(count=2000, rounds=5):
+
+    print("middleware adds %.1f us per request" % middleware_cost())
+
+    main.db_plugin.dbname = make_database()
+
+    print("%-20s %12s %12s %10s %10s" % ("page", "off req/s", "on req/s", "overhead", "us/req"))
+    for path in ('/', '/users/Bobalooba', '/tags/sun', '/no/such/page'):
+
+        def get():
+            wsgi_get(main.application, path)
+
+        rate(get, count // 10)  # warm up
+        best = [0, 0]
+        for i in range(rounds):
+            for enabled in (0, 1):
+                config.METRICS = enabled
+                best[enabled] = max(best[enabled], rate(get, count))
+        off, on = best
+        print("%-20s %12.0f %12.0f %9.1f%% %10.1f" % (path, off, on, (off / on - 1) * 100, (1 / on - 1 / off) * 1e6))
+
+
+if __name__ == '__main__':
+    benchmark(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,45 @@
+"""
+Requests per second for anonymous timeline pages rendered every
+time, served from the page cache, and answered with 304 Not Modified
+
+    python -m benchmarks.pagecache [requests] [posts]
+"""
+
+import sys
+
+from benchmarks.util import make_database, add_posts, wsgi_get, rate
+
+import main
+import pagecache
+
+
+def benchmark(count=2000, posts=100000):
+
+    path = make_database()
+    add_posts(path, posts)
+    main.db_plugin.dbname = path
+
+    print("%-20s %12s %12s %12s" % ("page", "render/s", "cached/s", "304/s"))
+    for page in ('/', '/users/Bobalooba', '/mentions/Contrary'):
+        etag = dict(wsgi_get(main.application, page)[1])['Etag']
+
+        def get():
+            wsgi_get(main.application, page)
+
+        def conditional():
+            status, headers, body = wsgi_get(main.application, page, {'If-None-Match': etag})
+            assert status.startswith('304'), status
+
+        maxsize = pagecache.pages.maxsize
+        pagecache.pages.maxsize = 0
+        pagecache.pages.clear()
+        rendered = rate(get, count)
+        pagecache.pages.maxsize = maxsize
+        get()
+        cached = rate(get, count)
+        not_modified = rate(conditional, count)
+        print("%-20s %12.0f %12.0f %12.0f" % (page, rendered, cached, not_modified))
+
+
+if __name__ == '__main__':
+    benchmark(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,56 @@
+"""
+Time to fetch a page of the home timeline at increasing depth with
+keyset cursors compared with LIMIT/OFFSET
+
+    python -m benchmarks.pagination [posts]
+"""
+
+import sys
+import time
+
+from benchmarks.util import make_database, add_posts
+
+import interface
+from database import COMP249Db
+
+
+def offset_page(db, offset, limit=50):
+    """The alternative to cursors, skip offset rows"""
+
+    cursor = db.cursor()
+    cursor.execute("SELECT " + interface.POST_COLUMNS + """
+                    FROM posts JOIN users ON posts.usernick = users.nick
+                    ORDER BY posts.timestamp DESC, posts.id DESC LIMIT ? OFFSET ?""", (limit, offset))
+    return cursor.fetchall()
+
+
+def mean_ms(func, repeat=20):
+
+    start = time.perf_counter()
+    for i in range(repeat):
+        func()
+    return (time.perf_counter() - start) * 1000 / repeat
+
+
+def benchmark(count=200000):
+
+    path = make_database()
+    add_posts(path, count)
+    db = COMP249Db(path)
+
+    print("%10s %12s %12s" % ("depth", "cursor ms", "offset ms"))
+    depth = 1
+    while depth * 50 < count:
+        # find the post just before this page to make its cursor
+        post = offset_page(db, depth * 50 - 1, 1)[0]
+        before = interface.parse_cursor(interface.page_cursor(post))
+
+        keyset = mean_ms(lambda: interface.post_list(db, before=before))
+        offset = mean_ms(lambda: offset_page(db, depth * 50))
+        print("%10d %12.3f %12.3f" % (depth, keyset, offset))
+        depth *= 4
+    db.close()
+
+
+if __name__ == '__main__':
+    benchmark(*[int(a) for a in sys.argv[1:]])
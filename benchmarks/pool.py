@@ -0,0 +1,47 @@
+"""
+Requests per second for the home page with and without connection pooling
+
+    python -m benchmarks.pool [requests] [threads]
+"""
+
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.util import make_database, wsgi_get
+
+import main
+
+
+def run(count, threads):
+    """Serve count requests for / using threads concurrent clients,
+    return requests per second"""
+
+    def get(i):
+        status, headers, body = wsgi_get(main.application, '/')
+        assert status.startswith('200'), status
+
+    start = time.perf_counter()
+    if threads == 1:
+        for i in range(count):
+            get(i)
+    else:
+        with ThreadPoolExecutor(threads) as executor:
+            list(executor.map(get, range(count)))
+    return count / (time.perf_counter() - start)
+
+
+def benchmark(count=2000, threads=4):
+
+    main.db_plugin.dbname = make_database()
+
+    for nthreads in (1, threads):
+        for pooled in (False, True):
+            main.db_plugin.pooled = pooled
+            run(count // 10, nthreads)  # warm up
+            rps = run(count, nthreads)
+            print("threads=%-2d pooled=%-5s %8.0f requests/s" % (nthreads, pooled, rps))
+
+
+if __name__ == '__main__':
+    benchmark(*[int(a) for a in sys.argv[1:]])
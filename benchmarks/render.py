@@ -0,0 +1,76 @@
+"""
+Throughput of post_to_html over a generated corpus, compared with
+converting a post in several passes, one per kind of link
+
+    python -m benchmarks.render [posts]
+"""
+
+import re
+import sys
+import time
+from random import seed
+
+# puts the project on the import path
+import benchmarks.util
+
+import render
+from database import gentext
+
+
+URL_RE = re.compile(r"(https?://(?:(?!&lt;|&gt;)[^\s'])+)")
+MENTION_RE = re.compile(r"(?<![\w/])@(\w+(?:\.\w+)*)")
+TAG_RE = re.compile(r"(?<![\w/])#(\w+)")
+
+
+def multipass_post_to_html(content):
+    """Escape then link URLs, mentions and tags each with its own pass"""
+
+    html = content.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+    html = URL_RE.sub(r"<a href='\1'>\1</a>", html)
+    html = MENTION_RE.sub(r"<a href='/users/\1'>@\1</a>", html)
+    html = TAG_RE.sub(r"<a href='/tags/\1'>#\1</a>", html)
+    return html
+
+
+def corpus(count):
+    """Return a list of count generated posts, some with URLs and HTML"""
+
+    seed(249)
+    mentions = ['@Bobalooba', '@Contrary', '@steve.cassidy']
+    posts = []
+    for i in range(count):
+        text = gentext('Jimbulator', mentions)
+        if i % 5 == 0:
+            text += ' http://example.org/page%d.html?a=1&b=2' % i
+        if i % 7 == 0:
+            text = '<b>' + text + '</b>'
+        posts.append(text)
+    return posts
+
+
+def throughput(func, posts):
+    """Return (MB/s, posts/s) for func over posts"""
+
+    size = sum(len(p.encode()) for p in posts)
+    start = time.perf_counter()
+    for post in posts:
+        func(post)
+    elapsed = time.perf_counter() - start
+    return size / elapsed / 1e6, len(posts) / elapsed
+
+
+def benchmark(count=100000):
+
+    posts = corpus(count)
+    # the two agree on ordinary posts
+    for post in posts[:1000]:
+        assert render.post_to_html(post) == multipass_post_to_html(post), post
+
+    print("%d posts, %.1f MB" % (count, sum(len(p.encode()) for p in posts) / 1e6))
+    for name, func in (('multipass', multipass_post_to_html), ('single pass', render.post_to_html)):
+        mbs, pps = throughput(func, posts)
+        print("%-12s %8.2f MB/s %10.0f posts/s" % (name, mbs, pps))
+
+
+if __name__ == '__main__':
+    benchmark(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,102 @@
+"""
+Reads and writes per second with reader threads listing pages of posts
+while writer threads add posts, under WAL, with the write queue
+(config.WRITE_QUEUE) and read-only connections (config.DB_READ_ONLY)
+each turned on and off, and the 99th percentile time of each and the
+number that failed
+
+    python -m benchmarks.routing [seconds] [readers] [writers]
+"""
+
+import sqlite3
+import sys
+import threading
+import time
+
+from benchmarks.util import make_database
+
+import config
+import interface
+import writer
+from database import COMP249Db, ConnectionPool
+
+
+def percentile(times, fraction):
+    if not times:
+        return 0.0
+    times = sorted(times)
+    return times[min(len(times) - 1, int(len(times) * fraction))]
+
+
+def run(dbname, seconds, readers, writers, readonly):
+    """Run readers and writers threads for seconds, return (reads/s,
+    writes/s, read p99 seconds, write p99 seconds, failures)"""
+
+    # a connection for every thread, so that none waits for the pool
+    pool = ConnectionPool(dbname, readers + writers, readonly=readonly)
+    reads = []
+    writes = []
+    failures = [0]
+    stop = time.perf_counter() + seconds
+
+    def read():
+        before = None
+        while time.perf_counter() < stop:
+            start = time.perf_counter()
+            db = COMP249Db(dbname, pool=pool)
+            try:
+                posts = interface.post_list(db, limit=20, before=before)
+                # page back through the posts, starting again at the end
+                before = (posts[-1][1], posts[-1][0]) if len(posts) == 20 else None
+                reads.append(time.perf_counter() - start)
+            except sqlite3.OperationalError:
+                failures[0] += 1
+            db.close()
+
+    def write():
+        i = 0
+        while time.perf_counter() < stop:
+            start = time.perf_counter()
+            db = COMP249Db(dbname, pool=pool)
+            try:
+                if interface.post_add(db, 'Bean', 'benchmark post %d @Contrary #bench' % i) is None:
+                    failures[0] += 1
+                else:
+                    writes.append(time.perf_counter() - start)
+            except (sqlite3.OperationalError, writer.WriteTimeout):
+                # database is locked or the write waited too long
+                failures[0] += 1
+            db.close()
+            i += 1
+
+    workers = ([threading.Thread(target=read) for i in range(readers)] +
+               [threading.Thread(target=write) for i in range(writers)])
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    return (len(reads) / elapsed, len(writes) / elapsed,
+            percentile(reads, 0.99), percentile(writes, 0.99), failures[0])
+
+
+def benchmark(seconds=3, readers=8, writers=4):
+
+    saved = config.WRITE_QUEUE, config.DB_READ_ONLY
+    print("%-6s %-10s %10s %10s %12s %12s %9s" % ("queue", "read-only", "reads/s", "writes/s",
+                                                  "read p99 ms", "write p99 ms", "failures"))
+    for queue in (0, 1):
+        for readonly in (0, 1):
+            config.WRITE_QUEUE = queue
+            config.DB_READ_ONLY = readonly
+            # a new file each time so each starts with the same posts
+            dbname = make_database()
+            rate = run(dbname, seconds, readers, writers, bool(readonly))
+            print("%-6s %-10s %10.0f %10.0f %12.1f %12.1f %9d" % ((bool(queue), bool(readonly)) + rate[:2] +
+                                                                  (rate[2] * 1000, rate[3] * 1000, rate[4])))
+    config.WRITE_QUEUE, config.DB_READ_ONLY = saved
+
+
+if __name__ == '__main__':
+    benchmark(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,98 @@
+"""
+Requests per second through server.py over real sockets with 1, 2
+and 4 worker processes, from as many client processes each keeping
+one connection alive, to show throughput scaling with cores
+
+    python -m benchmarks.server [seconds] [clients]
+
+Throughput can only grow with the workers while there are idle cores,
+os.cpu_count() is printed with the results.
+"""
+
+import http.client
+import multiprocessing
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+from benchmarks.util import make_database
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PATHS = ['/', '/users/Bobalooba', '/static/style.css']
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(port, timeout=10):
+    """Wait until the server on port answers"""
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('GET', '/')
+            connection.getresponse().read()
+            connection.close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("server on port %d didn't start" % port)
+
+
+def client(port, seconds, results):
+    """Make requests on one connection for seconds, put the count in results"""
+
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    count = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        connection.request('GET', PATHS[count % len(PATHS)], headers={'Accept-Encoding': 'gzip'})
+        response = connection.getresponse()
+        response.read()
+        count += 1
+    connection.close()
+    results.put(count)
+
+
+def run(dbname, workers, seconds, clients):
+    """Return the requests/s served by workers worker processes"""
+
+    port = free_port()
+    server = subprocess.Popen([sys.executable, 'server.py', '--port', str(port), '--workers', str(workers),
+                               '--db', dbname], cwd=ROOT, stdout=subprocess.DEVNULL)
+    try:
+        wait_for(port)
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=client, args=(port, seconds, results)) for i in range(clients)]
+        start = time.perf_counter()
+        for process in processes:
+            process.start()
+        total = sum(results.get() for process in processes)
+        elapsed = time.perf_counter() - start
+        for process in processes:
+            process.join()
+        return total / elapsed
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+
+
+def benchmark(seconds=5, clients=8):
+
+    dbname = make_database()
+    print("%d cores, %d clients" % (os.cpu_count(), clients))
+    print("%-8s %12s" % ("workers", "requests/s"))
+    for workers in (1, 2, 4):
+        print("%-8d %12.0f" % (workers, run(dbname, workers, seconds, clients)))
+
+
+if __name__ == '__main__':
+    benchmark(*[int(a) for a in sys.argv[1:]])
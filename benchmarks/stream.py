@@ -0,0 +1,106 @@
+"""
+Idle /stream clients held by one server process, and the time for a
+new post to reach all of them
+
+    python -m benchmarks.stream [clients]
+"""
+
+import os
+import resource
+import selectors
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+# puts the project on the import path
+import benchmarks.util
+
+import interface
+import main
+import server
+from database import COMP249Db
+
+
+def rss():
+    """Return the resident memory of this process in MB"""
+
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+
+
+def read_all(clients, until):
+    """Read from every client until each has sent until"""
+
+    selector = selectors.DefaultSelector()
+    received = {}
+    for client in clients:
+        selector.register(client, selectors.EVENT_READ)
+        received[client] = b''
+    waiting = len(clients)
+    while waiting:
+        for key, events in selector.select(10):
+            data = key.fileobj.recv(65536)
+            before = until in received[key.fileobj]
+            received[key.fileobj] += data
+            if not before and until in received[key.fileobj]:
+                selector.unregister(key.fileobj)
+                waiting -= 1
+            if not data:
+                raise RuntimeError("a client was disconnected")
+    selector.close()
+
+
+def benchmark(clients=2000):
+
+    # two sockets for each client in this process
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, max(soft, 2 * clients + 100)), hard))
+
+    with tempfile.TemporaryDirectory(prefix='psstbench') as dirname:
+        path = os.path.join(dirname, 'stream.db')
+        db = COMP249Db(path)
+        db.create_tables()
+        db.sample_data(random=False)
+        main.db_plugin.dbname = path
+
+        sock = server.listen('127.0.0.1', 0)
+        httpd = server.PooledWSGIServer(sock, main.application, 8)
+        thread = threading.Thread(target=httpd.serve_forever, kwargs={'poll_interval': 0.05})
+        thread.start()
+        port = sock.getsockname()[1]
+
+        memory = rss()
+        start = time.perf_counter()
+        sockets = []
+        # in batches within the listen backlog, beyond which connecting waits for a SYN retry
+        for first in range(0, clients, 100):
+            batch = []
+            for i in range(first, min(clients, first + 100)):
+                client = socket.create_connection(('127.0.0.1', port))
+                client.sendall(b'GET /stream HTTP/1.1\r\nHost: localhost\r\n\r\n')
+                batch.append(client)
+            read_all(batch, b'retry: ')
+            sockets.extend(batch)
+        connected = time.perf_counter() - start
+        print("%d clients connected in %.2fs, %d threads, %.1fMB more memory"
+              % (clients, connected, threading.active_count(), rss() - memory))
+
+        for i in range(3):
+            start = time.perf_counter()
+            post_id = interface.post_add(db, 'Mandible', 'post %d' % i)
+            read_all(sockets, b'id: %d\n' % post_id)
+            print("post %d reached every client in %.1fms" % (i, (time.perf_counter() - start) * 1000))
+
+        for client in sockets:
+            client.close()
+        httpd.shutdown()
+        thread.join()
+        httpd.server_close()
+        sock.close()
+        db.close()
+
+
+if __name__ == '__main__':
+    benchmark(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,193 @@
+"""
+Microbenchmarks of the hot paths at several dataset sizes, with the
+results saved as JSON and compared against an earlier run
+
+    python -m benchmarks.suite [--sizes 1000,10000] [--output results.json]
+                               [--baseline baseline.json] [--threshold 0.25]
+
+Each benchmark is timed with timeit in several rounds and the fastest
+round is kept, which is the least disturbed by other work on the
+machine.  With --baseline, any benchmark that is more than threshold
+(a fraction, 0.25 is 25%) slower than in the baseline is reported and
+the exit status is 1, so the suite can gate a deploy.  Make a baseline
+by saving the output of a run on the deployed version:
+
+    python -m benchmarks.suite --output baseline.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import timeit
+
+from benchmarks.util import wsgi_get
+
+from bottle import request
+
+import interface
+import loadgen
+import main
+import users
+from database import COMP249Db
+
+
+def measure(func, rounds=5):
+    """Return the fastest time in seconds of one call to func over
+    rounds of enough calls to take at least 0.2s"""
+
+    timer = timeit.Timer(func)
+    number = timer.autorange()[0]
+    return min(timer.repeat(rounds, number)) / number
+
+
+def make_dataset(dirname, size):
+    """Generate a database of size posts in dirname, return its path"""
+
+    path = os.path.join(dirname, 'suite%d.db' % size)
+    loadgen.generate(path, posts=size, users=max(100, size // 100), follows=20)
+    return path
+
+
+def benchmarks(db, path):
+    """Return a list of (name, func) pairs to time against db, which
+    is the database at path"""
+
+    cursor = db.cursor()
+    # the most prolific author and tag, whose pages are the most work
+    cursor.execute("SELECT usernick FROM posts GROUP BY usernick ORDER BY count(*) DESC LIMIT 1")
+    nick = cursor.fetchone()[0]
+    cursor.execute("SELECT tag FROM tags GROUP BY tag ORDER BY count(*) DESC LIMIT 1")
+    tag = cursor.fetchone()[0]
+    cursor.execute("SELECT content FROM posts ORDER BY id LIMIT 1000")
+    contents = [row[0] for row in cursor.fetchall()]
+
+    sessionid = users.generate_session(db, nick)
+    request.cookies[users.COOKIE_NAME] = sessionid
+    cookie = {'Cookie': '%s=%s' % (users.COOKIE_NAME, sessionid)}
+    main.db_plugin.dbname = path
+
+    def render():
+        for content in contents:
+            interface.post_to_html(content)
+
+    def lookup_session(cached=True):
+        if not cached:
+            users.session_cache.clear()
+        assert users.session_user(db) == nick
+
+    def vote():
+        interface.vote_add(db, 1, nick)
+        interface.vote_remove(db, 1, nick)
+
+    def page(path, headers=None):
+        def get():
+            status, headers_out, body = wsgi_get(main.application, path, headers)
+            assert status.startswith('200'), status
+        return get
+
+    return [
+        ('post_list', lambda: interface.post_list(db)),
+        ('post_list_user', lambda: interface.post_list(db, nick)),
+        ('post_list_mentions', lambda: interface.post_list_mentions(db, nick)),
+        ('post_list_home', lambda: interface.post_list_home(db, nick)),
+        ('top_posts', lambda: interface.top_posts(db)),
+        ('post_to_html_x1000', render),
+        ('check_login', lambda: users.check_login(db, nick, 'password')),
+        ('generate_session', lambda: users.generate_session(db, nick)),
+        ('session_user', lookup_session),
+        ('session_user_uncached', lambda: lookup_session(False)),
+        ('page_index', page('/')),
+        ('page_user', page('/users/' + nick)),
+        ('page_tag', page('/tags/' + tag)),
+        ('page_timeline', page('/timeline', cookie)),
+        ('page_top', page('/top')),
+        ('vote_add_remove', vote),
+        # last, as it changes the data the others read
+        ('post_add', lambda: interface.post_add(db, nick, 'benchmark post @%s #%s' % (nick, tag))),
+    ]
+
+
+def run(sizes, rounds=5, only=None):
+    """Run the benchmarks at each size, return the results as a dict"""
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='psstbench') as dirname:
+        for size in sizes:
+            path = make_dataset(dirname, size)
+            db = COMP249Db(path)
+            request.cookies.pop(users.COOKIE_NAME, None)
+            for name, func in benchmarks(db, path):
+                if only and name not in only:
+                    continue
+                seconds = measure(func, rounds)
+                key = '%s/%d' % (name, size)
+                results[key] = {'name': name, 'size': size, 'ms': seconds * 1000}
+                print("%-28s %12.4f ms %12.0f /s" % (key, seconds * 1000, 1 / seconds), file=sys.stderr)
+            request.cookies.pop(users.COOKIE_NAME, None)
+            db.close()
+
+    return {
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': results,
+    }
+
+
+def compare(current, baseline, threshold):
+    """Print current results against baseline, return the names of
+    the benchmarks more than threshold slower than in baseline"""
+
+    regressions = []
+    print("%-28s %12s %12s %9s" % ("benchmark", "baseline ms", "current ms", "change"))
+    for key, result in current['results'].items():
+        if key not in baseline['results']:
+            print("%-28s %12s %12.4f" % (key, '-', result['ms']))
+            continue
+        before = baseline['results'][key]['ms']
+        change = result['ms'] / before - 1
+        flag = ''
+        if change > threshold:
+            regressions.append(key)
+            flag = '  REGRESSION'
+        print("%-28s %12.4f %12.4f %+8.1f%%%s" % (key, before, result['ms'], change * 100, flag))
+    return regressions
+
+
+def suite(argv=None):
+
+    parser = argparse.ArgumentParser(description="Run the microbenchmark suite")
+    parser.add_argument('--sizes', default='1000,10000', help="comma separated numbers of posts")
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--only', help="comma separated names of benchmarks to run")
+    parser.add_argument('--output', help="file to save the results in as JSON")
+    parser.add_argument('--baseline', help="JSON results of an earlier run to compare with")
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help="fraction slower than the baseline that counts as a regression")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    only = args.only.split(',') if args.only else None
+    current = run(sizes, args.rounds, only)
+
+    if args.output:
+        with open(args.output, 'w') as out:
+            json.dump(current, out, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.threshold)
+        if regressions:
+            print("%d benchmarks regressed by more than %.0f%%: %s"
+                  % (len(regressions), args.threshold * 100, ', '.join(regressions)))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(suite())
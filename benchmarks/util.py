@@ -0,0 +1,85 @@
+"""
+Helpers shared by the benchmark scripts
+"""
+
+import io
+import os
+import sys
+import tempfile
+import time
+from wsgiref.util import setup_testing_defaults
+
+# benchmarks are run as python -m benchmarks.xxx from the project directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import COMP249Db, gentext
+import indexing
+
+
+def make_database(random=True):
+    """Create a database file in a temporary directory filled with
+    sample data, return the path to the file"""
+
+    dirname = tempfile.mkdtemp(prefix='psstbench')
+    path = os.path.join(dirname, 'bench.db')
+    db = COMP249Db(path)
+    db.create_tables()
+    db.sample_data(random=random)
+    db.close()
+    return path
+
+
+def add_posts(path, count, batch_size=10000):
+    """Add count random posts by the sample users to the database
+    at path and rebuild the derived tables"""
+
+    db = COMP249Db(path)
+    cursor = db.cursor()
+    cursor.execute("SELECT nick FROM users")
+    nicks = [row[0] for row in cursor.fetchall()]
+    mentions = ['@' + nick for nick in nicks]
+
+    start = time.time()
+    for offset in range(0, count, batch_size):
+        rows = []
+        for i in range(offset, min(count, offset + batch_size)):
+            nick = nicks[i % len(nicks)]
+            timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(start - i * 60))
+            rows.append((nick, timestamp, gentext(nick, mentions)))
+        cursor.executemany("INSERT INTO posts (usernick, timestamp, content) VALUES (?, ?, ?)", rows)
+        db.commit()
+
+    indexing.reindex(db)
+    db.close()
+
+
+def wsgi_get(app, path, headers=None):
+    """Make a GET request for path to the WSGI application app,
+    return a tuple (status, headers, body)"""
+
+    environ = {'PATH_INFO': path, 'REQUEST_METHOD': 'GET', 'wsgi.input': io.BytesIO()}
+    if headers:
+        for name, value in headers.items():
+            environ['HTTP_' + name.upper().replace('-', '_')] = value
+    setup_testing_defaults(environ)
+
+    result = {}
+
+    def start_response(status, headerlist, exc_info=None):
+        result['status'] = status
+        result['headers'] = headerlist
+
+    chunks = app(environ, start_response)
+    body = b''.join(chunks)
+    if hasattr(chunks, 'close'):
+        chunks.close()
+    return result['status'], result['headers'], body
+
+
+def rate(func, count):
+    """Call func count times, return the number of calls per second"""
+
+    start = time.perf_counter()
+    for i in range(count):
+        func()
+    return count / (time.perf_counter() - start)
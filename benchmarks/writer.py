@@ -0,0 +1,68 @@
+"""
+Posts added per second by many threads calling post_add at once, with
+each thread committing its own posts and with the group-commit writer,
+and the slowest post_add and number that failed in each case
+
+    python -m benchmarks.writer [posts] [threads]
+"""
+
+import sqlite3
+import sys
+import threading
+import time
+
+from benchmarks.util import make_database
+
+import config
+import interface
+import writer
+from database import COMP249Db, get_pool
+
+
+def run(dbname, posts, threads):
+    """Add posts posts from threads threads, return (posts/s, max seconds, failures)"""
+
+    pool = get_pool(dbname)
+    slowest = [0.0]
+    failures = [0]
+
+    def add(count):
+        for i in range(count):
+            db = COMP249Db(dbname, pool=pool)
+            start = time.perf_counter()
+            try:
+                if interface.post_add(db, 'Bean', 'benchmark post %d @Contrary #bench' % i) is None:
+                    failures[0] += 1
+            except (sqlite3.OperationalError, writer.WriteTimeout):
+                # database is locked or the write waited too long
+                failures[0] += 1
+            slowest[0] = max(slowest[0], time.perf_counter() - start)
+            db.close()
+
+    workers = [threading.Thread(target=add, args=(posts // threads,)) for i in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return posts / (time.perf_counter() - start), slowest[0], failures[0]
+
+
+def benchmark(posts=2000, threads=16):
+
+    saved = config.WRITE_QUEUE
+    print("%-8s %-6s %-8s %10s %10s %9s" % ("threads", "sync", "queue", "posts/s", "max ms", "failures"))
+    for synchronous in ('NORMAL', 'FULL'):
+        config.DB_SYNCHRONOUS = synchronous
+        for nthreads in (1, threads):
+            for queue in (0, 1):
+                config.WRITE_QUEUE = queue
+                # a new file each time so the writer and pool use the synchronous level
+                dbname = make_database()
+                rate, slowest, failures = run(dbname, posts, nthreads)
+                print("%-8d %-6s %-8s %10.0f %10.1f %9d" % (nthreads, synchronous, bool(queue), rate, slowest * 1000, failures))
+    config.WRITE_QUEUE = saved
+
+
+if __name__ == '__main__':
+    benchmark(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,64 @@
+"""
+A small thread safe in-process cache with a bounded size and
+per-entry expiry times.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache():
+    """
+    Map keys to values for up to ttl seconds each, holding at most
+    maxsize entries.  When full the least recently used entry is
+    discarded.
+    """
+
+    def __init__(self, maxsize, ttl):
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the value for key or default if it is not present
+        or has expired"""
+
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires = item
+            if expires <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Store value for key for ttl seconds (default the cache ttl)"""
+
+        if ttl is None:
+            ttl = self.ttl
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        """Remove key if it is present"""
+
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Remove everything"""
+
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
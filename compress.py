@@ -0,0 +1,205 @@
+"""
+Gzip compression of responses.
+
+GzipMiddleware compresses the responses of a WSGI application for
+clients that accept gzip.  The body is compressed a chunk at a time as
+the application produces it, each chunk flushed so that a streamed
+response reaches the client as it is made.  Small responses, responses
+that are compressed already (images, or static files with a
+Content-Encoding), ones marked Cache-Control: no-transform and ones
+written with the write() callable of start_response are sent as they
+are.
+
+Compressing a page costs more than serving it from the page cache, so
+the compressed bodies of complete responses with a strong ETag are
+kept and reused for the same ETag, which by definition identifies the
+same bytes.
+"""
+
+import zlib
+
+import config
+from cache import TTLCache
+
+
+# types worth compressing, others (images, fonts) are compressed already
+COMPRESSIBLE = ('text/', 'application/javascript', 'application/json', 'application/xml',
+                'application/x-ndjson', 'image/svg+xml')
+
+
+def compressible(content_type):
+    return content_type.startswith(COMPRESSIBLE)
+
+
+def accepts_gzip(accept_encoding):
+    """Return True if an Accept-Encoding header value allows gzip"""
+
+    for item in (accept_encoding or '').split(','):
+        coding, _, params = item.partition(';')
+        if coding.strip().lower() not in ('gzip', '*'):
+            continue
+        params = params.replace(' ', '')
+        if params.startswith('q='):
+            try:
+                return float(params[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+def _header(headers, name):
+    """Return the value of header name from a WSGI header list, or None"""
+
+    name = name.lower()
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+class GzipMiddleware():
+    """WSGI middleware compressing the responses of app with gzip at
+    level (default config.GZIP_LEVEL, 0 for none), leaving bodies
+    shorter than min_size bytes (default config.GZIP_MIN_SIZE) alone"""
+
+    def __init__(self, app, level=None, min_size=None):
+
+        self.app = app
+        self.level = config.GZIP_LEVEL if level is None else level
+        self.min_size = config.GZIP_MIN_SIZE if min_size is None else min_size
+        # (ETag, level) -> compressed body
+        self.cache = TTLCache(config.GZIP_CACHE_SIZE, 3600)
+
+    def __call__(self, environ, start_response):
+
+        if self.level <= 0 or not accepts_gzip(environ.get('HTTP_ACCEPT_ENCODING')):
+            return self.app(environ, start_response)
+
+        response = {'started': False}
+
+        def start_later(status, headers, exc_info=None):
+            if exc_info is not None and response['started']:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response['status'] = status
+            response['headers'] = headers
+            return write
+
+        def write(data):
+            # an application using write() has its response sent as it is
+            if not response['started']:
+                response['write'] = start_response(response['status'], response['headers'])
+                response['started'] = True
+            if 'write' not in response:
+                raise AssertionError("write() called after the body was started")
+            response['write'](data)
+
+        body = self.app(environ, start_later)
+        if 'write' in response:
+            return body
+
+        # most applications have made the whole body already, compress
+        # it in one go so it can be sent with a Content-Length
+        if 'status' in response and isinstance(body, (list, tuple)):
+            status, headers = response['status'], response['headers']
+            if (not self.should_compress(environ, status, headers) or
+                    sum(len(chunk) for chunk in body) < self.min_size):
+                start_response(status, headers)
+                return body
+            data = self.compress_all(body, _header(headers, 'ETag'))
+            headers = self.compressed_headers(headers)
+            headers.append(('Content-Length', str(len(data))))
+            start_response(status, headers)
+            return [data]
+
+        return self.stream(environ, body, response, start_response)
+
+    def stream(self, environ, body, response, start_response):
+        """Generate the compressed chunks of body as they are made,
+        response holds the status and headers given by the application"""
+
+        compressor = None
+        try:
+            for chunk in body:
+                if not response['started']:
+                    status, headers = response['status'], response['headers']
+                    if self.should_compress(environ, status, headers):
+                        compressor = self.compressor()
+                        headers = self.compressed_headers(headers)
+                    start_response(status, headers)
+                    response['started'] = True
+                if compressor is None:
+                    yield chunk
+                elif chunk:
+                    yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+            if not response['started']:
+                # an empty body
+                start_response(response['status'], response['headers'])
+            elif compressor is not None:
+                yield compressor.flush()
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+
+    def compress_all(self, body, etag):
+        """Return the list of chunks body compressed, reusing the
+        compressed copy of a body with the same strong etag"""
+
+        key = None
+        if etag is not None and not etag.startswith('W/'):
+            key = (etag, self.level)
+            data = self.cache.get(key)
+            if data is not None:
+                return data
+
+        compressor = self.compressor()
+        data = b''.join(compressor.compress(chunk) for chunk in body) + compressor.flush()
+        if key is not None:
+            self.cache.set(key, data)
+        return data
+
+    def compressor(self):
+        # wbits of 16 + MAX_WBITS writes a gzip header and trailer
+        return zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def should_compress(self, environ, status, headers):
+        """Return True if a response with status and headers should be compressed"""
+
+        if environ.get('REQUEST_METHOD') == 'HEAD' or not status.startswith('2') or status.startswith('204'):
+            return False
+        if _header(headers, 'Content-Encoding') is not None:
+            return False
+        if not compressible(_header(headers, 'Content-Type') or ''):
+            return False
+        if 'no-transform' in (_header(headers, 'Cache-Control') or ''):
+            return False
+        length = _header(headers, 'Content-Length')
+        if length is not None and int(length) < self.min_size:
+            return False
+        return True
+
+    def compressed_headers(self, headers):
+        """Return headers changed to describe the compressed body"""
+
+        result = []
+        vary = None
+        for name, value in headers:
+            lower = name.lower()
+            if lower == 'content-length':
+                continue
+            if lower == 'vary':
+                vary = value
+                continue
+            if lower == 'etag' and not value.startswith('W/'):
+                # the compressed body is only equivalent to the original
+                value = 'W/' + value
+            result.append((name, value))
+
+        if vary is None:
+            vary = 'Accept-Encoding'
+        elif 'accept-encoding' not in vary.lower():
+            vary += ', Accept-Encoding'
+        result.append(('Vary', vary))
+        result.append(('Content-Encoding', 'gzip'))
+        return result
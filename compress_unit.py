@@ -0,0 +1,175 @@
+"""
+Tests for gzip compression of responses
+"""
+
+import gzip
+import unittest
+import zlib
+
+from compress import GzipMiddleware, accepts_gzip
+
+
+PAGE = b"<p>" + b"Hello world " * 200 + b"</p>"
+
+
+def make_app(body, content_type='text/html; charset=UTF-8', headers=()):
+    """Return a WSGI application sending body, a list or a generator function"""
+
+    def app(environ, start_response):
+        response_headers = [('Content-Type', content_type)] + list(headers)
+        if isinstance(body, list):
+            response_headers.append(('Content-Length', str(sum(len(chunk) for chunk in body))))
+            start_response('200 OK', response_headers)
+            return body
+        start_response('200 OK', response_headers)
+        return body()
+    return app
+
+
+def call(app, method='GET', accept='gzip, deflate'):
+    """Call app, return (status, headers dict, list of body chunks)"""
+
+    environ = {'REQUEST_METHOD': method, 'PATH_INFO': '/'}
+    if accept:
+        environ['HTTP_ACCEPT_ENCODING'] = accept
+    result = {}
+
+    def start_response(status, headers, exc_info=None):
+        result['status'] = status
+        result['headers'] = dict(headers)
+
+    body = app(environ, start_response)
+    chunks = list(body)
+    if hasattr(body, 'close'):
+        body.close()
+    return result['status'], result['headers'], chunks
+
+
+class GzipTests(unittest.TestCase):
+
+    def test_accepts_gzip(self):
+
+        self.assertTrue(accepts_gzip('gzip, deflate, br'))
+        self.assertTrue(accepts_gzip('deflate;q=1.0, gzip;q=0.5'))
+        self.assertTrue(accepts_gzip('*'))
+        self.assertFalse(accepts_gzip('gzip;q=0'))
+        self.assertFalse(accepts_gzip('identity'))
+        self.assertFalse(accepts_gzip(None))
+
+    def test_compressed(self):
+        """A complete body is compressed with a new Content-Length"""
+
+        app = GzipMiddleware(make_app([PAGE], headers=[('ETag', '"abc"'), ('Vary', 'Cookie')]), level=6)
+        status, headers, chunks = call(app)
+
+        self.assertEqual('gzip', headers['Content-Encoding'])
+        self.assertEqual(PAGE, gzip.decompress(b''.join(chunks)))
+        self.assertEqual(str(len(b''.join(chunks))), headers['Content-Length'])
+        self.assertLess(len(b''.join(chunks)), len(PAGE) // 10)
+        self.assertEqual('W/"abc"', headers['ETag'])
+        self.assertEqual('Cookie, Accept-Encoding', headers['Vary'])
+
+    def test_reuse(self):
+        """The compressed body is reused for the same strong ETag"""
+
+        app = GzipMiddleware(make_app([PAGE], headers=[('ETag', '"abc"')]))
+        first = call(app)[2]
+        self.assertEqual(1, len(app.cache))
+        self.assertIs(first[0], call(app)[2][0])
+
+        weak = GzipMiddleware(make_app([PAGE], headers=[('ETag', 'W/"abc"')]))
+        call(weak)
+        self.assertEqual(0, len(weak.cache))
+
+    def test_not_compressed(self):
+        """Responses are sent as they are when compression wouldn't help"""
+
+        short = b'<p>short</p>'
+        # (app, Accept-Encoding, body sent)
+        cases = [
+            (make_app([PAGE]), 'identity', PAGE),
+            (make_app([short]), 'gzip', short),
+            (make_app([PAGE], 'image/png'), 'gzip', PAGE),
+            (make_app([PAGE], headers=[('Cache-Control', 'no-transform')]), 'gzip', PAGE),
+        ]
+        for app, accept, body in cases:
+            status, headers, chunks = call(GzipMiddleware(app, level=6, min_size=1024), accept=accept)
+            self.assertEqual(body, b''.join(chunks))
+            self.assertNotIn('Content-Encoding', headers)
+
+        # compressed already by the application
+        compressed = gzip.compress(PAGE)
+        app = make_app([compressed], headers=[('Content-Encoding', 'gzip')])
+        status, headers, chunks = call(GzipMiddleware(app, level=6))
+        self.assertEqual(compressed, b''.join(chunks))
+
+        status, headers, chunks = call(GzipMiddleware(make_app([PAGE]), level=0))
+        self.assertNotIn('Content-Encoding', headers)
+
+        status, headers, chunks = call(GzipMiddleware(make_app([PAGE])), method='HEAD')
+        self.assertNotIn('Content-Encoding', headers)
+
+    def test_write(self):
+        """A body written with the write() callable is sent as it is"""
+
+        def app(environ, start_response):
+            write = start_response('200 OK', [('Content-Type', 'text/html; charset=UTF-8')])
+            write(PAGE[:100])
+            write(PAGE[100:])
+            return []
+
+        environ = {'REQUEST_METHOD': 'GET', 'HTTP_ACCEPT_ENCODING': 'gzip'}
+        written = []
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            started.append(dict(headers))
+            return written.append
+
+        chunks = list(GzipMiddleware(app, level=6)(environ, start_response))
+        self.assertEqual(PAGE, b''.join(written + chunks))
+        self.assertNotIn('Content-Encoding', started[0])
+
+    def test_short_without_length(self):
+        """A short body without a Content-Length isn't compressed"""
+
+        def app(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/html; charset=UTF-8')])
+            return [b'<p>short</p>']
+
+        status, headers, chunks = call(GzipMiddleware(app, level=6, min_size=1024))
+        self.assertEqual(b'<p>short</p>', b''.join(chunks))
+        self.assertNotIn('Content-Encoding', headers)
+
+    def test_streaming(self):
+        """A streamed body is compressed as each chunk is made"""
+
+        made = []
+
+        def body():
+            for i in range(3):
+                made.append(i)
+                yield b'{"chunk": %d}\n' % i
+
+        app = GzipMiddleware(make_app(body, 'application/x-ndjson'), level=6)
+        environ = {'REQUEST_METHOD': 'GET', 'HTTP_ACCEPT_ENCODING': 'gzip'}
+        started = []
+        chunks = app(environ, lambda status, headers, exc_info=None: started.append(dict(headers)))
+
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        for i, chunk in enumerate(chunks):
+            if i < 3:
+                # everything made so far can be decompressed already
+                self.assertEqual(i + 1, len(made))
+                self.assertEqual(b'{"chunk": %d}\n' % i, decompressor.decompress(chunk))
+            else:
+                decompressor.decompress(chunk)
+        chunks.close()
+
+        self.assertEqual('gzip', started[0]['Content-Encoding'])
+        self.assertNotIn('Content-Length', started[0])
+        self.assertTrue(decompressor.eof)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+"""
+Configuration settings for the Psst application.
+
+Each setting can be overridden with an environment variable of the
+same name prefixed by PSST_, eg. PSST_DB_POOL_SIZE=16
+"""
+
+import os
+
+
+def _setting(name, default):
+    """Return the value of setting name, taken from the environment
+    if present, converted to the type of default"""
+
+    value = os.environ.get('PSST_' + name)
+    if value is None:
+        return default
+    return type(default)(value)
+
+
+# the database file used by the web application
+DB_NAME = _setting('DB_NAME', 'comp249.db')
+
+# maximum number of open connections held by a connection pool
+DB_POOL_SIZE = _setting('DB_POOL_SIZE', 8)
+
+# 1 to run the queries of requests on read-only connections (a pool of up to
+# DB_POOL_SIZE of them), their changes going through the writer (see writer)
+DB_READ_ONLY = _setting('DB_READ_ONLY', 1)
+
+# seconds to wait for a free pooled connection before giving up
+DB_POOL_TIMEOUT = _setting('DB_POOL_TIMEOUT', 10.0)
+
+# milliseconds a connection waits for a lock before raising 'database is locked'
+DB_BUSY_TIMEOUT = _setting('DB_BUSY_TIMEOUT', 5000)
+
+# PRAGMA synchronous level, NORMAL is safe in WAL mode
+DB_SYNCHRONOUS = _setting('DB_SYNCHRONOUS', 'NORMAL')
+
+# PRAGMA cache_size, negative values are in KiB so this is 16MB per connection
+DB_CACHE_SIZE = _setting('DB_CACHE_SIZE', -16000)
+
+# number of rendered posts kept in memory for posts whose stored HTML is out of date
+RENDER_CACHE_SIZE = _setting('RENDER_CACHE_SIZE', 10000)
+
+# number of posts kept in each materialised home timeline
+TIMELINE_DEPTH = _setting('TIMELINE_DEPTH', 800)
+
+# posts by authors with more followers than this are merged into home timelines when read
+FANOUT_MAX_FOLLOWERS = _setting('FANOUT_MAX_FOLLOWERS', 5000)
+
+# seconds that a login session lasts
+SESSION_LIFETIME = _setting('SESSION_LIFETIME', 14 * 24 * 3600)
+
+# 'db' keeps sessions in the sessions table, 'signed' keeps them in an
+# HMAC signed cookie so that no database lookup is needed; signed
+# sessions can't be ended early on the server, only by changing SESSION_SECRET
+SESSION_MODE = _setting('SESSION_MODE', 'db')
+
+# key used to sign session cookies in 'signed' mode, must be set to use that mode
+SESSION_SECRET = _setting('SESSION_SECRET', '')
+
+# seconds that a session lookup is cached in memory and the maximum number cached;
+# in a multi-process server another process can show pages to a logged out user
+# for this long, requests that change something always check the sessions table
+SESSION_CACHE_TTL = _setting('SESSION_CACHE_TTL', 60.0)
+SESSION_CACHE_SIZE = _setting('SESSION_CACHE_SIZE', 10000)
+
+# seconds between runs of the expired session sweeper and rows deleted per transaction
+SESSION_SWEEP_INTERVAL = _setting('SESSION_SWEEP_INTERVAL', 600.0)
+SESSION_SWEEP_BATCH = _setting('SESSION_SWEEP_BATCH', 500)
+
+# password hashing method, 'pbkdf2_sha256' or 'scrypt', and its cost:
+# PBKDF2 iterations or the scrypt n parameter (with r and p)
+PASSWORD_HASHER = _setting('PASSWORD_HASHER', 'pbkdf2_sha256')
+PBKDF2_ITERATIONS = _setting('PBKDF2_ITERATIONS', 200000)
+SCRYPT_N = _setting('SCRYPT_N', 2 ** 14)
+SCRYPT_R = _setting('SCRYPT_R', 8)
+SCRYPT_P = _setting('SCRYPT_P', 1)
+
+# threads used to check passwords, how many more checks may wait for
+# one before logins are refused (never more than half of SERVER_THREADS
+# in all, as a request thread waits on each), and how long a check may
+# take in seconds
+LOGIN_WORKERS = _setting('LOGIN_WORKERS', 2)
+LOGIN_QUEUE_LIMIT = _setting('LOGIN_QUEUE_LIMIT', 2)
+LOGIN_TIMEOUT = _setting('LOGIN_TIMEOUT', 10.0)
+
+# 1 to record request latency and SQL metrics served at /metrics, 0 to turn them off
+METRICS = _setting('METRICS', 1)
+
+# number of rendered timeline pages kept in memory for visitors who aren't logged in, 0 for none
+PAGE_CACHE_SIZE = _setting('PAGE_CACHE_SIZE', 1000)
+
+# gzip compression level for responses, 1 (fastest) to 9 (smallest) or 0 for none,
+# and the smallest body in bytes worth compressing
+GZIP_LEVEL = _setting('GZIP_LEVEL', 6)
+GZIP_MIN_SIZE = _setting('GZIP_MIN_SIZE', 1024)
+
+# number of compressed responses kept to send again for the same ETag
+GZIP_CACHE_SIZE = _setting('GZIP_CACHE_SIZE', 256)
+
+# address that server.py listens on
+SERVER_HOST = _setting('SERVER_HOST', '127.0.0.1')
+SERVER_PORT = _setting('SERVER_PORT', 8080)
+
+# server.py worker processes (0 to serve from the launching process), threads
+# handling requests in each, seconds an idle keep-alive connection is kept,
+# and seconds a thread waits for the next request on its connection before
+# leaving it idle without a thread (no more than half the threads at once)
+SERVER_WORKERS = _setting('SERVER_WORKERS', os.cpu_count() or 1)
+SERVER_THREADS = _setting('SERVER_THREADS', 8)
+SERVER_KEEPALIVE = _setting('SERVER_KEEPALIVE', 5.0)
+SERVER_LINGER = _setting('SERVER_LINGER', 0.05)
+
+# 1 to send writes to one writer connection per database, the threads waiting
+# for them committing them in batches of up to WRITE_BATCH_SIZE, waiting
+# WRITE_BATCH_DELAY seconds after the first for more (with none, writes that
+# arrive during a commit make up the next batch); a write not started in
+# WRITE_TIMEOUT seconds is abandoned
+WRITE_QUEUE = _setting('WRITE_QUEUE', 1)
+WRITE_BATCH_SIZE = _setting('WRITE_BATCH_SIZE', 100)
+WRITE_BATCH_DELAY = _setting('WRITE_BATCH_DELAY', 0.0)
+WRITE_TIMEOUT = _setting('WRITE_TIMEOUT', 5.0)
+
+# a post's votes count for half as much in the top posts ranking for every
+# TOP_POSTS_HALF_LIFE seconds it is older than another; the ranking keeps the
+# best TOP_POSTS_SIZE posts and is refreshed every TOP_POSTS_INTERVAL seconds,
+# TOP_POSTS_BATCH changed posts per transaction
+TOP_POSTS_HALF_LIFE = _setting('TOP_POSTS_HALF_LIFE', 12 * 3600)
+TOP_POSTS_SIZE = _setting('TOP_POSTS_SIZE', 1000)
+TOP_POSTS_INTERVAL = _setting('TOP_POSTS_INTERVAL', 60.0)
+TOP_POSTS_BATCH = _setting('TOP_POSTS_BATCH', 1000)
+
+# changes applied on top of the in-memory follow graph before its arrays are
+# rebuilt, seconds between checks for follows made by other processes and
+# number of those changes kept in the database
+FOLLOW_GRAPH_COMPACT = _setting('FOLLOW_GRAPH_COMPACT', 10000)
+FOLLOW_GRAPH_SYNC = _setting('FOLLOW_GRAPH_SYNC', 1.0)
+FOLLOW_LOG_SIZE = _setting('FOLLOW_LOG_SIZE', 100000)
+
+# users followed by a user that are looked at for follow suggestions
+FOLLOW_SUGGEST_FRIENDS = _setting('FOLLOW_SUGGEST_FRIENDS', 200)
+
+# posts read by each query of the streaming JSON API
+API_BATCH_SIZE = _setting('API_BATCH_SIZE', 200)
+
+# posts queued for a /stream client before it is dropped as too slow, seconds
+# between keep-alive comments to idle clients and between checks for posts
+# added by other processes
+STREAM_BUFFER = _setting('STREAM_BUFFER', 100)
+STREAM_HEARTBEAT = _setting('STREAM_HEARTBEAT', 15.0)
+STREAM_POLL = _setting('STREAM_POLL', 1.0)
+
+# posts more than ARCHIVE_AGE days old are moved into monthly archive files
+# every ARCHIVE_INTERVAL seconds, ARCHIVE_BATCH at a time; each connection
+# keeps up to ARCHIVE_ATTACHED archives attached
+ARCHIVE_AGE = _setting('ARCHIVE_AGE', 365)
+ARCHIVE_INTERVAL = _setting('ARCHIVE_INTERVAL', 3600.0)
+ARCHIVE_BATCH = _setting('ARCHIVE_BATCH', 500)
+ARCHIVE_ATTACHED = _setting('ARCHIVE_ATTACHED', 6)
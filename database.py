@@ -4,10 +4,162 @@ Created on Mar 26, 2012
 @author: steve
 '''
 
+import os
 import sqlite3
+import threading
+import queue
 import time
+import urllib.parse
+import weakref
 from random import randint, choice
 
+import archive
+import config
+import indexing
+import metrics
+import migrations
+import passwords
+import votes
+
+
+def connect(dbname, readonly=False):
+    """Open a new connection to dbname configured for use by
+    the web application: WAL journal mode so that readers don't
+    block the writer, a busy timeout, a relaxed synchronous level
+    and a larger page cache.  If readonly is True the file is opened
+    read-only and the connection can't change anything"""
+
+    readonly = readonly and dbname != ':memory:'
+    if readonly:
+        uri = 'file:%s?mode=ro' % urllib.parse.quote(os.path.abspath(dbname))
+        conn = sqlite3.connect(uri, uri=True,
+                               timeout=config.DB_BUSY_TIMEOUT / 1000.0,
+                               check_same_thread=False)
+    else:
+        conn = sqlite3.connect(dbname,
+                               timeout=config.DB_BUSY_TIMEOUT / 1000.0,
+                               check_same_thread=False)
+    ### ensure that results returned from queries are strings rather
+    # than unicode which doesn't work well with WSGI
+    conn.text_factory = str
+
+    if readonly:
+        # set by the connections that write, it stays set in the file
+        conn.execute("PRAGMA query_only=1")
+    elif dbname != ':memory:':
+        conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA busy_timeout=%d" % config.DB_BUSY_TIMEOUT)
+    conn.execute("PRAGMA synchronous=%s" % config.DB_SYNCHRONOUS)
+    conn.execute("PRAGMA cache_size=%d" % config.DB_CACHE_SIZE)
+
+    return conn
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection became free in time"""
+
+
+class ConnectionPool():
+    """
+    A bounded pool of open connections to one database file.
+
+    Connections are opened lazily up to size and handed out most
+    recently used first so that a lightly loaded server keeps
+    reusing the same warm connection.  A connection may be used by
+    any thread but only by one thread at a time.
+    """
+
+    def __init__(self, dbname, size=config.DB_POOL_SIZE, readonly=False):
+
+        self.dbname = dbname
+        # an in-memory database belongs to a single connection, so
+        # sharing it means never opening a second one
+        if dbname == ':memory:':
+            size = 1
+            readonly = False
+        self.size = size
+        self.readonly = readonly
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._opened = 0
+
+    def acquire(self, timeout=config.DB_POOL_TIMEOUT):
+        """Return a connection from the pool, opening a new one
+        if none are idle and the pool is not full, otherwise wait
+        up to timeout seconds for one to be released"""
+
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            grow = self._opened < self.size
+            if grow:
+                self._opened += 1
+
+        if grow:
+            try:
+                return connect(self.dbname, self.readonly)
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise PoolTimeout("no connection to %s available" % self.dbname)
+
+    def release(self, conn):
+        """Return a connection to the pool, abandoning any
+        transaction that the borrower left open"""
+
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def close(self):
+        """Close all idle connections"""
+
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(dbname=config.DB_NAME, readonly=False):
+    """Return the shared connection pool for dbname, creating it
+    on first use, the pool of read-only connections if readonly is True"""
+
+    key = (dbname, readonly and dbname != ':memory:')
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(dbname, readonly=key[1])
+        return _pools[key]
+
+
+def _forget_pools():
+    """Drop the pools inherited by a forked child process without
+    closing them, a SQLite connection must not be used across a fork
+    so the child opens its own connections as it needs them"""
+
+    global _pools, _pools_lock
+    _pools = {}
+    _pools_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_pools)
+
 
 class COMP249Db():
     '''
@@ -15,47 +167,137 @@ class COMP249Db():
     '''
 
 
-    def __init__(self, dbname="comp249.db"):
+    def __init__(self, dbname=config.DB_NAME, pool=None, readonly=False):
         '''
-        Constructor
+        Constructor, if pool is given the connection is borrowed
+        from it and given back by close(), otherwise a new connection
+        is opened.
+
+        If readonly is True, or pool is a pool of read-only
+        connections, queries are run on a read-only connection and
+        changes are made on a second connection (see write_cursor),
+        borrowed from the read-write pool if pool is given
         '''
         
         self.dbname = dbname
-        self.conn = sqlite3.connect(self.dbname)
-        ### ensure that results returned from queries are strings rather
-        # than unicode which doesn't work well with WSGI
-        self.conn.text_factory = str
-        
+        self.pool = pool
+        if pool is not None:
+            self.readonly = pool.readonly
+            self.conn = pool.acquire()
+        else:
+            self.readonly = readonly and dbname != ':memory:'
+            self.conn = connect(self.dbname, self.readonly)
+        self._write_conn = None
+        # the cursors handed out by cursor(), see wrote()
+        self._cursors = weakref.WeakSet()
+
+    def close(self):
+        """Finish with the database, returning the connection to
+        the pool if it was borrowed from one"""
+
+        if self.conn is None:
+            return
+        if self._write_conn is not None:
+            if self.pool is not None:
+                get_pool(self.dbname).release(self._write_conn)
+            else:
+                self._write_conn.close()
+            self._write_conn = None
+        if self.pool is not None:
+            self.pool.release(self.conn)
+        else:
+            self.conn.close()
+        self.conn = None
+
+    def _cursor(self, conn):
+        # one that times its queries if metrics are being recorded
+        if config.METRICS:
+            return conn.cursor(metrics.TimedCursor)
+        return conn.cursor()
+
     def cursor(self):
-        """Return a cursor on the database"""
-        
-        return self.conn.cursor()
+        """Return a cursor on the database, one that times its
+        queries if metrics are being recorded"""
+
+        cursor = self._cursor(self.conn)
+        self._cursors.add(cursor)
+        return cursor
+
+    def write_cursor(self):
+        """Return a cursor for making changes, committed by commit().
+        Changes made by the web application go through writer.write
+        instead"""
+
+        if not self.readonly:
+            return self.cursor()
+        if self._write_conn is None:
+            if self.pool is not None:
+                self._write_conn = get_pool(self.dbname).acquire()
+            else:
+                self._write_conn = connect(self.dbname)
+        return self._cursor(self._write_conn)
     
     def commit(self):
         """Commit pending changes"""
-        
+
+        if self._write_conn is not None:
+            self._write_conn.commit()
         self.conn.commit()
+
+    def rollback(self):
+        """Discard pending changes"""
+
+        if self._write_conn is not None:
+            self._write_conn.rollback()
+        self.conn.rollback()
+
+    def pending(self):
+        """Return True if changes have been made that aren't committed"""
+
+        if self.readonly:
+            return self._write_conn is not None and self._write_conn.in_transaction
+        return self.conn.in_transaction
+
+    def wrote(self):
+        """Make the queries that follow see changes just committed by
+        another connection (eg. the writer's).  A cursor part way
+        through the rows of a query keeps its connection reading the
+        database as it was when the query started, so each cursor is
+        given a query without rows to finish it"""
+
+        for cursor in list(self._cursors):
+            try:
+                # not counted in the metrics
+                sqlite3.Cursor.execute(cursor, "SELECT 1 WHERE 0")
+            except sqlite3.ProgrammingError:
+                # closed
+                pass
         
     def delete(self):
         """Destroy the database file"""
         pass
         
         
-    def crypt(self, password):
+    def crypt(self, password, cost=None):
         """Return a one-way hashed version of the password suitable for
-        storage in the database"""
-        
-        import hashlib
+        storage in the database, cost overrides the configured cost
+        of the hash function (see passwords)"""
         
-        return hashlib.sha1(password.encode()).hexdigest()
+        return passwords.hash_password(password, cost=cost)
         
 
     def create_tables(self):
         """Create and initialise the database tables
         This will have the effect of overwriting any existing
-        data."""
-        
+        data.  The tables are created at the latest schema version,
+        use migrations.migrate to upgrade an existing database."""
         
+        # remove every table, including those added by migrations
+        cursor = self.cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")
+        for (name,) in cursor.fetchall():
+            cursor.execute('DROP TABLE IF EXISTS "%s"' % name)
+
         sql = """
 DROP TABLE IF EXISTS users;
 CREATE TABLE users (
@@ -101,6 +343,8 @@ CREATE TABLE follows (
 
         self.conn.executescript(sql)
         self.conn.commit()
+
+        migrations.migrate(self)
         
     
     def sample_data(self, random=True):
@@ -124,11 +368,16 @@ CREATE TABLE follows (
         cursor = self.cursor()
         cursor.execute("DELETE FROM users")
         cursor.execute("DELETE FROM posts")
+        cursor.execute("DELETE FROM follows")
+        indexing.clear(cursor)
+        votes.clear(cursor)
+        archive.clear(cursor)
 
-        # create one entry for each user
+        # create one entry for each user, with the cheapest password
+        # hashes so that tests run quickly, they are upgraded on login
         for password, nick, avatar in self.users:
             sql = "INSERT INTO users (nick, password, avatar) VALUES (?, ?, ?)"
-            cursor.execute(sql, (nick, self.crypt(password), avatar))
+            cursor.execute(sql, (nick, self.crypt(password, passwords.minimum_cost()), avatar))
             sql = "INSERT INTO follows (followed, follower) VALUES (?, ?)"
             cursor.execute(sql, [nick, nick])
 
@@ -154,6 +403,7 @@ CREATE TABLE follows (
                 sql = "INSERT INTO posts (usernick, timestamp, content) VALUES (?, ?, ?)"
 
                 cursor.execute(sql, (user[1], timestamp, content))
+                indexing.index_post(cursor, cursor.lastrowid, timestamp, user[1], content)
 
                 # increment the time we subtract
                 t += 3013
@@ -181,11 +431,9 @@ CREATE TABLE follows (
 
         cursor = self.cursor()
 
-        for post in self.posts:
-
-            sql = "INSERT INTO posts (id, timestamp, usernick, content) VALUES (?, ?, ?, ?)"
-
-            cursor.execute(sql, post)
+        sql = "INSERT INTO posts (id, timestamp, usernick, content) VALUES (?, ?, ?, ?)"
+        cursor.executemany(sql, self.posts)
+        indexing.index_posts(cursor, self.posts)
 
         # commit all updates to the database
         self.commit()
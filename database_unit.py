@@ -0,0 +1,148 @@
+"""
+Tests for connection handling in the database module
+"""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+import interface
+from database import COMP249Db, ConnectionPool, PoolTimeout, get_pool
+
+
+class ConnectionPoolTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.dbname = os.path.join(self.dir, 'test.db')
+        db = COMP249Db(self.dbname)
+        db.create_tables()
+        db.sample_data(random=False)
+        db.close()
+        self.pool = ConnectionPool(self.dbname, size=2)
+
+    def tearDown(self):
+        self.pool.close()
+        shutil.rmtree(self.dir)
+
+    def test_connection_reused(self):
+        """A released connection is handed out again"""
+
+        db = COMP249Db(self.dbname, pool=self.pool)
+        conn = db.conn
+        db.close()
+
+        db = COMP249Db(self.dbname, pool=self.pool)
+        self.assertIs(conn, db.conn)
+        db.close()
+
+    def test_pragmas(self):
+        """Pooled connections use WAL mode and the busy timeout"""
+
+        db = COMP249Db(self.dbname, pool=self.pool)
+        cursor = db.cursor()
+        cursor.execute("PRAGMA journal_mode")
+        self.assertEqual('wal', cursor.fetchone()[0])
+        cursor.execute("PRAGMA busy_timeout")
+        self.assertGreater(cursor.fetchone()[0], 0)
+        db.close()
+
+    def test_pool_size(self):
+        """No more than size connections are handed out"""
+
+        db1 = COMP249Db(self.dbname, pool=self.pool)
+        db2 = COMP249Db(self.dbname, pool=self.pool)
+        self.assertIsNot(db1.conn, db2.conn)
+
+        self.assertRaises(PoolTimeout, self.pool.acquire, 0.01)
+
+        # releasing one from another thread wakes up a waiting borrower
+        threading.Timer(0.05, db1.close).start()
+        conn = self.pool.acquire(5)
+        self.pool.release(conn)
+        db2.close()
+
+    def test_release_rolls_back(self):
+        """Uncommitted changes are discarded when a connection is returned"""
+
+        db = COMP249Db(self.dbname, pool=self.pool)
+        db.cursor().execute("DELETE FROM posts")
+        db.close()
+
+        db = COMP249Db(self.dbname, pool=self.pool)
+        cursor = db.cursor()
+        cursor.execute("SELECT count(*) FROM posts")
+        self.assertEqual(10, cursor.fetchone()[0])
+        db.close()
+
+
+class RoutingTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.dbname = os.path.join(self.dir, 'test.db')
+        db = COMP249Db(self.dbname)
+        db.create_tables()
+        db.sample_data(random=False)
+        db.close()
+
+    def tearDown(self):
+        get_pool(self.dbname).close()
+        get_pool(self.dbname, readonly=True).close()
+        shutil.rmtree(self.dir)
+
+    def test_read_only(self):
+        """Queries can't change anything, changes go to a second connection"""
+
+        db = COMP249Db(self.dbname, pool=get_pool(self.dbname, readonly=True))
+        self.assertTrue(db.readonly)
+        self.assertRaises(sqlite3.OperationalError, db.cursor().execute, "DELETE FROM posts")
+
+        db.write_cursor().execute("DELETE FROM posts WHERE id = 1")
+        self.assertTrue(db.pending())
+        db.commit()
+        self.assertFalse(db.pending())
+        cursor = db.cursor()
+        cursor.execute("SELECT count(*) FROM posts")
+        self.assertEqual(9, cursor.fetchone()[0])
+        db.close()
+
+        # the write connection went back to the read-write pool
+        self.assertEqual(1, get_pool(self.dbname)._idle.qsize())
+
+    def test_read_your_writes(self):
+        """A post added by the writer is seen by the next query, even
+        with a query part way through on the same connection"""
+
+        db = COMP249Db(self.dbname, pool=get_pool(self.dbname, readonly=True))
+        unfinished = db.cursor()
+        unfinished.execute("SELECT id FROM posts")
+        unfinished.fetchone()
+
+        post_id = interface.post_add(db, 'Bean', 'just now')
+        self.assertEqual(post_id, interface.post_list(db, limit=1)[0][0])
+        # the cursor can still be used
+        unfinished.execute("SELECT count(*) FROM posts")
+        self.assertEqual(11, unfinished.fetchone()[0])
+        db.close()
+
+    def test_rollback(self):
+        """A failed bulk load leaves nothing for the next commit"""
+
+        db = COMP249Db(self.dbname, pool=get_pool(self.dbname, readonly=True))
+        posts = [('Bean', None, 'one'), ('Bean', None, 'two'), ('Bean', None, ['not', 'text'])]
+        self.assertRaises(sqlite3.Error, interface.post_add_many, db, posts)
+        self.assertFalse(db.pending())
+
+        interface.post_add_many(db, [])
+        cursor = db.cursor()
+        cursor.execute("SELECT count(*) FROM posts")
+        self.assertEqual(10, cursor.fetchone()[0])
+        db.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+"""
+A Bottle plugin that passes a database connection to any route
+callback that has a 'db' argument, eg.
+
+    @application.route('/')
+    def index(db):
+        ...
+
+The connection is borrowed from a shared pool before the callback
+runs and returned when it finishes.
+"""
+
+import inspect
+
+from database import COMP249Db, get_pool
+import config
+
+
+class COMP249DbPlugin():
+
+    name = 'comp249db'
+    api = 2
+
+    def __init__(self, dbname=config.DB_NAME, keyword='db', pooled=True):
+        """dbname is the database file, keyword the name of the
+        callback argument, if pooled is False a new connection is
+        opened for every request"""
+
+        self.dbname = dbname
+        self.keyword = keyword
+        self.pooled = pooled
+
+    def setup(self, app):
+        """Make sure no other installed plugin uses the same keyword"""
+
+        for other in app.plugins:
+            if isinstance(other, COMP249DbPlugin) and other.keyword == self.keyword:
+                raise RuntimeError("Another database plugin uses the keyword '%s'" % self.keyword)
+
+    def open(self):
+        """Return a COMP249Db for one request, reading through a
+        read-only connection if config.DB_READ_ONLY is set"""
+
+        if self.pooled:
+            return COMP249Db(self.dbname, pool=get_pool(self.dbname, readonly=config.DB_READ_ONLY))
+        return COMP249Db(self.dbname, readonly=config.DB_READ_ONLY)
+
+    def apply(self, callback, route):
+
+        params = inspect.signature(route.get_undecorated_callback()).parameters
+        if self.keyword not in params:
+            return callback
+
+        def wrapper(*args, **kwargs):
+            db = self.open()
+            kwargs[self.keyword] = db
+            try:
+                return callback(*args, **kwargs)
+            finally:
+                db.close()
+
+        return wrapper
@@ -0,0 +1,343 @@
+"""
+The follow graph held in memory.
+
+Who follows whom is read from the follows table into compressed sparse
+row arrays: users are numbered, and the users that user i follows are
+the sorted numbers targets[offsets[i]:offsets[i + 1]], with another
+pair of arrays for followers.  At 4 bytes an entry a million follows
+take about 8MB, counting a user's followers is a subtraction and
+checking whether one user follows another a binary search.  Users
+following themselves (see database.sample_data) are left out.
+
+Follows and unfollows are applied on top of the arrays as sets of
+added and removed entries per user, which are merged into new arrays
+once there are config.FOLLOW_GRAPH_COMPACT of them.  Each change is
+also recorded in the follow_changes table, and get_graph applies the
+changes that other processes have made since it last looked, at most
+every config.FOLLOW_GRAPH_SYNC seconds.
+"""
+
+import bisect
+import heapq
+import threading
+import time
+from array import array
+from collections import Counter
+
+import config
+
+
+class Adjacency():
+    """The neighbours of each of a numbered set of nodes, in one
+    direction, as CSR arrays with pending changes on top"""
+
+    def __init__(self, size=0, keys=()):
+        """keys is a sorted list with node * size + neighbour for each
+        neighbour of each node, nodes and neighbours less than size"""
+
+        self.size = size
+        self.targets = array('i', [key % size for key in keys])
+        # where the keys of each node start
+        self.offsets = array('i', [bisect.bisect_left(keys, node * size) for node in range(size + 1)])
+        # node -> set of neighbours added or removed since the arrays were built
+        self.added = {}
+        self.removed = {}
+        self.changes = 0
+
+    def _row(self, node):
+        """Return (start, end) of node's neighbours in targets"""
+
+        if node >= self.size:
+            return 0, 0
+        return self.offsets[node], self.offsets[node + 1]
+
+    def neighbours(self, node):
+        """Return a list of node's neighbours"""
+
+        start, end = self._row(node)
+        result = self.targets[start:end].tolist()
+        removed = self.removed.get(node)
+        if removed:
+            result = [neighbour for neighbour in result if neighbour not in removed]
+        added = self.added.get(node)
+        if added:
+            result.extend(added)
+        return result
+
+    def count(self, node):
+        start, end = self._row(node)
+        return end - start - len(self.removed.get(node, ())) + len(self.added.get(node, ()))
+
+    def contains(self, node, neighbour):
+
+        if neighbour in self.added.get(node, ()):
+            return True
+        if neighbour in self.removed.get(node, ()):
+            return False
+        start, end = self._row(node)
+        position = bisect.bisect_left(self.targets, neighbour, start, end)
+        return position < end and self.targets[position] == neighbour
+
+    def add(self, node, neighbour):
+        """Add neighbour to node, return False if it was there already"""
+
+        if self.contains(node, neighbour):
+            return False
+        removed = self.removed.get(node)
+        if removed and neighbour in removed:
+            removed.discard(neighbour)
+        else:
+            self.added.setdefault(node, set()).add(neighbour)
+        self.changes += 1
+        return True
+
+    def remove(self, node, neighbour):
+        """Remove neighbour from node, return False if it wasn't there"""
+
+        if not self.contains(node, neighbour):
+            return False
+        added = self.added.get(node)
+        if added and neighbour in added:
+            added.discard(neighbour)
+        else:
+            self.removed.setdefault(node, set()).add(neighbour)
+        self.changes += 1
+        return True
+
+    def compact(self, size):
+        """Return a new Adjacency of size nodes with the changes merged in"""
+
+        return Adjacency(size, [node * size + neighbour for node in range(size)
+                                for neighbour in sorted(self.neighbours(node))])
+
+    def nbytes(self):
+        """Return the bytes used by the arrays"""
+
+        return (len(self.offsets) * self.offsets.itemsize + len(self.targets) * self.targets.itemsize)
+
+
+class FollowGraph():
+    """Who follows whom, by nick"""
+
+    def __init__(self):
+
+        self.ids = {}
+        self.nicks = []
+        self.following = Adjacency()
+        self.followers = Adjacency()
+        # the last follow_changes row applied
+        self.last_change = 0
+        # changes when the tables are made again, eg. by create_tables
+        self.schema = None
+        self.synced = 0
+        self._lock = threading.RLock()
+
+    def load(self, cursor):
+        """Read the whole graph from the database"""
+
+        cursor.execute("PRAGMA schema_version")
+        schema = cursor.fetchone()[0]
+        cursor.execute("SELECT max(id) FROM follow_changes")
+        last_change = cursor.fetchone()[0] or 0
+
+        cursor.execute("SELECT nick FROM users")
+        nicks = {row[0] for row in cursor.fetchall()}
+        cursor.execute("SELECT follower, followed FROM follows WHERE follower != followed")
+        rows = cursor.fetchall()
+        for follower, followed in rows:
+            nicks.add(follower)
+            nicks.add(followed)
+        nicks = sorted(nicks)
+        ids = {nick: i for i, nick in enumerate(nicks)}
+
+        # sorting one integer per follow is much quicker than sorting
+        # pairs, or than asking SQLite for them in order
+        size = len(nicks)
+        keys = sorted({ids[follower] * size + ids[followed] for follower, followed in rows})
+        del rows
+        following = Adjacency(size, keys)
+        followers = Adjacency(size, sorted([(key % size) * size + key // size for key in keys]))
+
+        with self._lock:
+            self.ids = ids
+            self.nicks = nicks
+            self.following = following
+            self.followers = followers
+            self.last_change = last_change
+            self.schema = schema
+            self.synced = time.monotonic()
+
+    def sync(self, cursor):
+        """Apply the changes recorded in follow_changes since the last
+        load or sync, reloading if some have been pruned already or
+        the tables have been made again"""
+
+        with self._lock:
+            cursor.execute("PRAGMA schema_version")
+            if cursor.fetchone()[0] != self.schema:
+                self.load(cursor)
+                return
+            cursor.execute("SELECT id, follower, followed, added FROM follow_changes WHERE id > ? ORDER BY id",
+                           (self.last_change,))
+            changes = cursor.fetchall()
+            if changes and changes[0][0] != self.last_change + 1:
+                # pruned before this process saw them
+                self.load(cursor)
+                return
+            for change_id, follower, followed, added in changes:
+                if added:
+                    self.follow(follower, followed)
+                else:
+                    self.unfollow(follower, followed)
+                self.last_change = change_id
+            self.synced = time.monotonic()
+
+    def _id(self, nick, create=False):
+        """Return the number of nick, None if it isn't known unless create is True"""
+
+        node = self.ids.get(nick)
+        if node is None and create:
+            node = self.ids[nick] = len(self.nicks)
+            self.nicks.append(nick)
+        return node
+
+    def follow(self, follower, followed):
+        """Record that follower follows followed, return False if they did already"""
+
+        if follower == followed:
+            return False
+        with self._lock:
+            a = self._id(follower, create=True)
+            b = self._id(followed, create=True)
+            if not self.following.add(a, b):
+                return False
+            self.followers.add(b, a)
+            self._maybe_compact()
+            return True
+
+    def unfollow(self, follower, followed):
+        """Record that follower no longer follows followed, return False if they didn't"""
+
+        with self._lock:
+            a = self._id(follower)
+            b = self._id(followed)
+            if a is None or b is None or not self.following.remove(a, b):
+                return False
+            self.followers.remove(b, a)
+            self._maybe_compact()
+            return True
+
+    def _maybe_compact(self):
+
+        if self.following.changes >= config.FOLLOW_GRAPH_COMPACT:
+            self.following = self.following.compact(len(self.nicks))
+            self.followers = self.followers.compact(len(self.nicks))
+
+    def following_count(self, nick):
+        with self._lock:
+            node = self._id(nick)
+            return 0 if node is None else self.following.count(node)
+
+    def follower_count(self, nick):
+        with self._lock:
+            node = self._id(nick)
+            return 0 if node is None else self.followers.count(node)
+
+    def following_list(self, nick):
+        """Return the sorted nicks of the users that nick follows"""
+
+        with self._lock:
+            node = self._id(nick)
+            if node is None:
+                return []
+            return sorted(self.nicks[other] for other in self.following.neighbours(node))
+
+    def follower_list(self, nick):
+        """Return the sorted nicks of the users that follow nick"""
+
+        with self._lock:
+            node = self._id(nick)
+            if node is None:
+                return []
+            return sorted(self.nicks[other] for other in self.followers.neighbours(node))
+
+    def follows(self, follower, followed):
+        """Return True if follower follows followed"""
+
+        with self._lock:
+            a = self._id(follower)
+            b = self._id(followed)
+            return a is not None and b is not None and self.following.contains(a, b)
+
+    def mutual(self, nick, other):
+        """Return True if nick and other follow each other"""
+
+        return self.follows(nick, other) and self.follows(other, nick)
+
+    def suggestions(self, nick, limit=10, max_friends=None):
+        """Return up to limit (nick, count) pairs for the users followed
+        by the most of the users that nick follows, who nick doesn't
+        follow, most in common first, then most followers.  Only the
+        first max_friends (default config.FOLLOW_SUGGEST_FRIENDS) users
+        that nick follows are looked at"""
+
+        if max_friends is None:
+            max_friends = config.FOLLOW_SUGGEST_FRIENDS
+        with self._lock:
+            node = self._id(nick)
+            if node is None:
+                return []
+            friends = self.following.neighbours(node)[:max_friends]
+            counts = Counter()
+            for friend in friends:
+                counts.update(self.following.neighbours(friend))
+            counts.pop(node, None)
+            for friend in self.following.neighbours(node):
+                counts.pop(friend, None)
+
+            followers = self.followers
+            best = heapq.nlargest(limit, counts.items(),
+                                  key=lambda item: (item[1], followers.count(item[0])))
+            return [(self.nicks[other], count) for other, count in best]
+
+    def nbytes(self):
+        """Return the bytes used by the adjacency arrays"""
+
+        return self.following.nbytes() + self.followers.nbytes()
+
+
+_graphs = {}
+_graphs_lock = threading.Lock()
+
+
+def get_graph(db):
+    """Return the follow graph of db's database, loading it on first
+    use and applying changes made elsewhere if it hasn't been synced
+    for config.FOLLOW_GRAPH_SYNC seconds.  Follows added to the database
+    directly rather than through interface aren't seen until the graph
+    is loaded again"""
+
+    if db.dbname == ':memory:':
+        # every in-memory database has the same name
+        graph = FollowGraph()
+        graph.load(db.cursor())
+        return graph
+
+    with _graphs_lock:
+        graph = _graphs.get(db.dbname)
+        if graph is None:
+            graph = _graphs[db.dbname] = FollowGraph()
+            graph.load(db.cursor())
+            return graph
+    if time.monotonic() - graph.synced >= config.FOLLOW_GRAPH_SYNC:
+        graph.sync(db.cursor())
+    return graph
+
+
+def record(cursor, follower, followed, added):
+    """Record a follow (added True) or unfollow in follow_changes for
+    the graphs of every process, pruning old changes"""
+
+    cursor.execute("INSERT INTO follow_changes (follower, followed, added) VALUES (?, ?, ?)",
+                   (follower, followed, int(added)))
+    cursor.execute("DELETE FROM follow_changes WHERE id <= ?", (cursor.lastrowid - config.FOLLOW_LOG_SIZE,))
@@ -0,0 +1,161 @@
+"""
+Tests for the in-memory follow graph
+"""
+
+import os
+import tempfile
+import unittest
+
+from webtest import TestApp
+
+import config
+import graph
+import interface
+import main
+from database import COMP249Db
+
+
+class AdjacencyTests(unittest.TestCase):
+
+    def test_changes(self):
+        """Changes on top of the arrays read the same as the arrays rebuilt"""
+
+        edges = [(0, 1), (0, 2), (1, 2), (2, 0)]
+        adjacency = graph.Adjacency(4, [node * 4 + neighbour for node, neighbour in edges])
+        self.assertEqual([1, 2], adjacency.neighbours(0))
+        self.assertTrue(adjacency.contains(1, 2))
+        self.assertFalse(adjacency.contains(1, 0))
+        self.assertEqual(0, adjacency.count(3))
+
+        self.assertFalse(adjacency.add(0, 1))
+        self.assertTrue(adjacency.add(3, 0))
+        self.assertTrue(adjacency.remove(0, 1))
+        self.assertFalse(adjacency.remove(0, 1))
+        self.assertTrue(adjacency.add(0, 1))
+        self.assertTrue(adjacency.remove(0, 2))
+        # beyond the arrays
+        self.assertTrue(adjacency.add(5, 4))
+
+        compacted = adjacency.compact(6)
+        for node in range(6):
+            self.assertEqual(sorted(adjacency.neighbours(node)), compacted.neighbours(node))
+            self.assertEqual(adjacency.count(node), compacted.count(node))
+        self.assertEqual({}, compacted.added)
+
+
+class FollowGraphTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.db = COMP249Db(os.path.join(self.dir.name, 'test.db'))
+        self.db.create_tables()
+        self.db.sample_data(random=False)
+
+    def tearDown(self):
+        self.db.close()
+        self.dir.cleanup()
+
+    def test_follow(self):
+        """Follows are counted, checked and undone"""
+
+        self.assertEqual((0, 0), interface.follow_counts(self.db, 'Bean'))
+        self.assertTrue(interface.follow_add(self.db, 'Bean', 'Contrary'))
+        self.assertFalse(interface.follow_add(self.db, 'Bean', 'Contrary'))
+        self.assertIsNone(interface.follow_add(self.db, 'Bean', 'Nobody'))
+        self.assertIsNone(interface.follow_add(self.db, 'Bean', 'Bean'))
+
+        self.assertEqual((0, 1), interface.follow_counts(self.db, 'Bean'))
+        self.assertEqual((1, 0), interface.follow_counts(self.db, 'Contrary'))
+        self.assertTrue(interface.is_following(self.db, 'Bean', 'Contrary'))
+        self.assertFalse(interface.is_mutual(self.db, 'Bean', 'Contrary'))
+        interface.follow_add(self.db, 'Contrary', 'Bean')
+        self.assertTrue(interface.is_mutual(self.db, 'Bean', 'Contrary'))
+
+        # Contrary's posts are in Bean's timeline
+        self.assertIn('Contrary', [post[2] for post in interface.post_list_home(self.db, 'Bean')])
+
+        self.assertTrue(interface.follow_remove(self.db, 'Bean', 'Contrary'))
+        self.assertFalse(interface.follow_remove(self.db, 'Bean', 'Contrary'))
+        self.assertFalse(interface.is_following(self.db, 'Bean', 'Contrary'))
+        self.assertNotIn('Contrary', [post[2] for post in interface.post_list_home(self.db, 'Bean')])
+
+    def test_suggestions(self):
+        """Users followed by the most of those you follow come first"""
+
+        for follower, followed in [('Bean', 'Contrary'), ('Bean', 'Barfoo'), ('Bean', 'Mandible'),
+                                   ('Contrary', 'Jimbulator'), ('Barfoo', 'Jimbulator'),
+                                   ('Barfoo', 'Bobalooba'), ('Contrary', 'Mandible')]:
+            interface.follow_add(self.db, follower, followed)
+
+        suggested = interface.follow_suggestions(self.db, 'Bean')
+        self.assertEqual([('Jimbulator', 2), ('Bobalooba', 1)], [(nick, count) for nick, avatar, count in suggested])
+        self.assertEqual('http://robohash.org/jim', suggested[0][1])
+
+    def test_other_process(self):
+        """Follows made through another graph are seen after a sync"""
+
+        interface.follow_add(self.db, 'Bean', 'Contrary')
+        other = graph.FollowGraph()
+        other.load(self.db.cursor())
+        self.assertTrue(other.follows('Bean', 'Contrary'))
+
+        interface.follow_add(self.db, 'Bean', 'Barfoo')
+        interface.follow_remove(self.db, 'Bean', 'Contrary')
+        self.assertTrue(other.follows('Bean', 'Contrary'))
+        other.sync(self.db.cursor())
+        self.assertEqual(['Barfoo'], other.following_list('Bean'))
+
+        # changes pruned before they were seen mean loading again
+        saved = config.FOLLOW_LOG_SIZE
+        config.FOLLOW_LOG_SIZE = 1
+        try:
+            interface.follow_add(self.db, 'Bean', 'Mandible')
+            interface.follow_add(self.db, 'Bean', 'Jimbulator')
+        finally:
+            config.FOLLOW_LOG_SIZE = saved
+        other.sync(self.db.cursor())
+        self.assertEqual(['Barfoo', 'Jimbulator', 'Mandible'], other.following_list('Bean'))
+        self.assertEqual(['Bean'], other.follower_list('Mandible'))
+
+
+class RouteTests(unittest.TestCase):
+
+    def setUp(self):
+        self.db = COMP249Db()
+        self.db.create_tables()
+        self.db.sample_data(random=False)
+        self.app = TestApp(main.application)
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_follow_suggestion(self):
+        """Suggestions on the home timeline can be followed"""
+
+        self.app.post('/follow', {'nick': 'Bean'}, status=403)
+        interface.follow_add(self.db, 'Bobalooba', 'Contrary')
+        interface.follow_add(self.db, 'Contrary', 'Bean')
+
+        response = self.app.get('/')
+        form = response.forms['loginform']
+        form['nick'] = 'Bobalooba'
+        form['password'] = 'bob'
+        form.submit()
+
+        response = self.app.get('/timeline')
+        follow_form = [form for form in response.forms.values() if form.action == '/follow'][0]
+        self.assertEqual('Bean', follow_form['nick'].value)
+        follow_form.submit(status=303)
+        self.assertTrue(interface.is_following(self.db, 'Bobalooba', 'Bean'))
+        self.app.post('/follow', {'nick': 'Nobody'}, status=404)
+
+        response = self.app.post('/follow', {'nick': 'Mandible'},
+                                 headers={'Referer': 'http://localhost:80/users/Mandible'}, status=303)
+        self.assertEqual('/users/Mandible', response.headers['Location'])
+        response = self.app.post('/follow', {'nick': 'Mandible', 'remove': '1'},
+                                 headers={'Referer': 'http://evil.example/users/Mandible'}, status=303)
+        self.assertEqual('/timeline', response.headers['Location'])
+
+
+if __name__ == '__main__':
+    unittest.main()
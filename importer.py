@@ -0,0 +1,86 @@
+"""
+Import posts from a JSON lines file, one object per line with the
+keys usernick, timestamp and content, eg.
+
+    {"usernick": "Contrary", "timestamp": "2015-02-19 23:14:27", "content": "hello"}
+
+Timestamps are ISO 8601, converted to UTC if they give an offset.
+
+Usage:
+
+    python -m importer posts.jsonl [--db comp249.db] [--batch-size 5000]
+
+The file is read a batch at a time so memory use doesn't depend on its size.
+"""
+
+import argparse
+import datetime
+import json
+import sys
+
+import config
+import interface
+from database import COMP249Db
+
+
+def parse_timestamp(text):
+    """Return text, an ISO 8601 time such as 2015-02-19T23:14:27+10:00,
+    as 'YYYY-MM-DD HH:MM:SS' UTC.  A time without an offset is UTC"""
+
+    if text[-1:] in ('Z', 'z'):
+        text = text[:-1] + '+00:00'
+    when = datetime.datetime.fromisoformat(text)
+    if when.tzinfo is not None:
+        when = when.astimezone(datetime.timezone.utc)
+    return when.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def read_posts(lines):
+    """Generate (usernick, timestamp, content) tuples from lines of
+    JSON, raising ValueError at the first line that isn't a valid post"""
+
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+            usernick = record['usernick']
+            content = record['content']
+            timestamp = record.get('timestamp')
+            if not isinstance(usernick, str) or not isinstance(content, str):
+                raise ValueError("usernick and content must be strings")
+            if timestamp is not None and not isinstance(timestamp, str):
+                raise ValueError("timestamp must be a string")
+            if timestamp:
+                timestamp = parse_timestamp(timestamp)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            raise ValueError("line %d: %s" % (number, e))
+        yield usernick, timestamp, content
+
+
+def report(added, elapsed):
+    print("%10d posts  %8.0f posts/s" % (added, added / elapsed if elapsed else 0), file=sys.stderr)
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Import posts from a JSON lines file")
+    parser.add_argument('filename', help="file to import, - for standard input")
+    parser.add_argument('--db', default=config.DB_NAME, help="database file")
+    parser.add_argument('--batch-size', type=int, default=5000, help="posts written per transaction")
+    args = parser.parse_args(argv)
+
+    db = COMP249Db(args.db)
+    infile = sys.stdin if args.filename == '-' else open(args.filename, encoding='utf-8')
+    try:
+        added = interface.post_add_many(db, read_posts(infile), args.batch_size, report)
+    finally:
+        if infile is not sys.stdin:
+            infile.close()
+        db.close()
+    print("imported %d posts" % added)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+"""
+Derived tables built from the text of posts.
+
+When a post is written the @mentions in it are recorded in the
+mentions table and the #tags in the tags table, so that finding the
+posts that mention a user or use a tag is an index lookup rather than
+a search through the content of every post.  The tag_counts table
+keeps the number of uses of each tag per hour for trending tags.
+The HTML for each post is kept in post_html so that pages don't have
+to render it again.
+
+To rebuild the derived tables for an existing database run
+
+    python indexing.py [dbname]
+
+or to only re-render posts made by an older version of the renderer
+
+    python indexing.py --html [dbname]
+"""
+
+import sys
+
+import render
+import timelines
+
+
+def _parse(content, kind):
+    """Return the distinct values of the kind ('mention' or 'tag')
+    group of the renderer's tokens in content, so exactly the names
+    and tags that are linked in the HTML are indexed"""
+
+    result = []
+    for match in render.TOKEN_RE.finditer(content):
+        value = match.group(kind)
+        if value is not None and value not in result:
+            result.append(value)
+    return result
+
+
+def parse_mentions(content):
+    """Return a list of the distinct user nicks mentioned in content
+    in the order they first appear"""
+
+    return _parse(content, 'mention')
+
+
+def parse_tags(content):
+    """Return a list of the distinct tags (without the #) used in
+    content in the order they first appear"""
+
+    return _parse(content, 'tag')
+
+
+def tag_bucket(timestamp):
+    """Return the tag_counts bucket for a post timestamp, the hour
+    in which it was made eg. '2015-02-20 01'"""
+
+    return timestamp[:13]
+
+
+def index_mentions(cursor, posts):
+    """Record the users mentioned in posts"""
+
+    cursor.executemany("INSERT INTO mentions (post_id, usernick, timestamp) VALUES (?, ?, ?)",
+                       [(post_id, nick, timestamp)
+                        for post_id, timestamp, usernick, content in posts
+                        for nick in parse_mentions(content)])
+
+
+def index_tags(cursor, posts):
+    """Record the tags used in posts and count them in the
+    tag_counts bucket for the hour each was made"""
+
+    rows = []
+    counts = {}
+    for post_id, timestamp, usernick, content in posts:
+        bucket = tag_bucket(timestamp)
+        for tag in parse_tags(content):
+            rows.append((post_id, tag, timestamp))
+            counts[(bucket, tag)] = counts.get((bucket, tag), 0) + 1
+
+    cursor.executemany("INSERT INTO tags (post_id, tag, timestamp) VALUES (?, ?, ?)", rows)
+    cursor.executemany("""INSERT INTO tag_counts (bucket, tag, count) VALUES (?, ?, ?)
+                          ON CONFLICT (bucket, tag) DO UPDATE SET count = count + excluded.count""",
+                       [(bucket, tag, count) for (bucket, tag), count in counts.items()])
+
+
+def index_html(cursor, posts):
+    """Store the rendered HTML for posts"""
+
+    cursor.executemany("INSERT OR REPLACE INTO post_html (post_id, version, html) VALUES (?, ?, ?)",
+                       [(post_id, render.RENDER_VERSION, render.post_to_html(content))
+                        for post_id, timestamp, usernick, content in posts])
+
+
+def index_timelines(cursor, posts):
+    """Add posts to the home timelines of their authors' followers"""
+
+    timelines.fanout(cursor, [(post_id, timestamp, usernick) for post_id, timestamp, usernick, content in posts])
+
+
+# each indexer and the tables that it fills, an indexer is called with
+# a cursor and a list of (post_id, timestamp, usernick, content) tuples
+INDEXERS = [
+    (index_mentions, ('mentions',)),
+    (index_tags, ('tags', 'tag_counts')),
+    (index_html, ('post_html',)),
+    (index_timelines, ('timelines', 'timeline_sizes')),
+]
+
+
+def index_posts(cursor, posts, indexers=None):
+    """Record the derived rows for newly written posts, a list of
+    (post_id, timestamp, usernick, content) tuples, using indexers
+    (default all of them).  The caller is responsible for committing"""
+
+    for indexer, tables in INDEXERS:
+        if indexers is None or indexer in indexers:
+            indexer(cursor, posts)
+
+
+def index_post(cursor, post_id, timestamp, usernick, content):
+    """Record the derived rows for a newly written post using cursor,
+    the caller is responsible for committing"""
+
+    index_posts(cursor, [(post_id, timestamp, usernick, content)])
+
+
+def clear(cursor, indexers=None):
+    """Remove all derived rows made by indexers (default all of them)"""
+
+    for indexer, tables in INDEXERS:
+        if indexers is None or indexer in indexers:
+            for table in tables:
+                cursor.execute("DELETE FROM %s" % table)
+
+
+def reindex(db, indexers=None, batch_size=10000, commit=True):
+    """Rebuild the derived tables made by indexers (default all of
+    them) from the posts table, reading the posts in batches of
+    batch_size.  If commit is True each batch is committed as it is
+    done, otherwise the caller must commit.
+    Return the number of posts indexed"""
+
+    cursor = db.cursor()
+    clear(cursor, indexers)
+
+    count = 0
+    last_id = -1
+    while True:
+        cursor.execute("SELECT id, timestamp, usernick, content FROM posts WHERE id > ? ORDER BY id LIMIT ?",
+                       (last_id, batch_size))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        index_posts(cursor, rows, indexers)
+        count += len(rows)
+        last_id = rows[-1][0]
+        if commit:
+            db.commit()
+
+    return count
+
+
+def refresh_html(db, batch_size=10000):
+    """Re-render the posts whose stored HTML is missing or was made
+    by an older version of the renderer, committing after each batch
+    of batch_size posts.  Return the number of posts rendered"""
+
+    cursor = db.cursor()
+    count = 0
+    last_id = -1
+    while True:
+        cursor.execute("""SELECT posts.id, posts.timestamp, posts.usernick, posts.content, post_html.version
+                          FROM posts LEFT JOIN post_html ON posts.id = post_html.post_id
+                          WHERE posts.id > ? ORDER BY posts.id LIMIT ?""", (last_id, batch_size))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        stale = [row[:4] for row in rows if row[4] != render.RENDER_VERSION]
+        index_html(cursor, stale)
+        count += len(stale)
+        last_id = rows[-1][0]
+        db.commit()
+
+    return count
+
+
+if __name__ == '__main__':
+    import config
+    from database import COMP249Db
+
+    args = sys.argv[1:]
+    html_only = '--html' in args
+    if html_only:
+        args.remove('--html')
+    dbname = args[0] if args else config.DB_NAME
+    db = COMP249Db(dbname)
+    if html_only:
+        print("rendered %d posts" % refresh_html(db))
+    else:
+        print("indexed %d posts" % reindex(db))
+    db.close()
@@ -0,0 +1,143 @@
+"""
+Tests for the derived tables built from post content
+"""
+
+import calendar
+import time
+import unittest
+
+import indexing
+import interface
+import render
+from database import COMP249Db
+
+
+class MentionTests(unittest.TestCase):
+
+    def setUp(self):
+        self.db = COMP249Db(':memory:')
+        self.db.create_tables()
+        self.db.sample_data(random=False)
+
+    def test_parse_mentions(self):
+        """Mentions are found with internal but not final periods"""
+
+        self.assertEqual(['steve.cassidy', 'Cat'],
+                         indexing.parse_mentions("hi @steve.cassidy and @Cat. and @Cat again"))
+        self.assertEqual([], indexing.parse_mentions("no mentions here"))
+        # only mentions that are linked are recorded
+        self.assertEqual([], indexing.parse_mentions("me@example.org http://example.org/@bob"))
+
+    def test_post_add_records_mentions(self):
+        """A new post appears in the mentions list for each user it mentions"""
+
+        postid = interface.post_add(self.db, 'Bean', 'hello @Contrary and @Barfoo')
+
+        posts = interface.post_list_mentions(self.db, 'Contrary')
+        self.assertEqual([postid, 2, 5], [p[0] for p in posts])
+
+        posts = interface.post_list_mentions(self.db, 'Barfoo')
+        self.assertEqual([postid], [p[0] for p in posts])
+
+    def test_reindex(self):
+        """Rebuilding the mentions table gives the same result"""
+
+        before = interface.post_list_mentions(self.db, 'Jimbulator')
+        self.assertEqual([6, 9], [p[0] for p in before])
+
+        cursor = self.db.cursor()
+        cursor.execute("DELETE FROM mentions")
+        self.assertEqual(10, indexing.reindex(self.db, batch_size=3))
+
+        self.assertEqual(before, interface.post_list_mentions(self.db, 'Jimbulator'))
+
+
+class TagTests(unittest.TestCase):
+
+    def setUp(self):
+        self.db = COMP249Db(':memory:')
+        self.db.create_tables()
+        self.db.sample_data(random=False)
+
+    def test_parse_tags(self):
+
+        self.assertEqual(['sre', 'ax'], indexing.parse_tags("#sre ydpwg #ax jji #sre"))
+
+    def test_post_list_tag(self):
+        """Posts are listed by tag, newest first"""
+
+        self.assertEqual([1], [p[0] for p in interface.post_list_tag(self.db, 'ox')])
+        self.assertEqual([], interface.post_list_tag(self.db, 'nosuchtag'))
+
+        postid = interface.post_add(self.db, 'Bean', 'me too #ox')
+        self.assertEqual([postid, 1], [p[0] for p in interface.post_list_tag(self.db, 'ox')])
+        self.assertEqual([postid], [p[0] for p in interface.post_list_tag(self.db, 'ox', limit=1)])
+
+    def test_trending_tags(self):
+        """Trending tags are counted from the hourly buckets in the window"""
+
+        # the fixed posts are from 2015, nothing is trending now
+        self.assertEqual([], interface.trending_tags(self.db))
+
+        interface.post_add(self.db, 'Bean', 'one #new')
+        interface.post_add(self.db, 'Bean', 'two #new #other')
+        self.assertEqual([('new', 2), ('other', 1)], interface.trending_tags(self.db))
+        self.assertEqual([('new', 2)], interface.trending_tags(self.db, limit=1))
+
+        # counts are kept per bucket rather than derived from the posts
+        cursor = self.db.cursor()
+        cursor.execute("SELECT count FROM tag_counts WHERE tag='new'")
+        self.assertEqual([(2,)], cursor.fetchall())
+
+        # look back from just after the fixed posts were made
+        now = calendar.timegm(time.strptime('2015-02-20 02:00:00', '%Y-%m-%d %H:%M:%S'))
+        trending = interface.trending_tags(self.db, hours=2, now=now)
+        self.assertEqual({'ox', 'mtzw', 'ync', 'sre', 'ax', 'cvrwu'}, set(tag for tag, count in trending))
+
+
+class HtmlTests(unittest.TestCase):
+
+    def setUp(self):
+        self.version = render.RENDER_VERSION
+        self.db = COMP249Db(':memory:')
+        self.db.create_tables()
+        self.db.sample_data(random=False)
+
+    def tearDown(self):
+        render.RENDER_VERSION = self.version
+
+    def test_stored_html(self):
+        """HTML is rendered when the post is written"""
+
+        postid = interface.post_add(self.db, 'Bean', 'hi @Contrary see http://example.org/#x')
+        cursor = self.db.cursor()
+        cursor.execute("SELECT version, html FROM post_html WHERE post_id=?", (postid,))
+        self.assertEqual((render.RENDER_VERSION,
+                          "hi <a href='/users/Contrary'>@Contrary</a> see "
+                          "<a href='http://example.org/#x'>http://example.org/#x</a>"),
+                         cursor.fetchone())
+
+        posts = interface.post_list(self.db, usernick='Bean')
+        self.assertEqual([interface.post_to_html(posts[0][4])], interface.posts_to_html(self.db, posts))
+
+    def test_stale_html(self):
+        """Posts rendered by an old version are rendered again when displayed"""
+
+        cursor = self.db.cursor()
+        cursor.execute("UPDATE post_html SET html='stale'")
+        posts = interface.post_list(self.db)
+        self.assertEqual(['stale'] * 10, interface.posts_to_html(self.db, posts))
+
+        render.RENDER_VERSION += 1
+        expected = [interface.post_to_html(post[4]) for post in posts]
+        self.assertEqual(expected, interface.posts_to_html(self.db, posts))
+
+        # refreshing brings the stored copies up to date
+        self.assertEqual(10, indexing.refresh_html(self.db, batch_size=4))
+        self.assertEqual(0, indexing.refresh_html(self.db))
+        cursor.execute("SELECT count(*) FROM post_html WHERE version=?", (render.RENDER_VERSION,))
+        self.assertEqual(10, cursor.fetchone()[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,38 +2,580 @@
 @author:
 """
 
+import base64
+import itertools
+import time
+
+import archive
+import config
+import graph
+import indexing
+import pagecache
+import pubsub
+import render
+import timelines
+import votes
+import writer
+
+# posts longer than this are rejected by post_add
+MAX_POST_LENGTH = 150
+
 
 def post_to_html(content):
     """Convert a post to safe HTML, quote any HTML code, convert
     URLs to live links and spot any @mentions or #tags and turn
     them into links.  Return the HTML string"""
 
+    return render.post_to_html(content)
+
+
+def posts_to_html(db, posts):
+    """Return a list of the HTML for each of posts (as returned by
+    post_list) in the same order.
+
+    The HTML stored when the post was written is used if it was made
+    by the current renderer, otherwise the post is rendered (and kept
+    in an in-memory cache) until the stored copy is refreshed"""
+
+    if not posts:
+        return []
+
+    ids = [post[0] for post in posts]
+    cursor = db.cursor()
+    sql = "SELECT post_id, html FROM post_html WHERE version = ? AND post_id IN (%s)" % ','.join('?' * len(ids))
+    cursor.execute(sql, [render.RENDER_VERSION] + ids)
+    stored = dict(cursor.fetchall())
+
+    result = []
+    for post in posts:
+        if post[0] in stored:
+            result.append(stored[post[0]])
+        else:
+            result.append(render.cached_post_to_html(post[4]))
+    return result
+
+
+def user_get(db, usernick):
+    """Return a tuple (nick, avatar) for the user usernick or
+    None if there is no such user"""
+
+    cursor = db.cursor()
+    cursor.execute("SELECT nick, avatar FROM users WHERE nick = ?", (usernick,))
+    return cursor.fetchone()
+
+
+def follow_add(db, follower, followed):
+    """Make follower follow followed, their posts are added to the
+    follower's home timeline.
+
+    Return True if follower now follows followed, False if they did
+    already or None if either user doesn't exist or they are the same"""
+
+    def add(cursor):
+        if follower == followed:
+            return None
+        cursor.execute("SELECT count(*) FROM users WHERE nick IN (?, ?)", (follower, followed))
+        if cursor.fetchone()[0] != 2:
+            return None
+        cursor.execute("SELECT 1 FROM follows WHERE follower = ? AND followed = ?", (follower, followed))
+        if cursor.fetchone() is not None:
+            return False
+        cursor.execute("INSERT INTO follows (follower, followed) VALUES (?, ?)", (follower, followed))
+        graph.record(cursor, follower, followed, True)
+        timelines.update_heavy(cursor, followed)
+        timelines.rebuild_timeline(cursor, follower)
+        return True
+
+    added = writer.write(db, add)
+    if added:
+        graph.get_graph(db).sync(db.cursor())
+    return added
+
+
+def follow_remove(db, follower, followed):
+    """Make follower stop following followed.
+    Return True if they were following them"""
+
+    def remove(cursor):
+        if follower == followed:
+            return False
+        cursor.execute("DELETE FROM follows WHERE follower = ? AND followed = ?", (follower, followed))
+        if cursor.rowcount == 0:
+            return False
+        graph.record(cursor, follower, followed, False)
+        timelines.update_heavy(cursor, followed)
+        timelines.rebuild_timeline(cursor, follower)
+        return True
+
+    removed = writer.write(db, remove)
+    if removed:
+        graph.get_graph(db).sync(db.cursor())
+    return removed
+
+
+def follow_counts(db, usernick):
+    """Return a tuple (followers, following), the number of users who
+    follow usernick and the number usernick follows"""
+
+    follows = graph.get_graph(db)
+    return follows.follower_count(usernick), follows.following_count(usernick)
+
+
+def is_following(db, follower, followed):
+    """Return True if follower follows followed"""
+
+    return graph.get_graph(db).follows(follower, followed)
+
+
+def is_mutual(db, usernick, other):
+    """Return True if usernick and other follow each other"""
+
+    return graph.get_graph(db).mutual(usernick, other)
+
+
+def follow_suggestions(db, usernick, limit=10):
+    """Return a list of up to limit users for usernick to follow, the
+    ones followed by most of the users that usernick follows, as
+    tuples (nick, avatar, in_common) where in_common is the number of
+    those users who follow them"""
 
+    suggested = graph.get_graph(db).suggestions(usernick, limit)
+    if not suggested:
+        return []
+    cursor = db.cursor()
+    cursor.execute("SELECT nick, avatar FROM users WHERE nick IN (%s)" % ','.join('?' * len(suggested)),
+                   [nick for nick, count in suggested])
+    avatars = dict(cursor.fetchall())
+    return [(nick, avatars.get(nick), count) for nick, count in suggested]
 
-def post_list(db, usernick=None, limit=50):
+
+# the columns returned by all of the post listing functions
+POST_COLUMNS = "posts.id, posts.timestamp, posts.usernick, users.avatar, posts.content"
+
+
+def page_cursor(post):
+    """Return an opaque token marking the position of post (as
+    returned by post_list) in a timeline, for use in URLs"""
+
+    raw = "%s|%d" % (post[1], post[0])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def parse_cursor(token):
+    """Return the (timestamp, id) position encoded in a token made
+    by page_cursor, or None if token is missing or not valid"""
+
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        timestamp, post_id = raw.rsplit('|', 1)
+        return timestamp, int(post_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def _timeline(db, sql, conditions, params, key, limit, before, after):
+    """Run a post listing query sql with the given WHERE conditions
+    and params, newest first.  key is the pair of (timestamp, id)
+    columns that the query's index is ordered by.
+
+    before and after are (timestamp, id) positions as returned by
+    parse_cursor, only posts older than before and newer than after
+    are returned.  Paging this way is a range scan on the index
+    starting at the cursor, so deep pages cost the same as the first"""
+
+    conditions = list(conditions)
+    params = list(params)
+    if before is not None:
+        conditions.append("(%s, %s) < (?, ?)" % key)
+        params.extend(before)
+    if after is not None:
+        conditions.append("(%s, %s) > (?, ?)" % key)
+        params.extend(after)
+
+    # for posts newer than after we want the ones closest to it,
+    # so read forwards from the cursor and reverse them
+    order = 'ASC' if after is not None and before is None else 'DESC'
+
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    # id breaks ties between posts made in the same second, both
+    # orderings are satisfied by the timestamp indexes
+    sql += " ORDER BY %s %s, %s %s LIMIT ?" % (key[0], order, key[1], order)
+    params.append(limit)
+
+    cursor = db.cursor()
+    cursor.execute(sql, params)
+    rows = cursor.fetchall()
+    if order == 'ASC':
+        rows.reverse()
+    return rows
+
+
+def _partitioned(db, sql, conditions, params, key, limit, before, after, archived=True):
+    """Run _timeline on the live database, continuing into the
+    archives (see archive) if the live posts don't fill the page.  The
+    tables in sql are written {schema}posts etc. so that the query can
+    be run on each archive.  If archived is False only the live
+    database is read"""
+
+    rows = _timeline(db, sql.format(schema=''), conditions, params, key, limit, before, after)
+    if not archived:
+        return rows
+
+    def query(schema, limit):
+        return _timeline(db, sql.format(schema='"%s".' % schema), conditions, params, key, limit, before, after)
+
+    return archive.timeline(db, rows, query, limit, before, after)
+
+
+def post_list(db, usernick=None, limit=50, before=None, after=None, archived=True):
     """Return a list of posts ordered by date
     db is a database connection (as returned by COMP249Db())
     if usernick is not None, return only posts by this user
     return at most limit posts (default 50)
+    before and after are optional (timestamp, id) cursors (see
+    parse_cursor) to return only posts older or newer than a position
+    if archived is False archived posts are left out
 
     Returns a list of tuples (id, timestamp, usernick, avatar,  content)
     """
 
+    sql = "SELECT " + POST_COLUMNS + " FROM {schema}posts AS posts JOIN users ON posts.usernick = users.nick"
+    conditions = []
+    params = []
+    if usernick is not None:
+        conditions.append("posts.usernick = ?")
+        params.append(usernick)
+
+    return _partitioned(db, sql, conditions, params, ('posts.timestamp', 'posts.id'), limit, before, after,
+                        archived)
 
-def post_list_mentions(db, usernick, limit=50):
+
+def post_list_mentions(db, usernick, limit=50, before=None, after=None):
     """Return a list of posts that mention usernick, ordered by date
     db is a database connection (as returned by COMP249Db())
     return at most limit posts (default 50)
+    before and after are optional cursors as for post_list
+
+    Returns a list of tuples (id, timestamp, usernick, avatar,  content)
+    """
+
+    # mentions are recorded when a post is written, so this walks the
+    # (usernick, timestamp) index rather than searching post content
+    sql = """SELECT """ + POST_COLUMNS + """
+             FROM {schema}mentions AS mentions
+                  JOIN {schema}posts AS posts ON mentions.post_id = posts.id
+                  JOIN users ON posts.usernick = users.nick"""
+
+    return _partitioned(db, sql, ["mentions.usernick = ?"], [usernick],
+                     ('mentions.timestamp', 'mentions.post_id'), limit, before, after)
+
+
+def post_list_tag(db, tag, limit=50, before=None, after=None):
+    """Return a list of posts that use #tag, ordered by date
+    tag is given without the #
+    return at most limit posts (default 50)
+    before and after are optional cursors as for post_list
+
+    Returns a list of tuples (id, timestamp, usernick, avatar,  content)
+    """
+
+    sql = """SELECT """ + POST_COLUMNS + """
+             FROM {schema}tags AS tags
+                  JOIN {schema}posts AS posts ON tags.post_id = posts.id
+                  JOIN users ON posts.usernick = users.nick"""
+
+    return _partitioned(db, sql, ["tags.tag = ?"], [tag],
+                     ('tags.timestamp', 'tags.post_id'), limit, before, after)
+
+
+def iter_posts(db, usernick=None, mentions=None, before=None, after=None, limit=None, batch_size=None):
+    """Generate lists of posts ordered by date, newest first, to export
+    a timeline of any length in constant memory.
+    if usernick is not None only posts by this user, if mentions is not
+    None only posts that mention this user
+    before and after are optional cursors as for post_list, only posts
+    between them are generated, at most limit of them (default all)
+
+    Each list of up to batch_size (default config.API_BATCH_SIZE) posts
+    is read with its own query starting after the last post of the one
+    before, so no statement is left open while a batch is being sent
+
+    Posts are tuples (id, timestamp, usernick, avatar,  content)
+    """
+
+    if batch_size is None:
+        batch_size = config.API_BATCH_SIZE
+
+    if mentions is not None:
+        sql = """SELECT """ + POST_COLUMNS + """
+                 FROM {schema}mentions AS mentions
+                      JOIN {schema}posts AS posts ON mentions.post_id = posts.id
+                      JOIN users ON posts.usernick = users.nick"""
+        conditions = ["mentions.usernick = ?"]
+        params = [mentions]
+        key = ('mentions.timestamp', 'mentions.post_id')
+    else:
+        sql = "SELECT " + POST_COLUMNS + " FROM {schema}posts AS posts JOIN users ON posts.usernick = users.nick"
+        conditions = []
+        params = []
+        key = ('posts.timestamp', 'posts.id')
+        if usernick is not None:
+            conditions.append("posts.usernick = ?")
+            params.append(usernick)
+    # a bound rather than _timeline's after, which reads oldest first
+    if after is not None:
+        conditions.append("(%s, %s) > (?, ?)" % key)
+        params.extend(after)
+
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = batch_size if remaining is None else min(batch_size, remaining)
+        batch = _partitioned(db, sql, conditions, params, key, size, before, None)
+        if batch:
+            yield batch
+        if len(batch) < size:
+            return
+        before = (batch[-1][1], batch[-1][0])
+        if remaining is not None:
+            remaining -= len(batch)
+
+
+def post_list_since(db, post_id, usernick=None, mentions=None, limit=50):
+    """Return a list of up to limit posts newer than the post post_id,
+    by usernick or mentioning mentions as for iter_posts, the newest
+    limit of them if there are more, oldest first"""
+
+    cursor = db.cursor()
+    cursor.execute("SELECT timestamp FROM posts WHERE id = ?", (post_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return []
+    posts = [post for batch in iter_posts(db, usernick, mentions, after=(row[0], post_id), limit=limit,
+                                          batch_size=limit) for post in batch]
+    return posts[::-1]
+
+
+def post_list_home(db, usernick, limit=50, before=None, after=None):
+    """Return a list of posts by the users that usernick follows,
+    ordered by date
+    return at most limit posts (default 50)
+    before and after are optional cursors as for post_list
+
+    Posts are read from usernick's materialised timeline, with the
+    posts of any heavy authors they follow merged in (see timelines)
+
+    Returns a list of tuples (id, timestamp, usernick, avatar,  content)
+    """
+
+    sql = """SELECT """ + POST_COLUMNS + """
+             FROM timelines
+                  JOIN posts ON timelines.post_id = posts.id
+                  JOIN users ON posts.usernick = users.nick"""
+    posts = _timeline(db, sql, ["timelines.follower = ?"], [usernick],
+                      ('timelines.timestamp', 'timelines.post_id'), limit, before, after)
+
+    cursor = db.cursor()
+    cursor.execute("""SELECT DISTINCT follows.followed FROM follows
+                      JOIN heavy_authors ON follows.followed = heavy_authors.nick
+                      WHERE follows.follower = ?""", (usernick,))
+    heavy = [row[0] for row in cursor.fetchall()]
+    if not heavy:
+        return posts
+
+    for author in heavy:
+        # like the materialised timeline, only the live posts
+        posts.extend(post_list(db, usernick=author, limit=limit, before=before, after=after, archived=False))
+    posts.sort(key=lambda post: (post[1], post[0]), reverse=True)
+    # keep the posts nearest the cursor
+    if after is not None and before is None:
+        return posts[-limit:]
+    return posts[:limit]
+
+
+def newest_post(db, usernick=None, mentions=None):
+    """Return (id, timestamp) of the most recently added post, or
+    None if there are none.  If usernick is given only posts by that
+    user are considered, if mentions is given only posts mentioning
+    that user.
+
+    Ids only increase so this changes whenever a post is added to
+    the listing, wherever in it the post appears"""
+
+    cursor = db.cursor()
+    if mentions is not None:
+        cursor.execute("SELECT max(post_id) FROM mentions WHERE usernick = ?", (mentions,))
+    elif usernick is not None:
+        cursor.execute("SELECT max(id) FROM posts WHERE usernick = ?", (usernick,))
+    else:
+        cursor.execute("SELECT max(id) FROM posts")
+    post_id = cursor.fetchone()[0]
+    if post_id is None:
+        return None
+    cursor.execute("SELECT timestamp FROM posts WHERE id = ?", (post_id,))
+    return post_id, cursor.fetchone()[0]
+
+
+def trending_tags(db, hours=24, limit=10, now=None):
+    """Return the tags used most in the last hours hours before
+    now (default the current time) as a list of tuples (tag, count),
+    most used first.
+
+    Counts come from the hourly tag_counts buckets so this only
+    reads one row per tag per hour in the window"""
+
+    if now is None:
+        now = time.time()
+    since = indexing.tag_bucket(time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(now - hours * 3600)))
+    until = indexing.tag_bucket(time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(now)))
+
+    cursor = db.cursor()
+    sql = """SELECT tag, sum(count) AS total FROM tag_counts
+             WHERE bucket >= ? AND bucket <= ?
+             GROUP BY tag ORDER BY total DESC, tag LIMIT ?"""
+
+    cursor.execute(sql, (since, until, limit))
+    return cursor.fetchall()
+
+
+def vote_add(db, post_id, usernick):
+    """Record a vote by usernick for the post post_id, each user can
+    vote for a post once.
+
+    Return True if the vote was added, False if usernick had voted for
+    the post already or None if there is no such post"""
+
+    def add(cursor):
+        cursor.execute("SELECT 1 FROM posts WHERE id = ?", (post_id,))
+        if cursor.fetchone() is None:
+            return None
+        return votes.add(cursor, post_id, usernick)
+
+    return writer.write(db, add)
+
+
+def vote_remove(db, post_id, usernick):
+    """Remove usernick's vote for the post post_id.
+    Return True if there was one to remove"""
+
+    return writer.write(db, lambda cursor: votes.remove(cursor, post_id, usernick))
+
+
+def vote_counts(db, post_ids):
+    """Return a dictionary of the number of votes for each of the
+    posts post_ids that has any"""
+
+    post_ids = list(post_ids)
+    if not post_ids:
+        return {}
+    cursor = db.cursor()
+    cursor.execute("SELECT post_id, count FROM vote_counts WHERE post_id IN (%s)" % ','.join('?' * len(post_ids)),
+                   post_ids)
+    return dict(cursor.fetchall())
+
+
+def top_posts(db, limit=50):
+    """Return a list of the posts with the best time-decayed vote
+    scores, best first, from the ranking kept by votes.refresh
 
     Returns a list of tuples (id, timestamp, usernick, avatar,  content)
     """
 
+    cursor = db.cursor()
+    sql = """SELECT """ + POST_COLUMNS + """
+             FROM top_posts
+                  JOIN posts ON top_posts.post_id = posts.id
+                  JOIN users ON posts.usernick = users.nick
+             ORDER BY top_posts.score DESC LIMIT ?"""
+    cursor.execute(sql, (limit,))
+    return cursor.fetchall()
 
 
 def post_add(db, usernick, message):
     """Add a new post to the database.
     The date of the post will be the current time and date.
 
-    Return a the id of the newly created post or None if there was a problem"""
+    Return a the id of the newly created post or None if there was a problem.
+    Raise writer.WriteTimeout if the write waited too long to start"""
+
+    if len(message) > MAX_POST_LENGTH:
+        return None
+
+    timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+
+    def insert(cursor):
+        sql = "INSERT INTO posts (timestamp, usernick, content) VALUES (?, ?, ?)"
+        cursor.execute(sql, (timestamp, usernick, message))
+        post_id = cursor.lastrowid
+        indexing.index_post(cursor, post_id, timestamp, usernick, message)
+        return post_id
+
+    # committed with any other posts being added at the same time
+    post_id = writer.write(db, insert)
+    pagecache.post_added(usernick, indexing.parse_mentions(message))
+    pubsub.post_added(db, post_id, timestamp, usernick, message)
+
+    return post_id
+
+
+
+def post_add_many(db, posts, batch_size=1000, progress=None, indexers=None):
+    """Add many posts to the database, much faster than calling
+    post_add for each one.
+
+    posts is an iterable of (usernick, timestamp, content) tuples,
+    timestamp may be None for the current time.  It is read batch_size
+    posts at a time and each batch is written in one transaction, so
+    any number of posts can be added in constant memory.  Posts longer
+    than MAX_POST_LENGTH are skipped.
+
+    If progress is given it is called after each batch with the number
+    of posts added so far and the number of seconds taken.  indexers
+    chooses which derived tables are filled (see indexing.index_posts),
+    by default all of them.
+
+    Return the number of posts added"""
+
+    posts = iter(posts)
+    cursor = db.write_cursor()
+    db.commit()
+
+    added = 0
+    start = time.perf_counter()
+    while True:
+        batch = list(itertools.islice(posts, batch_size))
+        if not batch:
+            break
+        now = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            # ids are given out here so that the derived tables can be
+            # written with executemany too, the write lock stops anyone
+            # else taking the same ones
+            cursor.execute("""SELECT max(coalesce((SELECT seq FROM sqlite_sequence WHERE name = 'posts'), 0),
+                                         coalesce((SELECT max(id) FROM posts), 0))""")
+            next_id = cursor.fetchone()[0] + 1
+
+            rows = []
+            for usernick, timestamp, content in batch:
+                if len(content) > MAX_POST_LENGTH:
+                    continue
+                rows.append((next_id, timestamp or now, usernick, content))
+                next_id += 1
+
+            cursor.executemany("INSERT INTO posts (id, timestamp, usernick, content) VALUES (?, ?, ?, ?)", rows)
+            indexing.index_posts(cursor, rows, indexers)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
 
+        pagecache.pages.clear()
+        added += len(rows)
+        if progress is not None:
+            progress(added, time.perf_counter() - start)
 
+    return added
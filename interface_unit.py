@@ -0,0 +1,128 @@
+"""
+Tests for interface functions beyond those in level2_unit and level3_unit
+"""
+
+import io
+import unittest
+
+import importer
+import indexing
+import interface
+from database import COMP249Db
+
+
+class PaginationTests(unittest.TestCase):
+
+    def setUp(self):
+        self.db = COMP249Db(':memory:')
+        self.db.create_tables()
+        self.db.sample_data(random=False)
+        # two posts in the same second as post 4 to check ties
+        cursor = self.db.cursor()
+        cursor.execute("INSERT INTO posts (id, timestamp, usernick, content) VALUES (11, '2015-02-19 23:14:27', 'Bean', 'tie @Contrary')")
+        cursor.execute("INSERT INTO posts (id, timestamp, usernick, content) VALUES (12, '2015-02-19 23:14:27', 'Bean', 'tie @Contrary')")
+        self.db.commit()
+        indexing.reindex(self.db)
+
+    def test_cursor_tokens(self):
+        """Cursor tokens round trip and bad tokens are ignored"""
+
+        post = interface.post_list(self.db, limit=1)[0]
+        token = interface.page_cursor(post)
+        self.assertEqual((post[1], post[0]), interface.parse_cursor(token))
+        self.assertIsNone(interface.parse_cursor(None))
+        self.assertIsNone(interface.parse_cursor('not a cursor!'))
+        self.assertIsNone(interface.parse_cursor('bm90IGEgY3Vyc29y'))
+
+    def test_walk_pages(self):
+        """Following before cursors visits every post once in order"""
+
+        expected = [p[0] for p in interface.post_list(self.db)]
+        self.assertEqual([1, 2, 3, 12, 11, 4, 5, 6, 7, 8, 9, 10], expected)
+
+        seen = []
+        before = None
+        while True:
+            page = interface.post_list(self.db, limit=5, before=before)
+            if not page:
+                break
+            seen.extend(p[0] for p in page)
+            before = interface.parse_cursor(interface.page_cursor(page[-1]))
+        self.assertEqual(expected, seen)
+
+    def test_after(self):
+        """after gives the posts just newer than the cursor, newest first"""
+
+        posts = interface.post_list(self.db)
+        after = (posts[6][1], posts[6][0])
+        self.assertEqual([12, 11, 4], [p[0] for p in interface.post_list(self.db, limit=3, after=after)])
+        before = (posts[0][1], posts[0][0])
+        self.assertEqual([2, 3, 12, 11, 4], [p[0] for p in interface.post_list(self.db, before=before, after=after)])
+
+    def test_mentions_pages(self):
+
+        posts = interface.post_list_mentions(self.db, 'Contrary', limit=2)
+        self.assertEqual([2, 12], [p[0] for p in posts])
+        before = (posts[-1][1], posts[-1][0])
+        posts = interface.post_list_mentions(self.db, 'Contrary', limit=2, before=before)
+        self.assertEqual([11, 5], [p[0] for p in posts])
+
+
+class BulkTests(unittest.TestCase):
+
+    def setUp(self):
+        self.db = COMP249Db(':memory:')
+        self.db.create_tables()
+        self.db.sample_data(random=False)
+
+    def test_post_add_many(self):
+        """Bulk added posts are listed and indexed like single ones"""
+
+        posts = [('Bean', '2016-01-01 00:00:%02d' % i, 'bulk %d @Contrary #bulk' % i) for i in range(25)]
+        posts.append(('Bean', None, 'x' * (interface.MAX_POST_LENGTH + 1)))
+        batches = []
+
+        added = interface.post_add_many(self.db, iter(posts), batch_size=10,
+                                        progress=lambda n, t: batches.append(n))
+        self.assertEqual(25, added)
+        self.assertEqual([10, 20, 25], batches)
+
+        bean = interface.post_list(self.db, usernick='Bean', limit=100)
+        self.assertEqual(list(range(35, 10, -1)), [p[0] for p in bean])
+        self.assertEqual(27, len(interface.post_list_mentions(self.db, 'Contrary', limit=100)))
+        self.assertEqual(25, len(interface.post_list_tag(self.db, 'bulk', limit=100)))
+        self.assertEqual(25, len(interface.post_list_home(self.db, 'Bean', limit=100)))
+        self.assertEqual([interface.post_to_html(p[4]) for p in bean], interface.posts_to_html(self.db, bean))
+
+        # ids carry on after the bulk posts
+        self.assertEqual(36, interface.post_add(self.db, 'Bean', 'single'))
+
+    def test_import(self):
+        """Posts are read from JSON lines"""
+
+        lines = io.StringIO('{"usernick": "Bean", "timestamp": "2016-01-01T10:00:00Z", "content": "one"}\n'
+                            '\n'
+                            '{"usernick": "Bean", "content": "two"}\n')
+        posts = list(importer.read_posts(lines))
+        self.assertEqual(('Bean', '2016-01-01 10:00:00', 'one'), posts[0])
+        self.assertEqual(('Bean', None, 'two'), posts[1])
+
+        self.assertRaises(ValueError, list, importer.read_posts(['{"usernick": "Bean"}']))
+
+        # times with an offset are converted to UTC
+        lines = ['{"usernick": "Bean", "timestamp": "2015-02-19T23:14:27+10:00", "content": "one"}',
+                 '{"usernick": "Bean", "timestamp": "2015-02-19 23:14:27.500", "content": "two"}']
+        self.assertEqual(['2015-02-19 13:14:27', '2015-02-19 23:14:27'],
+                         [post[1] for post in importer.read_posts(lines)])
+
+        # fields of the wrong type are refused before anything is written
+        for line in ('{"usernick": "Bean", "content": null}',
+                     '{"usernick": "Bean", "content": 3}',
+                     '{"usernick": "Bean", "timestamp": 3, "content": "x"}',
+                     '{"usernick": "Bean", "timestamp": "yesterday", "content": "x"}',
+                     '["Bean", "x"]'):
+            self.assertRaises(ValueError, list, importer.read_posts([line]))
+
+
+if __name__ == "__main__":
+    unittest.main()
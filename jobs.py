@@ -0,0 +1,41 @@
+"""
+Background jobs run on a database at regular intervals, such as the
+expired session sweeper, the top posts ranking refresher and the
+archiver, started by server.py.
+"""
+
+import threading
+import traceback
+
+
+class PeriodicJob(threading.Thread):
+    """A background thread that calls job(db), db a connection from
+    the pool for dbname, every interval seconds until stop() is called.
+    A job that fails is reported and tried again at the next interval"""
+
+    def __init__(self, name, job, dbname, interval):
+
+        super().__init__(name=name, daemon=True)
+        self.job = job
+        self.dbname = dbname
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+
+        # imported here as database imports the modules with jobs
+        from database import COMP249Db, get_pool
+
+        while not self._stopped.wait(self.interval):
+            db = COMP249Db(self.dbname, pool=get_pool(self.dbname))
+            try:
+                self.job(db)
+            except Exception:
+                # eg. the database is locked or the write timed out
+                traceback.print_exc()
+                db.rollback()
+            finally:
+                db.close()
+
+    def stop(self):
+        self._stopped.set()
@@ -0,0 +1,116 @@
+"""
+Tests for the periodic background jobs
+"""
+
+import contextlib
+import io
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+import archive
+import jobs
+import users
+import votes
+from database import COMP249Db
+
+
+class PeriodicJobTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.dbname = os.path.join(self.dir.name, 'test.db')
+        db = COMP249Db(self.dbname)
+        db.create_tables()
+        db.sample_data(random=False)
+        db.close()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_runs_until_stopped(self):
+        """The job is called with a connection to the database until stopped"""
+
+        ran = threading.Event()
+        seen = []
+
+        def job(db):
+            seen.append(db.dbname)
+            ran.set()
+
+        thread = jobs.PeriodicJob('test-job', job, self.dbname, 0.01)
+        thread.start()
+        self.assertTrue(ran.wait(5))
+        thread.stop()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual({self.dbname}, set(seen))
+
+    def test_failure(self):
+        """A job that fails is run again at the next interval"""
+
+        ran = threading.Event()
+        calls = []
+
+        def job(db):
+            calls.append(db)
+            if len(calls) == 1:
+                raise RuntimeError("database is locked")
+            ran.set()
+
+        thread = jobs.PeriodicJob('test-job', job, self.dbname, 0.01)
+        with contextlib.redirect_stderr(io.StringIO()) as stderr:
+            thread.start()
+            self.assertTrue(ran.wait(5))
+            thread.stop()
+            thread.join(5)
+        self.assertIn("database is locked", stderr.getvalue())
+        self.assertGreaterEqual(len(calls), 2)
+
+    def test_jobs(self):
+        """The sweeper and the refresher run their jobs"""
+
+        db = COMP249Db(self.dbname)
+        cursor = db.cursor()
+        cursor.execute("INSERT INTO sessions (sessionid, usernick, expires) VALUES ('old', 'Bean', ?)",
+                       (time.time() - 10,))
+        votes.add(cursor, 1, 'Bean')
+        db.commit()
+
+        threads = [users.SessionSweeper(self.dbname, 0.01), votes.RankingRefresher(self.dbname, 0.01)]
+        for thread in threads:
+            thread.start()
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            cursor.execute("SELECT (SELECT count(*) FROM sessions), (SELECT count(*) FROM top_posts)")
+            if cursor.fetchone() == (0, 1):
+                break
+            time.sleep(0.01)
+        for thread in threads:
+            thread.stop()
+            thread.join(5)
+        cursor.execute("SELECT (SELECT count(*) FROM sessions), (SELECT count(*) FROM top_posts)")
+        self.assertEqual((0, 1), cursor.fetchone())
+        db.close()
+
+    def test_archiver(self):
+        """The archiver moves the old sample posts out"""
+
+        thread = archive.Archiver(self.dbname, 0.01)
+        thread.start()
+        db = COMP249Db(self.dbname)
+        cursor = db.cursor()
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline and len(archive.partitions(db)) == 0:
+            time.sleep(0.01)
+        thread.stop()
+        thread.join(5)
+        cursor.execute("SELECT count(*) FROM posts")
+        self.assertEqual(0, cursor.fetchone()[0])
+        db.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
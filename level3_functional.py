@@ -4,7 +4,7 @@
 import unittest
 from webtest import TestApp
 from database import COMP249Db
-import main, users
+import main, users, writer
 
 from random import choice
 
@@ -84,7 +84,43 @@ class Level3FunctionalTests(unittest.TestCase):
 
         # Should not have a cookie
         self.assertNotIn(users.COOKIE_NAME, self.app.cookies)
-    
+
+    def testLoginMissingField(self):
+        """A login without a nick or a password fails like a wrong password"""
+
+        (password, nick, avatar) = self.users[0]
+
+        for fields in ({'nick': nick}, {'password': password}, {}):
+            response = self.app.post('/login', fields)
+            self.assertEqual('200 OK', response.status)
+            self.assertIn("Failed", response)
+            self.assertNotIn(users.COOKIE_NAME, self.app.cookies)
+
+    def testWriteTimeout(self):
+        """A login or post whose write times out gets a 503 asking to try again"""
+
+        (password, nick, avatar) = self.users[0]
+
+        def timeout(db, job, timeout=None):
+            raise writer.WriteTimeout("write not started")
+
+        write = writer.write
+        writer.write = timeout
+        try:
+            response = self.app.post('/login', {'nick': nick, 'password': password}, status=503)
+            self.assertIn("try again", response)
+            self.assertNotIn(users.COOKIE_NAME, self.app.cookies)
+
+            writer.write = write
+            self.doLogin(nick, password)
+            writer.write = timeout
+            for path, fields in (('/post', {'post': 'hello'}), ('/vote', {'post': '1'}),
+                                 ('/follow', {'nick': 'Mandible'}), ('/logout', {})):
+                response = self.app.post(path, fields, status=503)
+                self.assertEqual('5', response.headers['Retry-After'])
+        finally:
+            writer.write = write
+
     def testLoginPagesLogoutForm(self):
         """As a registered user, once I have logged in,
          every page that I request contains my name and the logout form."""
@@ -0,0 +1,193 @@
+"""
+Generate a large synthetic database for load testing.
+
+    python -m loadgen load.db --seed 1 --users 10000 --posts 10000000
+
+Authors, mentions, tags and voters are drawn from Zipf distributions so
+that a few users and tags are very popular and most are not, as on a
+real site.  Everything is drawn from one random generator seeded with
+--seed, so the same arguments always produce the same users, follows,
+posts and votes.
+
+Post text is made a batch at a time from a fixed vocabulary with single
+calls to random.choices rather than a character at a time as gentext
+does, and rows are streamed into the database in large transactions
+through interface.post_add_many.  Every user has the password
+'password'.
+"""
+
+import argparse
+import calendar
+import itertools
+import random
+import sys
+import time
+
+import indexing
+import interface
+import passwords
+import timelines
+import votes
+from database import COMP249Db
+
+
+LETTERS = "aeiouybcdfghjklmnpqrstvwxzaeiouy"
+
+
+def zipf_weights(n, exponent):
+    """Return cumulative weights for choosing from n items where
+    item i has weight 1 / (i + 1) ** exponent"""
+
+    return list(itertools.accumulate(1.0 / (i + 1) ** exponent for i in range(n)))
+
+
+def make_words(rng, count, prefix=''):
+    """Return count distinct random words"""
+
+    words = set()
+    while len(words) < count:
+        words.add(prefix + ''.join(rng.choices(LETTERS, k=rng.randint(2, 10))))
+    return sorted(words)
+
+
+class Generator():
+    """Draws users, follows, posts and votes from one seeded random generator"""
+
+    def __init__(self, seed=1, users=1000, follows=20, vote_rate=2.0, exponent=1.1,
+                 vocabulary=5000, tags=2000, end='2026-01-01 00:00:00', days=365):
+
+        self.rng = random.Random(seed)
+        self.nicks = ['user%06d' % i for i in range(users)]
+        self.follows = follows
+        self.vote_rate = vote_rate
+        self.user_weights = zipf_weights(users, exponent)
+        self.words = make_words(self.rng, vocabulary)
+        self.tags = make_words(self.rng, tags, '#')
+        self.tag_weights = zipf_weights(tags, exponent)
+        self.end = calendar.timegm(time.strptime(end, '%Y-%m-%d %H:%M:%S'))
+        self.span = days * 24 * 3600
+
+    def popular_users(self, count):
+        """Return count nicks chosen with Zipf weights"""
+
+        return self.rng.choices(self.nicks, cum_weights=self.user_weights, k=count)
+
+    def user_rows(self):
+        """Generate (nick, password, avatar) rows"""
+
+        password = passwords.hash_password('password', cost=passwords.minimum_cost())
+        for nick in self.nicks:
+            yield nick, password, 'http://robohash.org/' + nick
+
+    def follow_rows(self):
+        """Generate (follower, followed) rows, everyone follows themselves
+        and about self.follows others, popular users more often"""
+
+        for nick in self.nicks:
+            followed = set(self.popular_users(self.rng.randint(0, 2 * self.follows)))
+            followed.add(nick)
+            for other in sorted(followed):
+                yield nick, other
+
+    def posts(self, count, batch_size=10000):
+        """Generate count (usernick, timestamp, content) tuples, oldest first"""
+
+        rng = self.rng
+        step = self.span / count
+        start = self.end - self.span
+        for offset in range(0, count, batch_size):
+            n = min(batch_size, count - offset)
+            authors = self.popular_users(n)
+            mentions = self.popular_users(n)
+            tags = rng.choices(self.tags, cum_weights=self.tag_weights, k=n)
+            lengths = rng.choices(range(5, 21), k=n)
+            words = rng.choices(self.words, k=sum(lengths))
+            extras = rng.choices((0, 1, 2, 3), weights=(5, 2, 2, 1), k=n)
+
+            position = 0
+            for i in range(n):
+                text = words[position:position + lengths[i]]
+                position += lengths[i]
+                # 1 adds a mention, 2 a tag and 3 both
+                if extras[i] & 1:
+                    text.insert(len(text) // 2, '@' + mentions[i])
+                if extras[i] & 2:
+                    text.append(tags[i])
+                content = ' '.join(text)[:interface.MAX_POST_LENGTH]
+                timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(start + (offset + i) * step))
+                yield authors[i], timestamp, content
+
+    def vote_rows(self, first_id, last_id, batch_size=10000):
+        """Generate (post, usernick) votes for posts first_id to last_id,
+        an average of self.vote_rate votes per post by popular users,
+        at most one vote per user per post"""
+
+        for low in range(first_id, last_id + 1, batch_size):
+            high = min(last_id, low + batch_size - 1)
+            n = int((high - low + 1) * self.vote_rate)
+            post_ids = [self.rng.randint(low, high) for i in range(n)]
+            voters = self.popular_users(n)
+            for vote in sorted(set(zip(post_ids, voters))):
+                yield vote
+
+
+def generate(dbname, posts=100000, seed=1, batch_size=50000, build_timelines=True, progress=None, **kwargs):
+    """Create dbname filled with generated data, see Generator for
+    the other arguments.  If build_timelines is False home timelines
+    are left empty, build them later with python timelines.py.
+    Return the number of posts added"""
+
+    generator = Generator(seed, **kwargs)
+    db = COMP249Db(dbname)
+    db.create_tables()
+    # a new file that can be generated again, so durability doesn't matter
+    db.conn.execute("PRAGMA synchronous=OFF")
+
+    cursor = db.cursor()
+    cursor.executemany("INSERT INTO users (nick, password, avatar) VALUES (?, ?, ?)", generator.user_rows())
+    cursor.executemany("INSERT INTO follows (follower, followed) VALUES (?, ?)", generator.follow_rows())
+    timelines.find_heavy_authors(cursor)
+    db.commit()
+
+    # fanning out post by post copies each popular author's posts to
+    # almost every user, so timelines are built once at the end instead
+    indexers = [indexer for indexer, tables in indexing.INDEXERS if indexer is not indexing.index_timelines]
+    added = interface.post_add_many(db, generator.posts(posts, batch_size), batch_size, progress, indexers)
+
+    cursor.executemany("INSERT OR IGNORE INTO votes (post, usernick) VALUES (?, ?)", generator.vote_rows(1, added))
+    votes.rebuild(db, commit=False)
+    db.commit()
+    if build_timelines:
+        timelines.rebuild(db, commit=False)
+        db.commit()
+    cursor.execute("ANALYZE")
+    db.close()
+    return added
+
+
+def report(added, elapsed):
+    print("%10d posts  %8.0f posts/s" % (added, added / elapsed if elapsed else 0), file=sys.stderr)
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Generate a synthetic database for load testing")
+    parser.add_argument('dbname', help="database file to create, any existing data is lost")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--posts', type=int, default=100000)
+    parser.add_argument('--follows', type=int, default=20, help="average number of users each user follows")
+    parser.add_argument('--votes', type=float, default=2.0, help="average number of votes per post")
+    parser.add_argument('--zipf', type=float, default=1.1, help="exponent of the popularity distribution")
+    parser.add_argument('--batch-size', type=int, default=50000)
+    parser.add_argument('--no-timelines', action='store_true', help="don't build home timelines")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    added = generate(args.dbname, args.posts, args.seed, args.batch_size, not args.no_timelines, report,
+                     users=args.users, follows=args.follows, vote_rate=args.votes, exponent=args.zipf)
+    print("generated %d posts in %.1fs" % (added, time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
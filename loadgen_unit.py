@@ -0,0 +1,79 @@
+"""
+Tests for the synthetic data generator
+"""
+
+import os
+import tempfile
+import unittest
+
+import loadgen
+from database import COMP249Db
+
+
+class GeneratorTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def generate(self, name, seed):
+        """Generate a small database, return its users, follows, posts and votes"""
+
+        dbname = os.path.join(self.dir.name, name)
+        loadgen.generate(dbname, posts=500, seed=seed, batch_size=200, users=50, follows=5)
+        db = COMP249Db(dbname)
+        cursor = db.cursor()
+        tables = []
+        for sql in ("SELECT nick, avatar FROM users ORDER BY nick",
+                    "SELECT follower, followed FROM follows ORDER BY follower, followed",
+                    "SELECT id, timestamp, usernick, content FROM posts ORDER BY id",
+                    "SELECT post, usernick FROM votes ORDER BY post, usernick"):
+            cursor.execute(sql)
+            tables.append(cursor.fetchall())
+        db.close()
+        return tables
+
+    def test_same_seed(self):
+        """The same seed generates the same data, a different seed doesn't"""
+
+        first = self.generate('a.db', 1)
+        self.assertEqual(first, self.generate('b.db', 1))
+        self.assertNotEqual(first[2], self.generate('c.db', 2)[2])
+
+    def test_contents(self):
+        """Posts are in time order, within the length limit and fill the indexes"""
+
+        users, follows, posts, votes = self.generate('a.db', 1)
+
+        self.assertEqual(50, len(users))
+        self.assertEqual(500, len(posts))
+        self.assertEqual(sorted(posts, key=lambda post: post[1]), posts)
+        for post in posts:
+            self.assertLessEqual(len(post[3]), 150)
+        # everyone follows themselves
+        for nick, avatar in users:
+            self.assertIn((nick, nick), follows)
+        self.assertEqual(len(votes), len(set(votes)))
+
+        db = COMP249Db(os.path.join(self.dir.name, 'a.db'))
+        cursor = db.cursor()
+        for table in ('mentions', 'tags', 'post_html', 'timelines'):
+            cursor.execute("SELECT count(*) FROM " + table)
+            self.assertGreater(cursor.fetchone()[0], 0, table)
+        db.close()
+
+    def test_zipf(self):
+        """A few authors write most of the posts"""
+
+        posts = self.generate('a.db', 1)[2]
+        counts = {}
+        for post in posts:
+            counts[post[2]] = counts.get(post[2], 0) + 1
+        top = sorted(counts.values(), reverse=True)
+        self.assertGreater(sum(top[:5]), len(posts) // 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
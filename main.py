@@ -1,28 +1,493 @@
 __author__ = 'Steve Cassidy'
 
-from bottle import Bottle, template, static_file, request, response, HTTPError
+import calendar
+import functools
+import glob
+import hashlib
+import json
+import os
+import time
+import urllib.parse
+
+from bottle import Bottle, BaseTemplate, request, response, HTTPError, HTTPResponse, http_date, parse_date
+import archive
+import assets
+import compress
 import interface
+import metrics
+import pagecache
+import passwords
+import pubsub
+import render
 import users
-from database import COMP249Db
+import votes
+import writer
+from dbplugin import COMP249DbPlugin
+from metrics import template
 
 
 application = Bottle()
+db_plugin = application.install(COMP249DbPlugin())
+
+# number of posts on each page of a timeline
+PAGE_SIZE = 50
+
+
+def _template_version():
+    """Return a digest of the templates so that pages cached by
+    browsers are not reused after the templates change"""
+
+    digest = hashlib.sha1()
+    for path in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'views', '*.tpl'))):
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+TEMPLATE_VERSION = _template_version()
+
+# files under static are served from memory and linked from
+# templates with {{static_url('style.css')}}
+static_assets = assets.Assets(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static'))
+
+
+def static_url(name):
+    return static_assets.url(name)
+
+
+BaseTemplate.defaults['static_url'] = static_url
+
+# a year, the longest a cache lifetime should be
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+def see_other(location):
+    """Redirect to location with a 303 response, keeping any cookies
+    set on the response and leaving location relative"""
+
+    res = response.copy(cls=HTTPResponse)
+    res.status = 303
+    res.body = ""
+    res.set_header('Location', location)
+    raise res
+
+
+def came_from(default):
+    """Return the path and query of the page on this site that the
+    request came from (its Referer), or default if it came from another
+    site or doesn't say, so that it can't redirect anywhere else"""
+
+    referer = urllib.parse.urlsplit(request.headers.get('Referer') or '')
+    if (referer.scheme in ('http', 'https') and referer.netloc == request.urlparts.netloc and
+            referer.path.startswith('/') and not referer.path.startswith(('//', '/\\'))):
+        return urllib.parse.urlunsplit(('', '', referer.path, referer.query, ''))
+    return default
+
+
+def writes(callback):
+    """Decorate a route that writes to the database, answering 503 if
+    the write times out waiting behind others (see writer.write)"""
+
+    @functools.wraps(callback)
+    def wrapper(*args, **kwargs):
+        try:
+            return callback(*args, **kwargs)
+        except writer.WriteTimeout:
+            response.status = 503
+            response.set_header('Retry-After', '5')
+            return template('general', title="Psst!", content="Psst! is busy, please try again shortly")
+
+    return wrapper
+
+
+def page_args():
+    """Return a dictionary of the before and after cursors
+    given in the query string of the request"""
+
+    return {'before': interface.parse_cursor(request.query.get('before')),
+            'after': interface.parse_cursor(request.query.get('after')),
+            'limit': PAGE_SIZE}
+
+
+def timeline(db, posts, args, **kwargs):
+    """Render a page of posts with links to older and newer posts,
+    args are the page_args used to fetch the posts"""
+
+    older = None
+    newer = None
+    if len(posts) == PAGE_SIZE:
+        older = interface.page_cursor(posts[-1])
+    if (args['before'] or args['after']) and posts:
+        newer = interface.page_cursor(posts[0])
+
+    html = interface.posts_to_html(db, posts)
+
+    kwargs.setdefault('title', "Psst!")
+    kwargs.setdefault('nick', users.session_user(db))
+    kwargs.setdefault('user', None)
+    kwargs.setdefault('trending', None)
+    return template('timeline', posts=zip(posts, html), older=older, newer=newer, **kwargs)
+
+
+def page_etag(group, newest, nick, args):
+    """Return the ETag of a page of the timeline group (see pagecache)
+    whose newest post is newest, as seen by nick"""
+
+    key = repr((group, newest and newest[0], nick, args['before'], args['after'],
+                render.RENDER_VERSION, TEMPLATE_VERSION, static_assets.version))
+    return '"%s"' % hashlib.sha1(key.encode()).hexdigest()[:24]
+
+
+def not_modified(etag, modified):
+    """Return True if the request is conditional and the client's copy,
+    last modified at modified (seconds since the epoch), is current"""
+
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in tags or etag in tags or 'W/' + etag in tags
+
+    if_modified_since = request.headers.get('If-Modified-Since')
+    if if_modified_since and modified is not None:
+        since = parse_date(if_modified_since.split(';')[0].strip())
+        return since is not None and since >= modified
+    return False
+
+
+def cached_timeline(db, group, newest, fetch, **kwargs):
+    """Render a page of posts as timeline does, answering conditional
+    requests from newest, the newest post that can appear in the page
+    (see interface.newest_post), and keeping the page in pagecache for
+    visitors who aren't logged in.  fetch is called with the page_args
+    to get the posts, group names the listing as in pagecache"""
+
+    nick = users.session_user(db)
+    args = page_args()
+
+    etag = page_etag(group, newest, nick, args)
+    response.set_header('ETag', etag)
+    response.set_header('Cache-Control', 'private, no-cache' if nick else 'no-cache')
+    response.set_header('Vary', 'Cookie')
+    modified = None
+    if newest is not None:
+        modified = calendar.timegm(time.strptime(newest[1], '%Y-%m-%d %H:%M:%S'))
+        response.set_header('Last-Modified', http_date(modified))
+
+    if not_modified(etag, modified):
+        res = response.copy(cls=HTTPResponse)
+        res.status = 304
+        res.body = ""
+        raise res
+
+    key = (db.dbname, args['before'], args['after'])
+    if nick is None:
+        page = pagecache.pages.get(group, key, newest)
+        if page is not None:
+            return page
+
+    page = timeline(db, fetch(args), args, nick=nick, **kwargs)
+    if nick is None:
+        pagecache.pages.set(group, key, newest, page)
+    return page
+
 
 @application.route('/')
-def index():
+def index(db):
+
+    return cached_timeline(db, ('all', None), interface.newest_post(db),
+                           lambda args: interface.post_list(db, **args),
+                           heading="Welcome to Psst")
+
+
+@application.route('/timeline')
+def home_timeline(db):
+
+    nick = users.session_user(db)
+    if nick is None:
+        see_other('/')
+
+    args = page_args()
+    posts = interface.post_list_home(db, nick, **args)
+    suggestions = interface.follow_suggestions(db, nick, limit=5)
+
+    return timeline(db, posts, args, heading="Your timeline", nick=nick, suggestions=suggestions)
+
+
+@application.route('/users/<nick>')
+def user_page(nick, db):
+
+    user = interface.user_get(db, nick)
+    if user is None:
+        raise HTTPError(404, "No such user")
+
+    return cached_timeline(db, ('user', nick), interface.newest_post(db, usernick=nick),
+                           lambda args: interface.post_list(db, usernick=nick, **args),
+                           heading=nick, user=user)
+
+
+@application.route('/mentions/<nick>')
+def mentions_page(nick, db):
+
+    return cached_timeline(db, ('mentions', nick), interface.newest_post(db, mentions=nick),
+                           lambda args: interface.post_list_mentions(db, nick, **args),
+                           heading="Mentions of " + nick)
+
+
+@application.route('/tags/<tag>')
+def tag_page(tag, db):
 
-    db = COMP249Db()
+    args = page_args()
+    posts = interface.post_list_tag(db, tag, **args)
+    trending = interface.trending_tags(db)
 
-    return template('general', title="Psst!", content="Get Started")
+    return timeline(db, posts, args, heading="#" + tag, trending=trending)
 
 
+@application.route('/top')
+def top_page(db):
+
+    posts = interface.top_posts(db, limit=PAGE_SIZE)
+    html = interface.posts_to_html(db, posts)
+    counts = interface.vote_counts(db, [post[0] for post in posts])
+
+    return template('timeline', title="Psst!", heading="Top posts", posts=zip(posts, html), votes=counts,
+                    nick=users.session_user(db), user=None, trending=None, older=None, newer=None)
+
+
+@application.post('/vote')
+@writes
+def vote(db):
+
+    nick = users.session_user(db, cached=False)
+    if nick is None:
+        raise HTTPError(403, "You must be logged in to vote")
+
+    post_id = request.forms.get('post', '')
+    if not post_id.isdigit():
+        raise HTTPError(400, "No post to vote for")
+    if request.forms.get('remove'):
+        interface.vote_remove(db, int(post_id), nick)
+    elif interface.vote_add(db, int(post_id), nick) is None:
+        raise HTTPError(404, "No such post")
+
+    see_other(came_from('/top'))
+
+
+@application.post('/follow')
+@writes
+def follow(db):
+
+    nick = users.session_user(db, cached=False)
+    if nick is None:
+        raise HTTPError(403, "You must be logged in to follow")
+
+    other = request.forms.getunicode('nick', '')
+    if request.forms.get('remove'):
+        interface.follow_remove(db, nick, other)
+    elif interface.follow_add(db, nick, other) is None:
+        raise HTTPError(404, "No such user")
+
+    see_other(came_from('/timeline'))
+
+
+def post_json(post):
+    """Return the JSON for a post, with the cursor to continue after it"""
+
+    post_id, timestamp, usernick, avatar, content = post
+    return json.dumps({'id': post_id, 'timestamp': timestamp, 'user': usernick, 'avatar': avatar,
+                       'content': content, 'cursor': interface.page_cursor(post)})
+
+
+def stream_posts(**kwargs):
+    """Return a body streaming the posts found by interface.iter_posts
+    with kwargs, newest first, as a line of JSON for each post or a JSON
+    array with ?format=json.  The query string may give before and
+    after cursors and a limit"""
+
+    limit = request.query.get('limit', '')
+    if limit and not limit.isdigit():
+        raise HTTPError(400, "limit must be a number")
+    array = request.query.get('format') == 'json'
+    args = {'before': interface.parse_cursor(request.query.get('before')),
+            'after': interface.parse_cursor(request.query.get('after')),
+            'limit': int(limit) if limit else None}
+
+    response.content_type = 'application/json' if array else 'application/x-ndjson'
+    response.set_header('Cache-Control', 'no-cache')
+
+    def generate():
+        # the request's connection is given back when the route returns,
+        # before any of the body is sent
+        db = db_plugin.open()
+        try:
+            separator = ''
+            if array:
+                yield b'['
+            for batch in interface.iter_posts(db, **dict(kwargs, **args)):
+                if array:
+                    chunk = separator + ',\n'.join(post_json(post) for post in batch)
+                    separator = ',\n'
+                else:
+                    chunk = ''.join(post_json(post) + '\n' for post in batch)
+                yield chunk.encode()
+            if array:
+                yield b']\n'
+        finally:
+            db.close()
+
+    return generate()
+
+
+@application.route('/api/posts')
+def api_posts():
+
+    return stream_posts()
+
+
+@application.route('/api/users/<nick>/posts')
+def api_user_posts(nick, db):
+
+    if interface.user_get(db, nick) is None:
+        raise HTTPError(404, "No such user")
+    return stream_posts(usernick=nick)
+
+
+@application.route('/api/mentions/<nick>')
+def api_mentions(nick, db):
+
+    if interface.user_get(db, nick) is None:
+        raise HTTPError(404, "No such user")
+    return stream_posts(mentions=nick)
+
+
+@application.route('/stream')
+def stream(db):
+    """New posts as server-sent events: all of them, those by ?user=nick
+    or those mentioning ?mention=nick.  A client reconnecting with
+    Last-Event-ID is first sent the posts it missed"""
+
+    user = request.query.get('user') or None
+    mention = request.query.get('mention') or None
+    if user and mention:
+        raise HTTPError(400, "Only one of user and mention")
+    for nick in (user, mention):
+        if nick and interface.user_get(db, nick) is None:
+            raise HTTPError(404, "No such user")
+
+    hub = pubsub.get_hub(db)
+    # subscribed first so that nothing is missed between the two
+    subscription = hub.subscribe(user, mention)
+    backlog = []
+    last = request.get_header('Last-Event-ID', '')
+    if last.isdigit():
+        backlog = interface.post_list_since(db, int(last), user, mention, limit=subscription.size)
+    stream = pubsub.EventStream(hub, subscription, post_json, backlog)
+
+    response.content_type = 'text/event-stream'
+    # server.py writes the events to the socket itself, so no-transform
+    # keeps the gzip middleware from compressing them
+    response.set_header('Cache-Control', 'no-cache, no-transform')
+    response.set_header('X-Accel-Buffering', 'no')
+    request.environ['psst.events'] = stream
+    return stream
+
+
+@application.post('/login')
+@writes
+def login(db):
+
+    nick = request.forms.get('nick')
+    password = request.forms.get('password')
+
+    try:
+        ok = nick is not None and password is not None and users.check_login(db, nick, password)
+    except passwords.LoginBusy:
+        response.status = 503
+        response.set_header('Retry-After', '5')
+        return template('general', title="Psst!", content="Too many people are logging in, please try again shortly")
+
+    if ok:
+        users.generate_session(db, nick)
+        see_other('/')
+
+    return template('general', title="Psst!", content="Login Failed, please try again")
+
+
+@application.post('/post')
+@writes
+def post(db):
+
+    nick = users.session_user(db, cached=False)
+    if nick is None:
+        raise HTTPError(403, "You must be logged in to post")
+
+    content = request.forms.getunicode('post', '')
+    if not content.strip():
+        see_other('/')
+    if interface.post_add(db, nick, content) is None:
+        response.status = 400
+        return template('general', title="Psst!",
+                        content="Posts can be at most %d characters long" % interface.MAX_POST_LENGTH)
+
+    see_other('/')
+
+
+@application.post('/logout')
+@writes
+def logout(db):
+
+    nick = users.session_user(db, cached=False)
+    if nick is not None:
+        users.delete_session(db, nick)
+
+    see_other('/')
+
 
 @application.route('/static/<filename:path>')
 def static(filename):
-    return static_file(filename=filename, root='static')
 
+    asset, fingerprinted = static_assets.get(filename)
+    if asset is None:
+        raise HTTPError(404, "File does not exist.")
+
+    body, etag = asset.body, asset.etag
+    if asset.compressed is not None and compress.accepts_gzip(request.headers.get('Accept-Encoding')):
+        body, etag = asset.compressed, asset.etag[:-1] + '-gzip"'
+        response.set_header('Content-Encoding', 'gzip')
+
+    response.content_type = asset.content_type
+    response.set_header('ETag', etag)
+    response.set_header('Vary', 'Accept-Encoding')
+    if fingerprinted:
+        # the name changes whenever the contents do
+        response.set_header('Cache-Control', 'public, max-age=%d, immutable' % IMMUTABLE_MAX_AGE)
+    else:
+        response.set_header('Cache-Control', 'public, no-cache')
+
+    if not_modified(etag, None):
+        res = response.copy(cls=HTTPResponse)
+        res.status = 304
+        res.body = ""
+        raise res
+
+    return body
+
+
+@application.route('/metrics')
+def metrics_page():
+
+    response.content_type = 'text/plain; version=0.0.4; charset=utf-8'
+    return metrics.exposition()
+
+
+# compress responses and measure every request, including ones that
+# match no route, the time taken includes compression
+application.wsgi = metrics.MetricsMiddleware(compress.GzipMiddleware(application.wsgi))
 
 
 
 if __name__ == '__main__':
-    application.run(debug=True)
\ No newline at end of file
+    users.SessionSweeper(db_plugin.dbname).start()
+    votes.RankingRefresher(db_plugin.dbname).start()
+    archive.Archiver(db_plugin.dbname).start()
+    application.run(debug=True)
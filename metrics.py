@@ -0,0 +1,284 @@
+"""
+Request metrics in the Prometheus text format.
+
+MetricsMiddleware wraps the WSGI application and, for every request,
+records the time taken against the route that handled it along with
+the time spent rendering templates and the number of SQL statements
+run and the time they took, including those of its writes applied by
+another request's thread.  The figures for the request being handled
+are kept in a thread local RequestStats which database cursors
+(TimedCursor) and templates (TimedTemplate) add to.
+
+Everything is kept in memory in this process and served by the
+/metrics route, ready to be scraped by Prometheus.  Recording a request
+costs a few microseconds; set PSST_METRICS=0 to turn it off.
+"""
+
+import bisect
+import sqlite3
+import threading
+import time
+
+import bottle
+
+import config
+
+
+# upper bounds of the histogram buckets for durations in seconds and query counts
+SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+def _labels(names, values, extra=''):
+    """Return the {name="value",...} part of a sample line"""
+
+    pairs = ['%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+             for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter():
+    """A count for each combination of label values"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        """Generate the sample lines for this metric"""
+
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield '%s%s %s' % (self.name, _labels(self.labels, labels), value)
+
+
+class Histogram():
+    """Counts of observations falling in each of a set of buckets,
+    with their sum, for each combination of label values"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=SECONDS_BUCKETS):
+
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # labels -> [count in each bucket and one for +Inf, sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, labels=()):
+
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [[0] * (len(self.buckets) + 1), 0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self):
+        """Generate the sample lines for this metric, the bucket
+        counts are cumulative as Prometheus expects"""
+
+        with self._lock:
+            values = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._values.items())
+        for labels, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield '%s_bucket%s %d' % (self.name, _labels(self.labels, labels, 'le="%s"' % bound), cumulative)
+            yield '%s_sum%s %r' % (self.name, _labels(self.labels, labels), total)
+            yield '%s_count%s %d' % (self.name, _labels(self.labels, labels), cumulative)
+
+
+REQUESTS = Counter('psst_requests_total', "Requests handled", ('route', 'method', 'status'))
+REQUEST_SECONDS = Histogram('psst_request_duration_seconds', "Time to handle a request", ('route', 'method'))
+RENDER_SECONDS = Histogram('psst_render_duration_seconds', "Time spent rendering templates in a request", ('route',))
+SQL_QUERIES = Histogram('psst_sql_queries_per_request', "SQL statements run in a request", ('route',), COUNT_BUCKETS)
+SQL_SECONDS = Histogram('psst_sql_duration_seconds', "Time spent in SQL in a request", ('route',))
+
+METRICS = [REQUESTS, REQUEST_SECONDS, RENDER_SECONDS, SQL_QUERIES, SQL_SECONDS]
+
+
+def exposition():
+    """Return all the metrics in the Prometheus text format"""
+
+    lines = []
+    for metric in METRICS:
+        lines.append('# HELP %s %s' % (metric.name, metric.help))
+        lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
+
+
+class RequestStats():
+    """The work done so far by the request being handled"""
+
+    __slots__ = ('queries', 'sql_seconds', 'render_seconds')
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.render_seconds = 0.0
+
+
+_local = threading.local()
+
+
+def current():
+    """Return the RequestStats of the request being handled by this
+    thread, or None if it isn't handling one"""
+
+    return getattr(_local, 'stats', None)
+
+
+def attribute(stats):
+    """Make stats the RequestStats that this thread's queries are added
+    to, eg. while it runs another request's write (see writer), and
+    return the one it replaces"""
+
+    previous = getattr(_local, 'stats', None)
+    _local.stats = stats
+    return previous
+
+
+def _timed(method, statement=False):
+    """Wrap a cursor method to add the time it takes to the current
+    request, counting a query if statement is True"""
+
+    def wrapper(self, *args):
+        stats = getattr(_local, 'stats', None)
+        if stats is None:
+            return method(self, *args)
+        if statement:
+            stats.queries += 1
+        start = time.perf_counter()
+        try:
+            return method(self, *args)
+        finally:
+            stats.sql_seconds += time.perf_counter() - start
+
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
+class TimedCursor(sqlite3.Cursor):
+    """A cursor that counts the statements it runs for the current
+    request and adds the time spent running them and fetching their
+    results.  This is much cheaper than a sqlite3 trace callback, which
+    is given the text of every statement with its parameters filled in"""
+
+    execute = _timed(sqlite3.Cursor.execute, True)
+    executemany = _timed(sqlite3.Cursor.executemany, True)
+    fetchone = _timed(sqlite3.Cursor.fetchone)
+    fetchmany = _timed(sqlite3.Cursor.fetchmany)
+    fetchall = _timed(sqlite3.Cursor.fetchall)
+
+
+class TimedTemplate(bottle.SimpleTemplate):
+    """A template that adds the time taken to render it to the current request"""
+
+    def render(self, *args, **kwargs):
+
+        stats = getattr(_local, 'stats', None)
+        if stats is None:
+            return super().render(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            stats.render_seconds += time.perf_counter() - start
+
+
+def template(*args, **kwargs):
+    """bottle.template, timing the rendering"""
+
+    kwargs.setdefault('template_adapter', TimedTemplate)
+    return bottle.template(*args, **kwargs)
+
+
+class _ClosingBody():
+    """Passes through a response body, calling done when it is closed"""
+
+    def __init__(self, body, done):
+        self.body = body
+        self.done = done
+
+    def __iter__(self):
+        return iter(self.body)
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            self.done()
+
+
+class MetricsMiddleware():
+    """WSGI middleware recording the metrics of each request to app,
+    a Bottle application or the wsgi method of one"""
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+
+        if not config.METRICS:
+            return self.app(environ, start_response)
+
+        stats = _local.stats = RequestStats()
+        start = time.perf_counter()
+        status = []
+
+        def start_metered(status_line, headers, exc_info=None):
+            status[:] = [status_line[:3]]
+            return start_response(status_line, headers, exc_info)
+
+        def done():
+            self.record(environ, status[0] if status else '500', stats, time.perf_counter() - start)
+            if getattr(_local, 'stats', None) is stats:
+                _local.stats = None
+
+        try:
+            body = self.app(environ, start_metered)
+        except BaseException:
+            done()
+            raise
+
+        # most responses are complete already, only streamed ones
+        # are still being made
+        if isinstance(body, (list, tuple)):
+            done()
+            return body
+        return _ClosingBody(body, done)
+
+    def record(self, environ, status, stats, elapsed):
+        """Add one request to the metrics"""
+
+        route = environ.get('bottle.route')
+        route = route.rule if route is not None else 'unmatched'
+        method = environ.get('REQUEST_METHOD', 'GET')
+
+        REQUESTS.inc((route, method, status))
+        REQUEST_SECONDS.observe(elapsed, (route, method))
+        RENDER_SECONDS.observe(stats.render_seconds, (route,))
+        SQL_QUERIES.observe(stats.queries, (route,))
+        SQL_SECONDS.observe(stats.sql_seconds, (route,))
@@ -0,0 +1,91 @@
+"""
+Tests for request metrics
+"""
+
+import unittest
+
+from webtest import TestApp
+
+import metrics
+import main
+from database import COMP249Db
+
+
+class HistogramTests(unittest.TestCase):
+
+    def test_exposition(self):
+        """Bucket counts are cumulative and labels are quoted"""
+
+        histogram = metrics.Histogram('test_seconds', "A test", ('route',), (0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 5):
+            histogram.observe(value, ('/say "hi"',))
+        lines = list(histogram.samples())
+
+        self.assertEqual(['test_seconds_bucket{route="/say \\"hi\\"",le="0.1"} 1',
+                          'test_seconds_bucket{route="/say \\"hi\\"",le="1.0"} 3',
+                          'test_seconds_bucket{route="/say \\"hi\\"",le="+Inf"} 4',
+                          'test_seconds_sum{route="/say \\"hi\\""} 6.05',
+                          'test_seconds_count{route="/say \\"hi\\""} 4'], lines)
+
+    def test_counter(self):
+
+        counter = metrics.Counter('test_total', "A test", ('status',))
+        counter.inc(('200',))
+        counter.inc(('200',))
+        counter.inc(('404',))
+        self.assertEqual(['test_total{status="200"} 2', 'test_total{status="404"} 1'], list(counter.samples()))
+
+
+class MiddlewareTests(unittest.TestCase):
+
+    def setUp(self):
+        self.app = TestApp(main.application)
+        self.db = COMP249Db()
+        self.db.create_tables()
+        self.db.sample_data(random=False)
+        self.db.close()
+
+    def sample(self, text, prefix):
+        """Return the value of the line of text starting with prefix"""
+
+        for line in text.splitlines():
+            if line.startswith(prefix + ' '):
+                return float(line.split()[-1])
+        self.fail("no sample " + prefix)
+
+    def test_metrics_page(self):
+        """Requests are counted against their route along with their SQL"""
+
+        before = self.app.get('/metrics').text
+        self.app.get('/users/Bobalooba')
+        self.app.get('/no/such/page', status=404)
+        response = self.app.get('/metrics')
+
+        self.assertEqual('text/plain', response.content_type)
+        text = response.text
+        for name in ('psst_requests_total', 'psst_request_duration_seconds', 'psst_render_duration_seconds',
+                     'psst_sql_queries_per_request', 'psst_sql_duration_seconds'):
+            self.assertIn('# TYPE ' + name, text)
+
+        self.assertIn('psst_requests_total{route="unmatched",method="GET",status="404"}', text)
+        route = '{route="/users/<nick>"}'
+        prefix = 'psst_sql_queries_per_request_count' + route
+        count = self.sample(text, prefix) - (self.sample(before, prefix) if prefix in before else 0)
+        self.assertEqual(1, count)
+        self.assertGreater(self.sample(text, 'psst_sql_queries_per_request_sum' + route), 0)
+        self.assertGreater(self.sample(text, 'psst_render_duration_seconds_sum' + route), 0)
+
+    def test_outside_request(self):
+        """Queries made outside a request are not counted"""
+
+        self.assertIsNone(metrics.current())
+        db = COMP249Db()
+        cursor = db.cursor()
+        cursor.execute("SELECT count(*) FROM posts")
+        self.assertEqual(10, cursor.fetchone()[0])
+        self.assertIsNone(metrics.current())
+        db.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
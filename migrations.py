@@ -0,0 +1,256 @@
+"""
+Versioned schema migrations for the Psst database.
+
+COMP249Db.create_tables builds the original schema (version 0) from
+scratch.  Every change after that is a numbered step in MIGRATIONS
+which upgrades a database in place without touching existing data.
+The steps that have been applied are recorded in the schema_version
+table so each runs exactly once.
+
+To bring an existing database up to date run
+
+    python migrations.py [dbname]
+"""
+
+import sqlite3
+import sys
+import time
+
+import config
+import indexing
+import timelines
+import votes
+
+
+def columns(cursor, table):
+    """Return the names of the columns in table"""
+
+    cursor.execute('PRAGMA table_info("%s")' % table)
+    return [row[1] for row in cursor.fetchall()]
+
+
+def _mentions(db):
+    """Create the mentions table and fill it from existing posts"""
+
+    cursor = db.cursor()
+    cursor.execute("""CREATE TABLE IF NOT EXISTS mentions (
+                        post_id integer,
+                        usernick text,
+                        timestamp text,
+                        FOREIGN KEY(post_id) REFERENCES posts(id),
+                        FOREIGN KEY(usernick) REFERENCES users(nick))""")
+    cursor.execute("CREATE INDEX IF NOT EXISTS mentions_usernick_timestamp ON mentions (usernick, timestamp, post_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS mentions_post_id ON mentions (post_id)")
+    indexing.reindex(db, [indexing.index_mentions], commit=False)
+
+
+def _tags(db):
+    """Create the tags and tag_counts tables and fill them from existing posts"""
+
+    cursor = db.cursor()
+    cursor.execute("""CREATE TABLE IF NOT EXISTS tags (
+                        post_id integer,
+                        tag text,
+                        timestamp text,
+                        FOREIGN KEY(post_id) REFERENCES posts(id))""")
+    cursor.execute("CREATE INDEX IF NOT EXISTS tags_tag_timestamp ON tags (tag, timestamp, post_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS tags_post_id ON tags (post_id)")
+    cursor.execute("""CREATE TABLE IF NOT EXISTS tag_counts (
+                        bucket text,
+                        tag text,
+                        count integer,
+                        PRIMARY KEY (bucket, tag))""")
+    indexing.reindex(db, [indexing.index_tags], commit=False)
+
+
+def _post_html(db):
+    """Create the post_html table and render existing posts into it"""
+
+    cursor = db.cursor()
+    cursor.execute("""CREATE TABLE IF NOT EXISTS post_html (
+                        post_id integer primary key,
+                        version integer,
+                        html text,
+                        FOREIGN KEY(post_id) REFERENCES posts(id))""")
+    indexing.reindex(db, [indexing.index_html], commit=False)
+
+
+def _timelines(db):
+    """Create the home timeline tables and build every timeline"""
+
+    cursor = db.cursor()
+    cursor.execute("""CREATE TABLE IF NOT EXISTS timelines (
+                        follower text,
+                        post_id integer,
+                        timestamp text,
+                        PRIMARY KEY (follower, timestamp, post_id)) WITHOUT ROWID""")
+    cursor.execute("""CREATE TABLE IF NOT EXISTS timeline_sizes (
+                        follower text primary key,
+                        size integer)""")
+    cursor.execute("""CREATE TABLE IF NOT EXISTS heavy_authors (
+                        nick text primary key)""")
+    timelines.rebuild(db, commit=False)
+
+
+def _session_expiry(db):
+    """Add expiry times to sessions, existing sessions expire one
+    session lifetime from now"""
+
+    cursor = db.cursor()
+    if 'expires' not in columns(cursor, 'sessions'):
+        cursor.execute("ALTER TABLE sessions ADD COLUMN expires real")
+    cursor.execute("UPDATE sessions SET expires = ?", (time.time() + config.SESSION_LIFETIME,))
+    cursor.execute("CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires)")
+
+
+def _vote_counts(db):
+    """Make votes unique per user and post, add the vote counts and
+    top posts ranking and fill them from existing votes"""
+
+    cursor = db.cursor()
+    cursor.execute("DELETE FROM votes WHERE rowid NOT IN (SELECT min(rowid) FROM votes GROUP BY post, usernick)")
+    cursor.execute("DROP INDEX IF EXISTS votes_post_usernick")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS votes_post_usernick_unique ON votes (post, usernick)")
+    cursor.execute("""CREATE TABLE IF NOT EXISTS vote_counts (
+                        post_id integer primary key,
+                        count integer)""")
+    cursor.execute("""CREATE TABLE IF NOT EXISTS vote_changes (
+                        post_id integer primary key)""")
+    cursor.execute("""CREATE TABLE IF NOT EXISTS top_posts (
+                        post_id integer primary key,
+                        score real)""")
+    cursor.execute("CREATE INDEX IF NOT EXISTS top_posts_score ON top_posts (score)")
+    votes.rebuild(db, commit=False)
+
+
+# (version, description, step) in the order they must be applied.
+# step is either a string of SQL statements or a function taking the
+# database, it is run inside the same transaction that records the version
+MIGRATIONS = [
+    (1, "secondary indexes for timeline, session, follow and vote lookups", """
+CREATE INDEX IF NOT EXISTS posts_usernick_timestamp ON posts (usernick, timestamp);
+CREATE INDEX IF NOT EXISTS posts_timestamp ON posts (timestamp);
+CREATE INDEX IF NOT EXISTS sessions_usernick ON sessions (usernick);
+CREATE INDEX IF NOT EXISTS follows_follower_followed ON follows (follower, followed);
+CREATE INDEX IF NOT EXISTS follows_followed_follower ON follows (followed, follower);
+CREATE INDEX IF NOT EXISTS votes_post_usernick ON votes (post, usernick);
+"""),
+    (2, "mentions table indexed by user and time", _mentions),
+    (3, "tags table and hourly tag counts", _tags),
+    (4, "rendered HTML for each post", _post_html),
+    (5, "materialised home timelines", _timelines),
+    (6, "session expiry times", _session_expiry),
+    (7, "indexes for the newest post by or mentioning a user", """
+CREATE INDEX IF NOT EXISTS posts_usernick_id ON posts (usernick, id);
+CREATE INDEX IF NOT EXISTS mentions_usernick_post_id ON mentions (usernick, post_id);
+"""),
+    (8, "one vote per user and post, vote counts and top posts ranking", _vote_counts),
+    (9, "log of follows and unfollows for the in-memory follow graph", """
+CREATE TABLE IF NOT EXISTS follow_changes (
+    id integer primary key,
+    follower text,
+    followed text,
+    added integer);
+"""),
+    (10, "catalog of the monthly post archives", """
+CREATE TABLE IF NOT EXISTS archives (
+    month text primary key,
+    oldest text,
+    newest text,
+    posts integer);
+"""),
+]
+
+
+def statements(sql):
+    """Split a string of SQL into complete statements"""
+
+    result = []
+    current = ''
+    for line in sql.splitlines(True):
+        current += line
+        if sqlite3.complete_statement(current):
+            result.append(current.strip())
+            current = ''
+    if current.strip():
+        result.append(current.strip())
+    return result
+
+
+def current_version(db):
+    """Return the schema version of the database, 0 if no
+    migrations have been applied"""
+
+    cursor = db.cursor()
+    cursor.execute("""CREATE TABLE IF NOT EXISTS schema_version (
+                        version integer primary key,
+                        description text,
+                        applied text default CURRENT_TIMESTAMP)""")
+    cursor.execute("SELECT max(version) FROM schema_version")
+    version = cursor.fetchone()[0]
+    db.commit()
+    return version or 0
+
+
+def latest_version():
+    """Return the version that migrate will bring a database up to"""
+
+    return MIGRATIONS[-1][0]
+
+
+def migrate(db, target=None, verbose=False):
+    """Apply all migrations newer than the current schema version
+    of db, up to and including target (default all of them).
+    Each migration is applied in its own transaction.
+    Return the list of versions applied"""
+
+    if target is None:
+        target = latest_version()
+    current = current_version(db)
+
+    applied = []
+    for version, description, step in MIGRATIONS:
+        if version <= current:
+            continue
+        if version > target:
+            break
+
+        cursor = db.cursor()
+        # take the write lock before checking the version so that two
+        # processes upgrading at once don't both apply the same step
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.execute("SELECT 1 FROM schema_version WHERE version=?", (version,))
+            if cursor.fetchone() is None:
+                if verbose:
+                    print("applying %d: %s" % (version, description))
+                if callable(step):
+                    step(db)
+                else:
+                    for sql in statements(step):
+                        cursor.execute(sql)
+                cursor.execute("INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                               (version, description))
+                applied.append(version)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+    return applied
+
+
+if __name__ == '__main__':
+    # upgrade the named database, by default the one used by the application
+    from database import COMP249Db
+
+    dbname = sys.argv[1] if len(sys.argv) > 1 else config.DB_NAME
+    db = COMP249Db(dbname)
+    cursor = db.cursor()
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='posts'")
+    if cursor.fetchone() is None:
+        sys.exit("%s has no tables, create it with python database.py" % dbname)
+    print("%s is at version %d" % (dbname, current_version(db)))
+    migrate(db, verbose=True)
+    print("%s is at version %d" % (dbname, current_version(db)))
+    db.close()
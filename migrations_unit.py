@@ -0,0 +1,86 @@
+"""
+Tests for schema migrations
+"""
+
+import unittest
+
+import migrations
+import interface
+from database import COMP249Db
+
+
+class MigrationTests(unittest.TestCase):
+
+    def setUp(self):
+        self.db = COMP249Db(':memory:')
+        self.db.create_tables()
+        self.db.sample_data(random=False)
+
+    def make_legacy(self):
+        """Turn the test database back into one made before migrations
+        existed: original tables and data but no indexes, derived
+        tables or version table"""
+
+        cursor = self.db.cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")
+        for (name,) in cursor.fetchall():
+            if name not in ('users', 'sessions', 'posts', 'votes', 'follows'):
+                cursor.execute('DROP TABLE "%s"' % name)
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='index' AND sql IS NOT NULL")
+        for (name,) in cursor.fetchall():
+            cursor.execute('DROP INDEX "%s"' % name)
+        # and the original sessions table
+        cursor.execute("DROP TABLE sessions")
+        cursor.execute("CREATE TABLE sessions (sessionid text unique primary key, usernick text)")
+        cursor.execute("INSERT INTO sessions VALUES ('abc', 'Bobalooba')")
+        self.db.commit()
+
+    def test_create_tables_is_current(self):
+        """A new database starts at the latest version"""
+
+        self.assertEqual(migrations.latest_version(), migrations.current_version(self.db))
+        # nothing more to do
+        self.assertEqual([], migrations.migrate(self.db))
+
+    def test_upgrade_keeps_data(self):
+        """Migrating a legacy database keeps the existing posts"""
+
+        self.make_legacy()
+        self.assertEqual(0, migrations.current_version(self.db))
+
+        applied = migrations.migrate(self.db)
+        self.assertEqual([m[0] for m in migrations.MIGRATIONS], applied)
+        self.assertEqual(migrations.latest_version(), migrations.current_version(self.db))
+
+        self.assertEqual(10, len(interface.post_list(self.db)))
+        self.assertEqual(3, len(interface.post_list(self.db, usernick='Mandible')))
+        # derived tables are filled from the existing posts
+        self.assertEqual([2, 5], [p[0] for p in interface.post_list_mentions(self.db, 'Contrary')])
+        # existing sessions are given an expiry time
+        cursor = self.db.cursor()
+        cursor.execute("SELECT count(*) FROM sessions WHERE expires > strftime('%s', 'now')")
+        self.assertEqual(1, cursor.fetchone()[0])
+
+    def test_user_posts_use_index(self):
+        """Listing a user's posts is an index search not a table scan"""
+
+        cursor = self.db.cursor()
+        cursor.execute("""EXPLAIN QUERY PLAN SELECT id FROM posts WHERE usernick=?
+                          ORDER BY timestamp DESC LIMIT 50""", ('Mandible',))
+        plan = ' '.join(row[-1] for row in cursor.fetchall())
+        self.assertIn('posts_usernick_timestamp', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_statements(self):
+        """SQL is split into complete statements"""
+
+        sql = """CREATE TABLE a (x);
+CREATE TRIGGER t AFTER INSERT ON a BEGIN
+    DELETE FROM a;
+END;
+"""
+        self.assertEqual(2, len(migrations.statements(sql)))
+
+
+if __name__ == "__main__":
+    unittest.main()
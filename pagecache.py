@@ -0,0 +1,94 @@
+"""
+Rendered timeline pages for visitors who aren't logged in.
+
+Most page views are anonymous and see exactly the same HTML, so the
+rendered page is kept here until a post changes it.  Pages are grouped
+by what they show: ('all', None) for the front page, ('user', nick)
+for a user's posts and ('mentions', nick) for the posts mentioning a
+user; a group holds every page (cursor position) of that listing.
+
+Each page is stored with the version it was rendered from, the newest
+relevant post as returned by interface.newest_post, and is only used
+while that is still the newest, so posts written by other processes
+are never missed.  interface.post_add also calls post_added so that
+pages it changes are dropped straight away.
+"""
+
+import threading
+from collections import OrderedDict
+
+import config
+
+
+class PageCache():
+    """
+    Rendered pages by group and page key, holding at most maxsize
+    pages.  When full the least recently used group is discarded.
+    """
+
+    def __init__(self, maxsize):
+
+        self.maxsize = maxsize
+        self._groups = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, group, key, version):
+        """Return the page stored for key in group if it was rendered
+        from version, otherwise None"""
+
+        with self._lock:
+            pages = self._groups.get(group)
+            if pages is None:
+                return None
+            item = pages.get(key)
+            if item is None or item[0] != version:
+                return None
+            self._groups.move_to_end(group)
+            return item[1]
+
+    def set(self, group, key, version, page):
+        """Store page, rendered from version, for key in group"""
+
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            pages = self._groups.setdefault(group, {})
+            if key not in pages:
+                self._size += 1
+            pages[key] = (version, page)
+            self._groups.move_to_end(group)
+            while self._size > self.maxsize:
+                group, pages = self._groups.popitem(last=False)
+                self._size -= len(pages)
+
+    def invalidate(self, group):
+        """Drop every page in group"""
+
+        with self._lock:
+            pages = self._groups.pop(group, None)
+            if pages is not None:
+                self._size -= len(pages)
+
+    def clear(self):
+        """Drop everything"""
+
+        with self._lock:
+            self._groups.clear()
+            self._size = 0
+
+    def __len__(self):
+        return self._size
+
+
+pages = PageCache(config.PAGE_CACHE_SIZE)
+
+
+def post_added(usernick, mentions):
+    """Drop the pages changed by a new post by usernick that
+    mentions the users in the list mentions"""
+
+    pages.invalidate(('all', None))
+    pages.invalidate(('user', usernick))
+    for nick in mentions:
+        pages.invalidate(('mentions', nick))
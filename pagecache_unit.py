@@ -0,0 +1,129 @@
+"""
+Tests for conditional GET and the rendered page cache
+"""
+
+import unittest
+
+from webtest import TestApp
+
+import interface
+import main
+import pagecache
+from database import COMP249Db
+
+
+class PageCacheTests(unittest.TestCase):
+
+    def test_versions(self):
+        """Pages are only returned for the version they were rendered from"""
+
+        cache = pagecache.PageCache(10)
+        cache.set(('user', 'bob'), 1, (5, 'ts'), 'page')
+        self.assertEqual('page', cache.get(('user', 'bob'), 1, (5, 'ts')))
+        self.assertIsNone(cache.get(('user', 'bob'), 1, (6, 'ts')))
+        self.assertIsNone(cache.get(('user', 'bob'), 2, (5, 'ts')))
+
+        cache.invalidate(('user', 'bob'))
+        self.assertIsNone(cache.get(('user', 'bob'), 1, (5, 'ts')))
+        self.assertEqual(0, len(cache))
+
+    def test_size(self):
+        """The least recently used groups are dropped when full"""
+
+        cache = pagecache.PageCache(3)
+        cache.set('a', 1, 1, 'a1')
+        cache.set('a', 2, 1, 'a2')
+        cache.set('b', 1, 1, 'b1')
+        cache.get('a', 1, 1)
+        cache.set('c', 1, 1, 'c1')
+        self.assertEqual(3, len(cache))
+        self.assertIsNone(cache.get('b', 1, 1))
+        self.assertEqual('a2', cache.get('a', 2, 1))
+        self.assertEqual('c1', cache.get('c', 1, 1))
+
+        # a group is dropped with all its pages
+        cache.set('d', 1, 1, 'd1')
+        self.assertEqual(2, len(cache))
+        self.assertIsNone(cache.get('a', 1, 1))
+
+
+class ConditionalTests(unittest.TestCase):
+
+    def setUp(self):
+        self.app = TestApp(main.application)
+        self.db = COMP249Db()
+        self.db.create_tables()
+        self.db.sample_data(random=False)
+        pagecache.pages.clear()
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_not_modified(self):
+        """A page is not sent again until a post appears in it"""
+
+        response = self.app.get('/users/Bobalooba')
+        etag = response.headers['ETag']
+        self.assertIn('Last-Modified', response.headers)
+
+        self.app.get('/users/Bobalooba', headers={'If-None-Match': etag}, status=304)
+        self.app.get('/users/Bobalooba', headers={'If-Modified-Since': response.headers['Last-Modified']}, status=304)
+
+        # a post by someone else doesn't change the page
+        interface.post_add(self.db, 'Contrary', 'hello')
+        self.app.get('/users/Bobalooba', headers={'If-None-Match': etag}, status=304)
+
+        interface.post_add(self.db, 'Bobalooba', 'hello')
+        response = self.app.get('/users/Bobalooba', headers={'If-None-Match': etag})
+        self.assertEqual(200, response.status_int)
+        self.assertNotEqual(etag, response.headers['ETag'])
+
+    def test_mentions(self):
+        """The mentions page changes when someone is mentioned"""
+
+        etag = self.app.get('/mentions/Contrary').headers['ETag']
+        interface.post_add(self.db, 'Bobalooba', 'hello @Mandible')
+        self.app.get('/mentions/Contrary', headers={'If-None-Match': etag}, status=304)
+        interface.post_add(self.db, 'Bobalooba', 'hello @Contrary')
+        response = self.app.get('/mentions/Contrary', headers={'If-None-Match': etag})
+        self.assertIn('hello', response)
+
+    def test_cached_pages(self):
+        """Anonymous pages are kept until a post is added to them"""
+
+        first = self.app.get('/').text
+        self.assertEqual(1, len(pagecache.pages))
+        self.app.get('/users/Contrary')
+        self.assertEqual(2, len(pagecache.pages))
+        self.assertEqual(first, self.app.get('/').text)
+
+        interface.post_add(self.db, 'Bobalooba', 'a new post')
+        self.assertEqual(1, len(pagecache.pages))
+        self.assertIn('a new post', self.app.get('/'))
+
+    def test_writes_elsewhere(self):
+        """A post added without post_add, eg. by another process, isn't missed"""
+
+        self.app.get('/')
+        cursor = self.db.cursor()
+        cursor.execute("INSERT INTO posts (timestamp, usernick, content) VALUES ('2015-02-20 00:00:00', 'Bean', 'elsewhere')")
+        self.db.commit()
+        self.assertIn('elsewhere', self.app.get('/'))
+
+    def test_login_changes_etag(self):
+        """Logged in users see a different page and it isn't cached"""
+
+        etag = self.app.get('/').headers['ETag']
+        form = self.app.get('/').forms['loginform']
+        form['nick'] = 'Bobalooba'
+        form['password'] = 'bob'
+        form.submit()
+
+        response = self.app.get('/', headers={'If-None-Match': etag})
+        self.assertEqual(200, response.status_int)
+        self.assertIn('postform', response)
+        self.assertEqual('private, no-cache', response.headers['Cache-Control'])
+
+
+if __name__ == '__main__':
+    unittest.main()
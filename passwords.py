@@ -0,0 +1,189 @@
+"""
+Password hashing.
+
+Passwords are stored as method$cost$salt$hash strings made with a
+deliberately slow key derivation function from hashlib, PBKDF2 or
+scrypt, chosen with config.PASSWORD_HASHER.  Hashes made by older
+versions of the application (a bare SHA-1 hex digest) and hashes made
+with another method or a lower cost than currently configured are
+still accepted, check_password reports that they should be replaced.
+
+Because checking a password takes a substantial fraction of a second,
+checks run on a small pool of worker threads (the hash functions
+release the GIL) with a limit on the number waiting, so that a burst of
+logins can't tie up every thread that serves pages.  The request thread
+of each check waits for it, so at most half of config.SERVER_THREADS
+checks are let in at once whatever LOGIN_QUEUE_LIMIT says.
+"""
+
+import base64
+import hashlib
+import hmac
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as ResultTimeout
+
+import config
+
+
+class LoginBusy(Exception):
+    """Raised when too many password checks are already waiting, or
+    one has taken longer than config.LOGIN_TIMEOUT"""
+
+
+def _b64(data):
+    return base64.b64encode(data).decode()
+
+
+def _unb64(text):
+    return base64.b64decode(text.encode())
+
+
+def configured_cost(method=None):
+    """Return the configured cost for method (default the configured method)"""
+
+    method = method or config.PASSWORD_HASHER
+    if method == 'pbkdf2_sha256':
+        return config.PBKDF2_ITERATIONS
+    if method == 'scrypt':
+        return config.SCRYPT_N
+    raise ValueError("unknown password hasher %s" % method)
+
+
+def minimum_cost(method=None):
+    """Return the lowest cost for method, used for sample data so
+    that tests run quickly.  Such hashes are upgraded on login"""
+
+    method = method or config.PASSWORD_HASHER
+    return {'pbkdf2_sha256': 1000, 'scrypt': 2 ** 4}[method]
+
+
+def _derive(method, cost, salt, password, params=None):
+    """Return the derived key for password"""
+
+    if method == 'pbkdf2_sha256':
+        return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, cost)
+    if method == 'scrypt':
+        r, p = params
+        return hashlib.scrypt(password.encode(), salt=salt, n=cost, r=r, p=p,
+                              maxmem=256 * cost * r + 2 ** 20)
+    raise ValueError("unknown password hasher %s" % method)
+
+
+def hash_password(password, method=None, cost=None):
+    """Return a string to store for password, using method and cost
+    (default those in config)"""
+
+    method = method or config.PASSWORD_HASHER
+    if cost is None:
+        cost = configured_cost(method)
+    salt = os.urandom(16)
+
+    if method == 'scrypt':
+        params = (config.SCRYPT_R, config.SCRYPT_P)
+        key = _derive(method, cost, salt, password, params)
+        return "scrypt$%d$%d$%d$%s$%s" % (cost, params[0], params[1], _b64(salt), _b64(key))
+
+    key = _derive(method, cost, salt, password)
+    return "%s$%d$%s$%s" % (method, cost, _b64(salt), _b64(key))
+
+
+def check_password(password, stored):
+    """Return a tuple (ok, rehash): ok is True if password matches the
+    stored hash and rehash is True if the stored hash was not made
+    with the configured method and cost"""
+
+    if '$' not in stored:
+        # legacy unsalted SHA-1
+        ok = hmac.compare_digest(hashlib.sha1(password.encode()).hexdigest(), stored)
+        return ok, True
+
+    parts = stored.split('$')
+    method = parts[0]
+    if method == 'scrypt':
+        cost, r, p, salt, key = parts[1:]
+        params = (int(r), int(p))
+    else:
+        cost, salt, key = parts[1:]
+        params = None
+    cost = int(cost)
+
+    ok = hmac.compare_digest(_derive(method, cost, _unb64(salt), password, params), _unb64(key))
+    rehash = method != config.PASSWORD_HASHER or cost < configured_cost(method)
+    return ok, rehash
+
+
+def check_and_rehash(password, stored):
+    """Return a tuple (ok, hashed): ok as for check_password, hashed a
+    new hash of password to store if it matched a hash that should be
+    replaced, otherwise None.  One job for the worker pool, so that a
+    login whose password is right doesn't need a second slot"""
+
+    ok, rehash = check_password(password, stored)
+    return ok, hash_password(password) if ok and rehash else None
+
+
+_executor = None
+_executor_lock = threading.Lock()
+_slots = None
+
+
+def limit():
+    """Return the number of checks allowed in progress at once"""
+
+    return max(1, min(config.LOGIN_WORKERS + config.LOGIN_QUEUE_LIMIT, config.SERVER_THREADS // 2))
+
+
+def _pool():
+    """Return the worker pool and its semaphore, creating them on first use"""
+
+    global _executor, _slots
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(config.LOGIN_WORKERS, thread_name_prefix='password')
+            _slots = threading.BoundedSemaphore(limit())
+        return _executor, _slots
+
+
+def run_in_pool(func, *args):
+    """Run func(*args) on the password worker pool and return its
+    result.  Raise LoginBusy if the pool already has its limit of
+    waiting work or func doesn't finish within config.LOGIN_TIMEOUT"""
+
+    executor, slots = _pool()
+    if not slots.acquire(blocking=False):
+        raise LoginBusy("too many logins in progress")
+    try:
+        future = executor.submit(func, *args)
+    except Exception:
+        slots.release()
+        raise
+    future.add_done_callback(lambda f: slots.release())
+    try:
+        return future.result(timeout=config.LOGIN_TIMEOUT)
+    except ResultTimeout:
+        raise LoginBusy("password check took more than %.1fs" % config.LOGIN_TIMEOUT) from None
+
+
+def shutdown():
+    """Stop the worker pool, a new one is made when next needed"""
+
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+            _executor = None
+
+
+def _forget_pool():
+    """A forked child has none of its parent's worker threads, so
+    start again with a new pool"""
+
+    global _executor, _executor_lock, _slots
+    _executor = None
+    _slots = None
+    _executor_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_pool)
@@ -0,0 +1,189 @@
+"""
+Tests for password hashing and the password worker pool
+"""
+
+import hashlib
+import http.client
+import threading
+import time
+import unittest
+
+import config
+import passwords
+import server
+import users
+from database import COMP249Db
+
+
+class PasswordTests(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = (config.PASSWORD_HASHER, config.LOGIN_WORKERS, config.LOGIN_QUEUE_LIMIT,
+                      config.SERVER_THREADS, config.LOGIN_TIMEOUT)
+
+    def tearDown(self):
+        (config.PASSWORD_HASHER, config.LOGIN_WORKERS, config.LOGIN_QUEUE_LIMIT,
+         config.SERVER_THREADS, config.LOGIN_TIMEOUT) = self.saved
+        passwords.shutdown()
+
+    def test_round_trip(self):
+        """Hashes made by each method check correctly"""
+
+        for method in ('pbkdf2_sha256', 'scrypt'):
+            config.PASSWORD_HASHER = method
+            stored = passwords.hash_password('secret', cost=passwords.minimum_cost())
+            self.assertTrue(stored.startswith(method + '$'))
+            # low cost hashes should be upgraded
+            self.assertEqual((True, True), passwords.check_password('secret', stored))
+            self.assertEqual((False, True), passwords.check_password('wrong', stored))
+
+            stored = passwords.hash_password('secret', cost=passwords.configured_cost())
+            self.assertEqual((True, False), passwords.check_password('secret', stored))
+
+        # salted, so the same password hashes differently
+        self.assertNotEqual(passwords.hash_password('secret', 'pbkdf2_sha256', 1000),
+                            passwords.hash_password('secret', 'pbkdf2_sha256', 1000))
+
+    def test_legacy_rehash(self):
+        """A legacy SHA-1 hash is replaced when the user logs in"""
+
+        db = COMP249Db(':memory:')
+        db.create_tables()
+        db.sample_data(random=False)
+        cursor = db.cursor()
+        cursor.execute("UPDATE users SET password = ? WHERE nick = 'Bobalooba'",
+                       (hashlib.sha1(b'bob').hexdigest(),))
+        db.commit()
+
+        self.assertFalse(users.check_login(db, 'Bobalooba', 'wrong'))
+        self.assertTrue(users.check_login(db, 'Bobalooba', 'bob'))
+
+        cursor.execute("SELECT password FROM users WHERE nick = 'Bobalooba'")
+        stored = cursor.fetchone()[0]
+        self.assertTrue(stored.startswith(config.PASSWORD_HASHER + '$'))
+        self.assertEqual((True, False), passwords.check_password('bob', stored))
+        self.assertTrue(users.check_login(db, 'Bobalooba', 'bob'))
+
+    def test_rehash_one_slot(self):
+        """A login that replaces the stored hash takes only one slot in
+        the worker pool"""
+
+        db = COMP249Db(':memory:')
+        db.create_tables()
+        db.sample_data(random=False)
+        cursor = db.cursor()
+        cursor.execute("UPDATE users SET password = ? WHERE nick = 'Bobalooba'",
+                       (hashlib.sha1(b'bob').hexdigest(),))
+        db.commit()
+
+        jobs = []
+        run_in_pool = passwords.run_in_pool
+
+        def counted(func, *args):
+            jobs.append(func)
+            return run_in_pool(func, *args)
+
+        passwords.run_in_pool = counted
+        try:
+            self.assertTrue(users.check_login(db, 'Bobalooba', 'bob'))
+        finally:
+            passwords.run_in_pool = run_in_pool
+        self.assertEqual(1, len(jobs))
+        cursor.execute("SELECT password FROM users WHERE nick = 'Bobalooba'")
+        self.assertTrue(cursor.fetchone()[0].startswith(config.PASSWORD_HASHER + '$'))
+
+    def test_timeout(self):
+        """A check that takes too long is refused as busy"""
+
+        config.LOGIN_TIMEOUT = 0.05
+        self.assertRaises(passwords.LoginBusy, passwords.run_in_pool, time.sleep, 0.5)
+
+    def test_busy(self):
+        """Checks beyond the queue limit are refused rather than queued"""
+
+        passwords.shutdown()
+        config.LOGIN_WORKERS = 1
+        config.LOGIN_QUEUE_LIMIT = 0
+
+        started = threading.Event()
+        release = threading.Event()
+
+        def block():
+            started.set()
+            release.wait(5)
+
+        thread = threading.Thread(target=passwords.run_in_pool, args=(block,))
+        thread.start()
+        started.wait(5)
+        try:
+            self.assertRaises(passwords.LoginBusy, passwords.run_in_pool, len, '')
+        finally:
+            release.set()
+            thread.join()
+
+        # and the slot is free again afterwards
+        self.assertEqual(0, passwords.run_in_pool(len, ''))
+
+    def test_burst(self):
+        """More logins at once than the server has threads leave
+        threads free to serve pages"""
+
+        passwords.shutdown()
+        config.LOGIN_WORKERS = 1
+        config.LOGIN_QUEUE_LIMIT = 32
+        config.SERVER_THREADS = 4
+        release = threading.Event()
+
+        def app(environ, start_response):
+            status = '200 OK'
+            if environ['PATH_INFO'] == '/login':
+                try:
+                    passwords.run_in_pool(release.wait, 5)
+                except passwords.LoginBusy:
+                    status = '503 Service Unavailable'
+            start_response(status, [('Content-Type', 'text/plain'), ('Content-Length', '0')])
+            return [b'']
+
+        sock = server.listen('127.0.0.1', 0)
+        httpd = server.PooledWSGIServer(sock, app, config.SERVER_THREADS)
+        thread = threading.Thread(target=httpd.serve_forever, kwargs={'poll_interval': 0.05})
+        thread.start()
+        port = sock.getsockname()[1]
+
+        def get(path, results):
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+            connection.request('GET', path)
+            results.append(connection.getresponse().status)
+            connection.close()
+
+        logins = []
+        clients = [threading.Thread(target=get, args=('/login', logins)) for i in range(3 * config.SERVER_THREADS)]
+        try:
+            for client in clients:
+                client.start()
+            # the refused logins have been answered
+            deadline = time.monotonic() + 5
+            while len(logins) < 3 * config.SERVER_THREADS - passwords.limit() and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+            start = time.monotonic()
+            pages = []
+            get('/page', pages)
+            self.assertEqual([200], pages)
+            self.assertLess(time.monotonic() - start, 1)
+        finally:
+            release.set()
+            for client in clients:
+                client.join()
+            httpd.shutdown()
+            thread.join()
+            httpd.server_close()
+            sock.close()
+
+        self.assertEqual(2, passwords.limit())
+        self.assertEqual(2, logins.count(200))
+        self.assertEqual(3 * config.SERVER_THREADS - 2, logins.count(503))
+
+
+if __name__ == "__main__":
+    unittest.main()
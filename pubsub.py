@@ -0,0 +1,429 @@
+"""
+New posts as they are made, for the /stream server-sent events endpoint.
+
+Each process has a Hub for each database that interface.post_add
+publishes new posts to.  A client subscribes to every post, to one
+user's posts or to the posts mentioning one user, and the posts for it
+are queued on its Subscription.  A client that falls
+config.STREAM_BUFFER posts behind is dropped rather than queueing
+without end; it reconnects with Last-Event-ID and reads what it missed
+from the database.  Posts added by other worker processes are found by
+polling the posts table every config.STREAM_POLL seconds while anyone
+is subscribed.
+
+Under server.py a stream is handed to its hub's Streamer once the
+headers have been sent: one thread per process writes to every client
+through non-blocking sockets, sending a comment every
+config.STREAM_HEARTBEAT seconds so that proxies keep idle connections
+open.  An idle client costs a socket rather than a thread.  Under other
+servers the stream is an ordinary response body that holds its request
+thread until the client goes away.
+"""
+
+import collections
+import os
+import selectors
+import socket
+import threading
+import time
+
+import config
+import indexing
+from database import COMP249Db, get_pool
+
+# milliseconds a client waits before reconnecting
+RETRY = 3000
+HEARTBEAT = b': keep-alive\n\n'
+
+
+class Subscription():
+    """The posts waiting to be sent to one client: posts by user if
+    given, posts mentioning mention if given, otherwise all posts"""
+
+    def __init__(self, user=None, mention=None, size=None):
+
+        self.user = user
+        self.mention = mention
+        self.size = config.STREAM_BUFFER if size is None else size
+        self.posts = collections.deque()
+        self.dropped = False
+        self.closed = False
+        # called with the subscription when a post is queued or it is dropped
+        self.listener = None
+        self._changed = threading.Condition()
+
+    def key(self):
+        if self.user is not None:
+            return ('user', self.user)
+        if self.mention is not None:
+            return ('mention', self.mention)
+        return None
+
+    def push(self, post):
+        """Queue post, dropping the subscription if it is full"""
+
+        with self._changed:
+            if self.dropped or self.closed:
+                return
+            if len(self.posts) >= self.size:
+                self.dropped = True
+                self.posts.clear()
+            else:
+                self.posts.append(post)
+            self._changed.notify()
+            listener = self.listener
+        if listener is not None:
+            listener(self)
+
+    def take(self, timeout=0):
+        """Return the queued posts, oldest first, waiting up to timeout
+        seconds for one if there are none"""
+
+        with self._changed:
+            if timeout:
+                self._changed.wait_for(lambda: self.posts or self.dropped or self.closed, timeout)
+            posts = list(self.posts)
+            self.posts.clear()
+            return posts
+
+    def close(self):
+        with self._changed:
+            self.closed = True
+            self._changed.notify()
+
+
+class Hub():
+    """The subscriptions to the posts of one database"""
+
+    def __init__(self, dbname):
+
+        self.dbname = dbname
+        # Subscription.key() -> set of subscriptions
+        self.subscriptions = {}
+        # the last post seen by poll, the posts published here since
+        self.last_id = None
+        self.published = set()
+        self.schema = None
+        self.streamer = Streamer(self)
+        self._lock = threading.Lock()
+
+    def subscribe(self, user=None, mention=None, size=None):
+        """Return a new Subscription, see Subscription for the arguments"""
+
+        subscription = Subscription(user, mention, size)
+        with self._lock:
+            self.subscriptions.setdefault(subscription.key(), set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+
+        subscription.close()
+        with self._lock:
+            group = self.subscriptions.get(subscription.key())
+            if group is not None:
+                group.discard(subscription)
+                if not group:
+                    del self.subscriptions[subscription.key()]
+
+    def count(self):
+        """Return the number of subscriptions"""
+
+        with self._lock:
+            return sum(len(group) for group in self.subscriptions.values())
+
+    def _subscribers(self, post, mentions):
+        """Return the subscriptions that post should be sent to"""
+
+        keys = [None, ('user', post[2])] + [('mention', nick) for nick in mentions]
+        return [subscription for key in keys for subscription in self.subscriptions.get(key, ())]
+
+    def publish(self, post, mentions):
+        """Queue post, a tuple (id, timestamp, usernick, avatar, content)
+        mentioning the nicks in mentions, for its subscribers unless
+        poll has found it already"""
+
+        with self._lock:
+            if self.last_id is not None:
+                if post[0] <= self.last_id:
+                    return
+                self.published.add(post[0])
+            subscribers = self._subscribers(post, mentions)
+        for subscription in subscribers:
+            subscription.push(post)
+
+    def poll(self, cursor):
+        """Publish the posts added since the last poll that weren't
+        published here, ie. those added by other processes"""
+
+        cursor.execute("PRAGMA schema_version")
+        schema = cursor.fetchone()[0]
+        with self._lock:
+            if schema != self.schema:
+                # a new database, or the first poll
+                cursor.execute("SELECT max(id) FROM posts")
+                self.last_id = cursor.fetchone()[0] or 0
+                self.published.clear()
+                self.schema = schema
+                return
+            last_id = self.last_id
+
+        cursor.execute("""SELECT posts.id, posts.timestamp, posts.usernick, users.avatar, posts.content
+                          FROM posts JOIN users ON posts.usernick = users.nick
+                          WHERE posts.id > ? ORDER BY posts.id LIMIT 1000""", (last_id,))
+        for post in cursor.fetchall():
+            with self._lock:
+                subscribers = []
+                if post[0] <= self.last_id:
+                    # found by a poll in another thread
+                    continue
+                if post[0] not in self.published:
+                    subscribers = self._subscribers(post, indexing.parse_mentions(post[4]))
+                self.last_id = post[0]
+            for subscription in subscribers:
+                subscription.push(post)
+        with self._lock:
+            self.published = {post_id for post_id in self.published if post_id > self.last_id}
+
+
+class EventStream():
+    """The body of a /stream response: the posts of subscription as
+    server-sent events, their data made by format(post), after the
+    posts in backlog (oldest first) that the client missed"""
+
+    def __init__(self, hub, subscription, format, backlog=()):
+
+        self.hub = hub
+        self.subscription = subscription
+        self.format = format
+        self.sent = 0
+        self.out = bytearray(b'retry: %d\n\n' % RETRY + self.events(backlog))
+        # queued posts that were in the backlog are skipped
+        self.sent = max([post[0] for post in backlog], default=0)
+        # set once handed to the streamer
+        self.sock = None
+        self.stalled = 0
+
+    def events(self, posts):
+        """Return the events for posts as bytes"""
+
+        return ''.join('id: %d\nevent: post\ndata: %s\n\n' % (post[0], self.format(post))
+                       for post in posts if post[0] > self.sent).encode()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        # the events are sent by the request thread
+
+        if self.out:
+            chunk = bytes(self.out)
+            self.out.clear()
+            return chunk
+        if self.subscription.dropped or self.subscription.closed:
+            raise StopIteration
+        posts = self.subscription.take(config.STREAM_HEARTBEAT)
+        if self.subscription.dropped:
+            raise StopIteration
+        return self.events(posts) or HEARTBEAT
+
+    def detach(self, sock):
+        """Send the rest of the stream to sock from the streamer thread,
+        sock is closed when the client goes away"""
+
+        self.sock = sock
+        self.hub.streamer.add(self)
+
+    def close(self):
+        if self.sock is None:
+            self.hub.unsubscribe(self.subscription)
+
+
+class Streamer(threading.Thread):
+    """Writes the streams handed to it to their clients' sockets and
+    polls for posts added by other processes"""
+
+    def __init__(self, hub):
+
+        super().__init__(name='stream %s' % hub.dbname, daemon=True)
+        self.hub = hub
+        self.selector = selectors.DefaultSelector()
+        self._wake_in, self._wake_out = socket.socketpair()
+        self._wake_in.setblocking(False)
+        self._wake_out.setblocking(False)
+        self.selector.register(self._wake_in, selectors.EVENT_READ)
+        self.streams = set()
+        # streams handed over and streams with posts queued, since the loop last looked
+        self._added = []
+        self._ready = set()
+        self._lock = threading.Lock()
+
+    def add(self, stream):
+        """Take over stream, whose socket has been sent the headers"""
+
+        stream.subscription.listener = lambda subscription: self.ready(stream)
+        with self._lock:
+            self._added.append(stream)
+        self.wake()
+
+    def ready(self, stream):
+        with self._lock:
+            waiting = bool(self._ready)
+            self._ready.add(stream)
+        if not waiting:
+            self.wake()
+
+    def wake(self):
+        try:
+            self._wake_out.send(b'.')
+        except BlockingIOError:
+            # it has plenty of wake ups already
+            pass
+
+    def run(self):
+
+        next_poll = next_heartbeat = time.monotonic()
+        while True:
+            timeout = max(0, min(next_poll, next_heartbeat) - time.monotonic())
+            for key, events in self.selector.select(timeout):
+                if key.fileobj is self._wake_in:
+                    try:
+                        while self._wake_in.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                elif events & selectors.EVENT_READ:
+                    # clients send nothing, this is the end of the connection
+                    try:
+                        closed = not key.fileobj.recv(4096)
+                    except BlockingIOError:
+                        closed = False
+                    except OSError:
+                        closed = True
+                    if closed:
+                        self.close(key.data)
+                    elif events & selectors.EVENT_WRITE:
+                        self.send(key.data)
+                else:
+                    self.send(key.data)
+
+            with self._lock:
+                added, self._added = self._added, []
+                ready, self._ready = self._ready, set()
+            for stream in added:
+                stream.sock.setblocking(False)
+                self.selector.register(stream.sock, selectors.EVENT_READ, stream)
+                self.streams.add(stream)
+                ready.add(stream)
+            for stream in ready:
+                if stream in self.streams:
+                    self.send(stream)
+
+            now = time.monotonic()
+            if now >= next_heartbeat:
+                next_heartbeat = now + config.STREAM_HEARTBEAT
+                self.heartbeat()
+            if now >= next_poll:
+                next_poll = now + config.STREAM_POLL
+                self.poll()
+
+    def send(self, stream):
+        """Send what stream has to send without blocking"""
+
+        if stream.subscription.dropped:
+            self.close(stream)
+            return
+        if not stream.out:
+            stream.out += stream.events(stream.subscription.take())
+        if stream.out:
+            try:
+                sent = stream.sock.send(stream.out)
+            except BlockingIOError:
+                sent = 0
+            except OSError:
+                self.close(stream)
+                return
+            del stream.out[:sent]
+        # wait for the client to take more if it couldn't all be sent
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if stream.out else 0)
+        if self.selector.get_key(stream.sock).events != events:
+            self.selector.modify(stream.sock, events, stream)
+
+    def heartbeat(self):
+        """Send a comment to every idle client, closing those that have
+        taken nothing since the last heartbeat"""
+
+        for stream in list(self.streams):
+            if stream.out:
+                stream.stalled += 1
+                if stream.stalled >= 2:
+                    self.close(stream)
+                continue
+            stream.stalled = 0
+            stream.out += HEARTBEAT
+            self.send(stream)
+
+    def poll(self):
+
+        if self.hub.dbname == ':memory:' or not self.hub.count():
+            return
+        db = COMP249Db(self.hub.dbname, pool=get_pool(self.hub.dbname, readonly=True))
+        try:
+            self.hub.poll(db.cursor())
+        except Exception:
+            # eg. the database is being made again, try at the next poll
+            pass
+        finally:
+            db.close()
+
+    def close(self, stream):
+
+        self.streams.discard(stream)
+        try:
+            self.selector.unregister(stream.sock)
+        except KeyError:
+            pass
+        stream.sock.close()
+        self.hub.unsubscribe(stream.subscription)
+
+
+_hubs = {}
+_hubs_lock = threading.Lock()
+
+
+def get_hub(db):
+    """Return the hub for db's database, with the posts of other
+    processes published up to now"""
+
+    with _hubs_lock:
+        hub = _hubs.get(db.dbname)
+        if hub is None:
+            hub = _hubs[db.dbname] = Hub(db.dbname)
+            hub.streamer.start()
+    if db.dbname != ':memory:':
+        hub.poll(db.cursor())
+    return hub
+
+
+def _forget_hubs():
+    """A forked child has none of its parent's streamer threads"""
+
+    global _hubs, _hubs_lock
+    _hubs = {}
+    _hubs_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_hubs)
+
+
+def post_added(db, post_id, timestamp, usernick, content):
+    """Publish a post just committed to db to the subscribers in this process"""
+
+    hub = _hubs.get(db.dbname)
+    if hub is None or not hub.count():
+        return
+    cursor = db.cursor()
+    cursor.execute("SELECT avatar FROM users WHERE nick = ?", (usernick,))
+    row = cursor.fetchone()
+    hub.publish((post_id, timestamp, usernick, row[0] if row else None, content),
+                indexing.parse_mentions(content))
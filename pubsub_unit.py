@@ -0,0 +1,180 @@
+"""
+Tests for the live post stream
+"""
+
+import json
+import socket
+import threading
+import unittest
+
+from webtest import TestApp
+
+import config
+import interface
+import main
+import pubsub
+import server
+from database import COMP249Db
+
+
+def post(post_id, usernick='Bobalooba', content='hello'):
+    return (post_id, '2015-02-20 00:00:00', usernick, None, content)
+
+
+class HubTests(unittest.TestCase):
+
+    def setUp(self):
+        self.hub = pubsub.Hub(':memory:')
+
+    def test_filters(self):
+        """Subscribers get all posts, a user's or those mentioning a user"""
+
+        everyone = self.hub.subscribe()
+        bob = self.hub.subscribe(user='Bobalooba')
+        mary = self.hub.subscribe(mention='Contrary')
+
+        self.hub.publish(post(1), [])
+        self.hub.publish(post(2, 'Mandible', 'hi @Contrary'), ['Contrary'])
+        self.assertEqual([1, 2], [p[0] for p in everyone.take()])
+        self.assertEqual([1], [p[0] for p in bob.take()])
+        self.assertEqual([2], [p[0] for p in mary.take()])
+        self.assertEqual([], bob.take())
+
+        self.hub.unsubscribe(bob)
+        self.assertEqual(2, self.hub.count())
+        self.hub.publish(post(3), [])
+        self.assertEqual([], bob.take())
+
+    def test_slow_consumer(self):
+        """A subscriber that doesn't keep up is dropped"""
+
+        slow = self.hub.subscribe(size=2)
+        for post_id in range(1, 4):
+            self.hub.publish(post(post_id), [])
+        self.assertTrue(slow.dropped)
+        self.assertEqual([], slow.take())
+
+        stream = pubsub.EventStream(self.hub, slow, main.post_json)
+        self.assertEqual([b'retry: %d\n\n' % pubsub.RETRY], list(stream))
+
+    def test_stream(self):
+        """Events follow the backlog, skipping posts sent in it, with
+        comments when there are no posts"""
+
+        subscription = self.hub.subscribe()
+        stream = pubsub.EventStream(self.hub, subscription, main.post_json, [post(1), post(2)])
+        first = next(stream).decode()
+        self.assertTrue(first.startswith('retry: '))
+        self.assertEqual(['1', '2'], [line[4:] for line in first.splitlines() if line.startswith('id: ')])
+
+        self.hub.publish(post(2), [])
+        self.hub.publish(post(3), [])
+        event = next(stream).decode()
+        self.assertTrue(event.startswith('id: 3\nevent: post\ndata: '))
+        self.assertEqual(3, json.loads(event.splitlines()[2][6:])['id'])
+
+        heartbeat = config.STREAM_HEARTBEAT
+        config.STREAM_HEARTBEAT = 0.01
+        try:
+            self.assertEqual(pubsub.HEARTBEAT, next(stream))
+        finally:
+            config.STREAM_HEARTBEAT = heartbeat
+
+        stream.close()
+        self.assertEqual(0, self.hub.count())
+
+
+class PollTests(unittest.TestCase):
+
+    def setUp(self):
+        self.db = COMP249Db()
+        self.db.create_tables()
+        self.db.sample_data(random=False)
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_other_processes(self):
+        """Posts added elsewhere are published once by poll"""
+
+        hub = pubsub.get_hub(self.db)
+        subscription = hub.subscribe()
+
+        post_id = interface.post_add(self.db, 'Mandible', 'from here')
+        cursor = self.db.cursor()
+        cursor.execute("INSERT INTO posts (timestamp, usernick, content) VALUES ('2015-03-01 00:00:00', 'Contrary', 'there')")
+        self.db.commit()
+        hub.poll(cursor)
+        hub.poll(cursor)
+
+        self.assertEqual([(post_id, 'from here'), (post_id + 1, 'there')],
+                         [(p[0], p[4]) for p in subscription.take()])
+        hub.unsubscribe(subscription)
+
+    def test_errors(self):
+
+        app = TestApp(main.application)
+        app.get('/stream?user=Nobody', status=404)
+        app.get('/stream?user=Mandible&mention=Contrary', status=400)
+
+
+class ServerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.db = COMP249Db()
+        self.db.create_tables()
+        self.db.sample_data(random=False)
+        self.sock = server.listen('127.0.0.1', 0)
+        # one thread, each stream must give it back to be able to serve the next
+        self.httpd = server.PooledWSGIServer(self.sock, main.application, 1)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, kwargs={'poll_interval': 0.05})
+        self.thread.start()
+        self.port = self.sock.getsockname()[1]
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.thread.join()
+        self.httpd.server_close()
+        self.sock.close()
+        self.db.close()
+
+    def connect(self, path):
+        """Request path, return the socket and the response up to the first events"""
+
+        client = socket.create_connection(('127.0.0.1', self.port), timeout=5)
+        client.sendall(b'GET %s HTTP/1.1\r\nHost: localhost\r\nAccept-Encoding: gzip\r\n\r\n' % path.encode())
+        return client, self.read(client, b'retry: ')
+
+    def read(self, client, until):
+        data = b''
+        while until not in data:
+            chunk = client.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+        return data
+
+    def test_streams(self):
+        """Streams are written by the hub's thread, not request threads"""
+
+        clients = []
+        for path in ('/stream', '/stream', '/stream?mention=Contrary', '/stream?user=Bobalooba'):
+            client, head = self.connect(path)
+            self.assertIn(b'Content-Type: text/event-stream', head)
+            self.assertNotIn(b'Content-Encoding', head)
+            clients.append(client)
+
+        post_id = interface.post_add(self.db, 'Mandible', 'hello @Contrary')
+        for client in clients[:3]:
+            event = self.read(client, b'\n\n').decode()
+            self.assertIn('id: %d\nevent: post\n' % post_id, event)
+        for client in clients:
+            client.close()
+
+        # still served after the clients have gone
+        client, head = self.connect('/stream?user=Mandible')
+        client.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
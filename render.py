@@ -0,0 +1,63 @@
+"""
+Conversion of post content to HTML.
+
+The HTML for a post is computed once when the post is written and
+stored in the post_html table with the RENDER_VERSION that made it.
+Changing the rules below must increase RENDER_VERSION, posts rendered
+by an older version are then re-rendered when next displayed and
+can be brought up to date with
+
+    python indexing.py --html [dbname]
+"""
+
+import functools
+import re
+
+import config
+
+
+# increase whenever the output of post_to_html changes
+RENDER_VERSION = 2
+
+# every piece of a post that needs changing is one alternative of this
+# pattern, so a post is converted in a single scan with the text between
+# matches copied unchanged.  URLs come first so that an @ or # inside
+# one is part of the link, names can contain internal but not final
+# periods and an @ or # preceded by a word character or / is left alone.
+# Each alternative starts with a literal character (the lookbehinds come
+# after it) which lets the regex engine skip quickly over plain text
+TOKEN_RE = re.compile(r"""(?P<url>https?://[^\s'<>]+)
+                        | @(?<![\w/]@)(?P<mention>\w+(?:\.\w+)*)
+                        | \#(?<![\w/]\#)(?P<tag>\w+)
+                        | (?P<special>[<>&])""", re.VERBOSE)
+
+ESCAPES = {'<': '&lt;', '>': '&gt;', '&': '&amp;'}
+
+
+def _token_to_html(match):
+    """Return the HTML for one match of TOKEN_RE"""
+
+    kind = match.lastgroup
+    if kind == 'special':
+        return ESCAPES[match.group(kind)]
+    if kind == 'url':
+        url = match.group(kind).replace('&', '&amp;')
+        return "<a href='%s'>%s</a>" % (url, url)
+    if kind == 'mention':
+        nick = match.group(kind)
+        return "<a href='/users/%s'>@%s</a>" % (nick, nick)
+    tag = match.group(kind)
+    return "<a href='/tags/%s'>#%s</a>" % (tag, tag)
+
+
+def post_to_html(content):
+    """Convert a post to safe HTML, quote any HTML code, convert
+    URLs to live links and spot any @mentions or #tags and turn
+    them into links.  Return the HTML string"""
+
+    return TOKEN_RE.sub(_token_to_html, content)
+
+
+# posts whose stored HTML is missing or out of date are rendered
+# through this cache until the post_html table catches up
+cached_post_to_html = functools.lru_cache(maxsize=config.RENDER_CACHE_SIZE)(post_to_html)
@@ -0,0 +1,37 @@
+"""
+Tests for post_to_html beyond those in level2_unit
+"""
+
+import unittest
+
+import render
+
+
+class RenderTests(unittest.TestCase):
+
+    def test_url_with_query(self):
+        """Ampersands in a URL are escaped in the link"""
+
+        self.assertEqual("<a href='http://example.org/?a=1&amp;b=2'>http://example.org/?a=1&amp;b=2</a>",
+                         render.post_to_html("http://example.org/?a=1&b=2"))
+
+    def test_url_ends_at_markup(self):
+        """A URL does not run into following HTML"""
+
+        self.assertEqual("&lt;p&gt;<a href='http://example.org/'>http://example.org/</a>&lt;/p&gt;",
+                         render.post_to_html("<p>http://example.org/</p>"))
+
+    def test_no_links_inside_urls(self):
+        """@ and # inside a URL are part of the link"""
+
+        self.assertEqual("<a href='http://example.org/@bob#top'>http://example.org/@bob#top</a>",
+                         render.post_to_html("http://example.org/@bob#top"))
+
+    def test_mentions_and_tags(self):
+
+        self.assertEqual("<a href='/tags/ox'>#ox</a> <a href='/users/jb.x'>@jb.x</a>. me@example.org",
+                         render.post_to_html("#ox @jb.x. me@example.org"))
+
+
+if __name__ == "__main__":
+    unittest.main()
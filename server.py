@@ -0,0 +1,523 @@
+"""
+Production server for main.application.
+
+    python server.py [--host HOST] [--port PORT] [--workers N] [--threads N]
+                     [--server wsgiref|waitress] [--db DBNAME]
+
+The master process opens the listening socket and forks --workers
+worker processes (default config.SERVER_WORKERS, one per core) that
+accept connections from it, each handling up to --threads requests at
+once.  A slow request only holds up one thread, and a connection kept
+open between requests holds none until its client sends the next one.
+Workers that die are replaced.  Each worker opens its own database connections, as the pools
+in database are forgotten in a forked child.  The connections of /stream
+clients are handed to pubsub once the headers are sent, so that they
+don't hold a thread each.
+
+Signals to the master:
+
+    TERM, INT   stop accepting, let the workers finish their requests, exit
+    HUP         replace the workers one at a time (eg. after a deploy of
+                templates or static files) without refusing any connection
+
+With --workers 0 the application is served by threads in this
+process.  The default server is a threaded wsgiref server from the
+standard library that keeps HTTP/1.1 connections alive; --server
+waitress uses waitress instead if it is installed.
+"""
+
+import argparse
+import os
+import selectors
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from socketserver import TCPServer
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, ServerHandler
+
+import config
+
+
+class KeepAliveHandler(ServerHandler):
+    """Sends HTTP/1.1 responses, noting whether the client can tell
+    where the body ends"""
+
+    http_version = '1.1'
+    length_sent = False
+
+    def close(self):
+        # close() forgets the headers
+        self.length_sent = self.headers is not None and 'Content-Length' in self.headers
+        super().close()
+
+    def finish_response(self):
+        # a pubsub.EventStream is sent its first events here and the
+        # rest by the hub's streamer thread, freeing this one
+        stream = self.environ.get('psst.events')
+        if stream is None:
+            super().finish_response()
+            return
+        try:
+            for data in self.result:
+                self.write(data)
+                break
+            if self.headers_sent and self.status.startswith('200'):
+                stream.detach(self.request_handler.connection)
+                self.request_handler.detached = True
+            else:
+                for data in self.result:
+                    self.write(data)
+                self.finish_content()
+        finally:
+            self.close()
+
+
+class RequestBody():
+    """The body of a request as wsgi.input, reading no further than
+    its Content-Length and counting what is left unread"""
+
+    def __init__(self, rfile, length):
+
+        self.rfile = rfile
+        self.remaining = length
+
+    def _limit(self, size):
+        if size is None or size < 0 or size > self.remaining:
+            return self.remaining
+        return size
+
+    def read(self, size=-1):
+        data = self.rfile.read(self._limit(size))
+        self.remaining -= len(data)
+        return data
+
+    def readline(self, size=-1):
+        data = self.rfile.readline(self._limit(size))
+        self.remaining -= len(data)
+        return data
+
+    def readlines(self, hint=-1):
+        return list(iter(self.readline, b''))
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+
+class KeepAliveRequestHandler(WSGIRequestHandler):
+    """Handles the requests a client has sent on a connection, leaving
+    it idle (see IdleConnections) once there are no more unless the
+    client asked for it to be closed"""
+
+    protocol_version = 'HTTP/1.1'
+    # True once the connection has been handed to pubsub
+    detached = False
+    # True if the connection is to wait for the client's next request
+    idle = False
+    # headers and body are written separately, with Nagle's algorithm the
+    # body would wait for the client to acknowledge the headers
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        self.timeout = config.SERVER_KEEPALIVE
+        super().setup()
+
+    def handle(self):
+        # WSGIRequestHandler only handles one request, this is the
+        # loop from BaseHTTPRequestHandler, without waiting in it
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection:
+            if not self.pending():
+                self.idle = True
+                return
+            self.handle_one_request()
+
+    def pending(self):
+        """Return True if the client sends more within
+        config.SERVER_LINGER seconds, or has already if half the
+        threads are waiting like this"""
+
+        linger = self.server.linger(1)
+        self.connection.settimeout(config.SERVER_LINGER if linger else 0)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            # timed out, the file can't be read again
+            return False
+        finally:
+            if linger:
+                self.server.linger(-1)
+            self.connection.settimeout(self.timeout)
+
+    def handle_one_request(self):
+
+        try:
+            self.raw_requestline = self.rfile.readline(65537)
+        except (socket.timeout, ConnectionError):
+            self.close_connection = True
+            return
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ''
+            self.request_version = ''
+            self.command = ''
+            self.send_error(414)
+            return
+        if not self.raw_requestline:
+            self.close_connection = True
+            return
+        if not self.parse_request():
+            return
+
+        length = self.headers.get('Content-Length', '0')
+        body = RequestBody(self.rfile, int(length) if length.isdigit() else 0)
+        handler = KeepAliveHandler(body, self.wfile, self.get_stderr(), self.get_environ(),
+                                   multithread=True, multiprocess=True)
+        handler.request_handler = self
+        handler.run(self.server.get_app())
+
+        # without a length the end of the body is the end of the connection
+        if not handler.length_sent:
+            self.close_connection = True
+        # a request body the application didn't read, or one whose end
+        # isn't known, would be taken as the next request
+        if body.remaining or not length.isdigit() or 'Transfer-Encoding' in self.headers:
+            self.close_connection = True
+
+    def log_request(self, code='-', size='-'):
+        # access logs are left to the proxy in front
+        pass
+
+
+class IdleConnections(threading.Thread):
+    """Holds the connections of a PooledWSGIServer that are waiting for
+    a request, handing each to the server's thread pool once its client
+    sends one and closing those idle for config.SERVER_KEEPALIVE seconds"""
+
+    def __init__(self, server):
+
+        super().__init__(name='keep-alive', daemon=True)
+        self.server = server
+        self.selector = selectors.DefaultSelector()
+        self._wake_in, self._wake_out = socket.socketpair()
+        self._wake_in.setblocking(False)
+        self._wake_out.setblocking(False)
+        self.selector.register(self._wake_in, selectors.EVENT_READ)
+        # socket -> (client address, time it became idle)
+        self.connections = {}
+        # connections added since the loop last looked
+        self._added = []
+        self._stopped = False
+        self._lock = threading.Lock()
+
+    def add(self, request, client_address):
+        """Wait for the next request on request"""
+
+        with self._lock:
+            if not self._stopped:
+                self._added.append((request, client_address))
+                request = None
+        if request is not None:
+            self.server.shutdown_request(request)
+        else:
+            self.wake()
+
+    def wake(self):
+        try:
+            self._wake_out.send(b'.')
+        except BlockingIOError:
+            pass
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+        self.wake()
+
+    def run(self):
+
+        while True:
+            now = time.monotonic()
+            timeout = min([since + config.SERVER_KEEPALIVE - now for address, since in self.connections.values()],
+                          default=None)
+            for key, events in self.selector.select(None if timeout is None else max(0, timeout)):
+                if key.fileobj is self._wake_in:
+                    try:
+                        while self._wake_in.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                else:
+                    # a request, or the end of the connection for the handler to find
+                    self.selector.unregister(key.fileobj)
+                    address, since = self.connections.pop(key.fileobj)
+                    self.server.pool.submit(self.server.process_request_thread, key.fileobj, address)
+
+            with self._lock:
+                added, self._added = self._added, []
+                stopped = self._stopped
+            now = time.monotonic()
+            for request, address in added:
+                self.connections[request] = (address, now)
+                self.selector.register(request, selectors.EVENT_READ)
+            for request, (address, since) in list(self.connections.items()):
+                if stopped or now - since >= config.SERVER_KEEPALIVE:
+                    self.selector.unregister(request)
+                    del self.connections[request]
+                    self.server.shutdown_request(request)
+            if stopped:
+                self.selector.close()
+                self._wake_in.close()
+                self._wake_out.close()
+                return
+
+
+class PooledWSGIServer(WSGIServer):
+    """A wsgiref server handling each request on a bounded pool of
+    threads, the connections between requests waiting in IdleConnections"""
+
+    request_queue_size = 128
+
+    def __init__(self, sock, app, threads):
+
+        # the socket is made by the caller so that workers can share it
+        TCPServer.__init__(self, sock.getsockname(), KeepAliveRequestHandler, bind_and_activate=False)
+        self.socket.close()
+        self.socket = sock
+        self.server_address = sock.getsockname()
+        self.setup_environ()
+        self.set_app(app)
+        self.pool = ThreadPoolExecutor(threads, thread_name_prefix='request')
+        self.threads = threads
+        # threads waiting for the next request on their connection
+        self.lingering = 0
+        self._lock = threading.Lock()
+        self.idle = IdleConnections(self)
+        self.idle.start()
+
+    def server_bind(self):
+        # base_environ needs server_name and server_port, normally set when binding
+        host, port = self.server_address[:2]
+        self.server_name = socket.getfqdn(host)
+        self.server_port = port
+
+    def setup_environ(self):
+        self.server_bind()
+        super().setup_environ()
+
+    def get_request(self):
+        request, client_address = self.socket.accept()
+        request.setblocking(True)
+        return request, client_address
+
+    def linger(self, change):
+        """Count a thread starting (1) or ending (-1) a wait for the
+        next request, return False if it mustn't start"""
+
+        with self._lock:
+            if change > 0 and self.lingering >= self.threads // 2:
+                return False
+            self.lingering += change
+            return True
+
+    def process_request(self, request, client_address):
+        # a thread is only taken once the request has arrived
+        self.idle.add(request, client_address)
+
+    def finish_request(self, request, client_address):
+        return self.RequestHandlerClass(request, client_address, self)
+
+    def process_request_thread(self, request, client_address):
+        handler = None
+        try:
+            handler = self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            if handler is not None and handler.idle:
+                self.idle.add(request, client_address)
+            elif handler is None or not handler.detached:
+                # an event stream's socket stays open for pubsub to write to
+                self.shutdown_request(request)
+
+    def server_close(self):
+        # in-flight requests finish, idle connections are closed
+        self.idle.stop()
+        self.idle.join()
+        self.pool.shutdown(wait=True)
+
+
+def listen(host, port):
+    """Return a listening socket shared by all the workers"""
+
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(PooledWSGIServer.request_queue_size)
+    # every worker is woken for a new connection but only one gets it,
+    # the others mustn't wait in accept() where they can't be stopped
+    sock.setblocking(False)
+    return sock
+
+
+def serve(sock, threads, server='wsgiref', dbname=None, sweep=False):
+    """Serve main.application on sock with threads threads until
+    SIGTERM or SIGINT.  If sweep is True also run the expired session
+    sweeper, the top posts ranking refresher and the archiver"""
+
+    import archive
+    import main
+    import users
+    import votes
+
+    if dbname is not None:
+        main.db_plugin.dbname = dbname
+    # the number of logins let in at once is a share of these (see passwords)
+    config.SERVER_THREADS = threads
+    if sweep:
+        users.SessionSweeper(main.db_plugin.dbname).start()
+        votes.RankingRefresher(main.db_plugin.dbname).start()
+        archive.Archiver(main.db_plugin.dbname).start()
+
+    if server == 'waitress':
+        # optional, only needed if asked for
+        import waitress.server
+        httpd = waitress.server.create_server(main.application, sockets=[sock], threads=threads,
+                                              channel_timeout=max(1, int(config.SERVER_KEEPALIVE)))
+        stop = httpd.close
+        run = httpd.run
+    else:
+        httpd = PooledWSGIServer(sock, main.application, threads)
+        stop = httpd.shutdown
+
+        def run():
+            httpd.serve_forever(poll_interval=0.5)
+            httpd.server_close()
+
+    def graceful(signum, frame):
+        # shutdown() waits for serve_forever, which runs in this thread
+        threading.Thread(target=stop, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, graceful)
+    signal.signal(signal.SIGINT, graceful)
+    run()
+
+
+class Master():
+    """Forks and watches the worker processes"""
+
+    def __init__(self, sock, workers, threads, server='wsgiref', dbname=None):
+
+        self.sock = sock
+        self.workers = workers
+        self.threads = threads
+        self.server = server
+        self.dbname = dbname
+        # pid -> worker number
+        self.children = {}
+        self.stopping = False
+        self.reloading = False
+
+    def spawn(self, number):
+        """Start worker number, return its pid"""
+
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                signal.signal(signal.SIGHUP, signal.SIG_DFL)
+                # one worker runs the background jobs for everyone
+                serve(self.sock, self.threads, self.server, self.dbname, sweep=(number == 0))
+            except BaseException:
+                import traceback
+                traceback.print_exc()
+                status = 1
+            finally:
+                os._exit(status)
+        self.children[pid] = number
+        return pid
+
+    def stop(self, signum, frame):
+        self.stopping = True
+
+    def reload(self, signum, frame):
+        self.reloading = True
+
+    def replace_workers(self):
+        """Start a new worker for each old one before stopping the old
+        one, so that there is always a worker accepting connections"""
+
+        for pid, number in list(self.children.items()):
+            self.spawn(number)
+            self.kill(pid, wait=True)
+
+    def kill(self, pid, wait=False):
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+        if wait:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+            self.children.pop(pid, None)
+
+    def run(self):
+
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGHUP, self.reload)
+
+        for number in range(self.workers):
+            self.spawn(number)
+        print("serving on http://%s:%d/ with %d workers of %d threads"
+              % (self.sock.getsockname()[:2] + (self.workers, self.threads)), flush=True)
+
+        while not self.stopping:
+            if self.reloading:
+                self.reloading = False
+                self.replace_workers()
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                pid = 0
+            if pid and pid in self.children:
+                number = self.children.pop(pid)
+                if not self.stopping:
+                    print("worker %d (pid %d) exited with status %d, restarting" % (number, pid, status), flush=True)
+                    # don't spin if workers die as soon as they start
+                    time.sleep(0.5)
+                    self.spawn(number)
+            elif not pid:
+                time.sleep(0.2)
+
+        for pid in list(self.children):
+            self.kill(pid)
+        for pid in list(self.children):
+            self.kill(pid, wait=True)
+        self.sock.close()
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Serve the Psst application")
+    parser.add_argument('--host', default=config.SERVER_HOST)
+    parser.add_argument('--port', type=int, default=config.SERVER_PORT)
+    parser.add_argument('--workers', type=int, default=config.SERVER_WORKERS,
+                        help="worker processes, 0 to serve from this process")
+    parser.add_argument('--threads', type=int, default=config.SERVER_THREADS, help="threads in each worker")
+    parser.add_argument('--server', choices=('wsgiref', 'waitress'), default='wsgiref')
+    parser.add_argument('--db', help="database file (default config.DB_NAME)")
+    args = parser.parse_args(argv)
+
+    sock = listen(args.host, args.port)
+    if args.workers <= 0 or not hasattr(os, 'fork'):
+        print("serving on http://%s:%d/ with %d threads" % (sock.getsockname()[:2] + (args.threads,)), flush=True)
+        serve(sock, args.threads, args.server, args.db, sweep=True)
+    else:
+        Master(sock, args.workers, args.threads, args.server, args.db).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""
+Tests for the production server
+"""
+
+import http.client
+import socket
+import threading
+import time
+import unittest
+
+import config
+import server
+
+
+def app(environ, start_response):
+    body = environ['PATH_INFO'].encode()
+    if environ['PATH_INFO'] == '/echo':
+        body = environ['wsgi.input'].read(int(environ.get('CONTENT_LENGTH') or 0))
+    if environ['PATH_INFO'] == '/stream':
+        # no length, the connection has to be closed to end the body
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return iter([body])
+    start_response('200 OK', [('Content-Type', 'text/plain'), ('Content-Length', str(len(body)))])
+    return [body]
+
+
+class ServerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.sock = server.listen('127.0.0.1', 0)
+        self.httpd = server.PooledWSGIServer(self.sock, app, 2)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, kwargs={'poll_interval': 0.05})
+        self.thread.start()
+        self.port = self.sock.getsockname()[1]
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.thread.join()
+        self.httpd.server_close()
+        self.sock.close()
+
+    def get(self, connection, path):
+        connection.request('GET', path)
+        response = connection.getresponse()
+        return response, response.read()
+
+    def test_keep_alive(self):
+        """Requests are handled one after another on the same connection"""
+
+        connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        response, body = self.get(connection, '/one')
+        self.assertEqual((200, b'/one'), (response.status, body))
+        self.assertEqual(11, response.version)
+        sock = connection.sock
+
+        response, body = self.get(connection, '/two')
+        self.assertEqual(b'/two', body)
+        self.assertIs(sock, connection.sock)
+        connection.close()
+
+    def test_close_without_length(self):
+        """A body without a Content-Length ends the connection"""
+
+        connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        response, body = self.get(connection, '/stream')
+        self.assertEqual(b'/stream', body)
+        self.assertTrue(response.will_close)
+        connection.close()
+
+    def test_idle_connections(self):
+        """Connections waiting for a request don't hold a thread"""
+
+        # more idle connections than the server has threads, some that
+        # have had a response and some that haven't sent anything
+        idle = []
+        for i in range(3):
+            connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+            self.get(connection, '/idle')
+            idle.append(connection)
+        for i in range(3):
+            idle.append(socket.create_connection(('127.0.0.1', self.port)))
+
+        start = time.monotonic()
+        connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        response, body = self.get(connection, '/busy')
+        self.assertEqual(b'/busy', body)
+        self.assertLess(time.monotonic() - start, 1)
+
+        # and the idle ones can still be used
+        response, body = self.get(idle[0], '/again')
+        self.assertEqual(b'/again', body)
+
+        connection.close()
+        for connection in idle:
+            connection.close()
+
+    def test_idle_timeout(self):
+        """Connections idle for SERVER_KEEPALIVE seconds are closed"""
+
+        saved = config.SERVER_KEEPALIVE
+        config.SERVER_KEEPALIVE = 0.2
+        try:
+            sock = socket.create_connection(('127.0.0.1', self.port), timeout=5)
+            sock.sendall(b'GET /one HTTP/1.1\r\nHost: localhost\r\n\r\n')
+            response = http.client.HTTPResponse(sock)
+            response.begin()
+            self.assertEqual(b'/one', response.read())
+            start = time.monotonic()
+            self.assertEqual(b'', sock.recv(1))
+            self.assertLess(time.monotonic() - start, 2)
+            sock.close()
+        finally:
+            config.SERVER_KEEPALIVE = saved
+
+    def test_pipelined(self):
+        """Requests sent together are all answered"""
+
+        sock = socket.create_connection(('127.0.0.1', self.port), timeout=5)
+        sock.sendall(b'GET /one HTTP/1.1\r\nHost: localhost\r\n\r\n'
+                     b'GET /two HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        data = b''
+        while data.count(b'HTTP/1.1 200') < 2 or not data.endswith(b'/two'):
+            chunk = sock.recv(4096)
+            self.assertTrue(chunk)
+            data += chunk
+        self.assertLess(data.index(b'/one'), data.index(b'/two'))
+        sock.close()
+
+    def test_unread_body(self):
+        """A request body the application doesn't read isn't taken as
+        another request, one it reads leaves the connection open"""
+
+        smuggled = b'GET /smuggled HTTP/1.1\r\nHost: localhost\r\n\r\n'
+        sock = socket.create_connection(('127.0.0.1', self.port), timeout=5)
+        sock.sendall(b'POST /one HTTP/1.1\r\nHost: localhost\r\nContent-Length: %d\r\n\r\n' % len(smuggled) +
+                     smuggled)
+        data = b''
+        while True:
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            data += chunk
+        self.assertEqual(1, data.count(b'HTTP/1.1 200'))
+        self.assertNotIn(b'/smuggled', data)
+        sock.close()
+
+        connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        connection.request('POST', '/echo', body=b'hello')
+        response = connection.getresponse()
+        self.assertEqual(b'hello', response.read())
+        sock = connection.sock
+        response, body = self.get(connection, '/two')
+        self.assertEqual(b'/two', body)
+        self.assertIs(sock, connection.sock)
+        connection.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+"""
+Materialised home timelines.
+
+A user's home timeline is the posts of the users that they follow.
+Rather than joining posts against follows on every page view, when a
+post is written its id is copied into the timelines table for each
+follower of the author (fan-out on write).  Each timeline keeps about
+the newest config.TIMELINE_DEPTH posts; timeline_sizes counts the rows
+added so that trimming only happens once a timeline has grown well
+past that depth.
+
+Copying a post to every follower of an author with a very large number
+of followers would make posting slow, so authors with more than
+config.FANOUT_MAX_FOLLOWERS followers are listed in heavy_authors.
+Their posts are not fanned out but merged in when a timeline is read.
+
+Following or unfollowing through interface rebuilds the follower's
+timeline and moves the followed user on or off heavy_authors if that
+takes them across the limit.  After follows are added or removed in
+the database directly run
+
+    python timelines.py [dbname] [nick ...]
+
+to rebuild the timelines of the given followers (default everyone)
+and recompute the heavy authors.
+"""
+
+import sys
+
+import config
+
+
+def is_heavy(cursor, usernick):
+    """Return True if posts by usernick are merged at read time
+    rather than fanned out"""
+
+    cursor.execute("SELECT 1 FROM heavy_authors WHERE nick = ?", (usernick,))
+    return cursor.fetchone() is not None
+
+
+def trim(cursor, follower, depth=None):
+    """Remove all but the newest depth (default config.TIMELINE_DEPTH)
+    posts from the timeline of follower"""
+
+    if depth is None:
+        depth = config.TIMELINE_DEPTH
+
+    cursor.execute("""SELECT timestamp, post_id FROM timelines WHERE follower = ?
+                      ORDER BY timestamp DESC, post_id DESC LIMIT 1 OFFSET ?""", (follower, depth - 1))
+    last = cursor.fetchone()
+    if last is not None:
+        cursor.execute("DELETE FROM timelines WHERE follower = ? AND (timestamp, post_id) < (?, ?)",
+                       (follower, last[0], last[1]))
+        size = depth
+    else:
+        cursor.execute("SELECT count(*) FROM timelines WHERE follower = ?", (follower,))
+        size = cursor.fetchone()[0]
+    cursor.execute("INSERT OR REPLACE INTO timeline_sizes (follower, size) VALUES (?, ?)", (follower, size))
+
+
+def fanout(cursor, posts):
+    """Add newly written posts, a list of (post_id, timestamp, usernick)
+    tuples, to the timeline of each follower of their author, except
+    for posts by heavy authors"""
+
+    by_author = {}
+    for post_id, timestamp, usernick in posts:
+        by_author.setdefault(usernick, []).append((post_id, timestamp))
+
+    for author, authored in by_author.items():
+        if is_heavy(cursor, author):
+            continue
+
+        cursor.execute("SELECT DISTINCT follower FROM follows WHERE followed = ?", (author,))
+        followers = [row[0] for row in cursor.fetchall()]
+
+        cursor.executemany("INSERT OR IGNORE INTO timelines (follower, post_id, timestamp) VALUES (?, ?, ?)",
+                           [(follower, post_id, timestamp)
+                            for follower in followers for post_id, timestamp in authored])
+        cursor.executemany("""INSERT INTO timeline_sizes (follower, size) VALUES (?, ?)
+                              ON CONFLICT (follower) DO UPDATE SET size = size + excluded.size""",
+                           [(follower, len(authored)) for follower in followers])
+
+        # trim once a timeline is a quarter longer than it should be, so
+        # the cost of trimming is spread over many posts
+        cursor.execute("""SELECT follower FROM timeline_sizes
+                          WHERE follower IN (SELECT follower FROM follows WHERE followed = ?)
+                                AND size > ?""", (author, config.TIMELINE_DEPTH * 5 // 4))
+        for (follower,) in cursor.fetchall():
+            trim(cursor, follower)
+
+
+def find_heavy_authors(cursor):
+    """Recompute the heavy_authors table from follows"""
+
+    cursor.execute("DELETE FROM heavy_authors")
+    cursor.execute("""INSERT INTO heavy_authors (nick)
+                      SELECT followed FROM follows GROUP BY followed
+                      HAVING count(DISTINCT follower) > ?""", (config.FANOUT_MAX_FOLLOWERS,))
+
+
+def update_heavy(cursor, author):
+    """Add author to heavy_authors or remove them if a follow or
+    unfollow has taken them across config.FANOUT_MAX_FOLLOWERS, taking
+    their posts out of their followers' timelines or adding the newest
+    of them to match"""
+
+    cursor.execute("SELECT count(DISTINCT follower) FROM follows WHERE followed = ?", (author,))
+    heavy = cursor.fetchone()[0] > config.FANOUT_MAX_FOLLOWERS
+    if heavy == is_heavy(cursor, author):
+        return
+
+    if heavy:
+        cursor.execute("INSERT INTO heavy_authors (nick) VALUES (?)", (author,))
+        # from now on merged in when read
+        cursor.execute("""DELETE FROM timelines
+                          WHERE follower IN (SELECT follower FROM follows WHERE followed = ?)
+                                AND post_id IN (SELECT id FROM posts WHERE usernick = ?)""", (author, author))
+    else:
+        cursor.execute("DELETE FROM heavy_authors WHERE nick = ?", (author,))
+        cursor.execute("""SELECT id, timestamp, usernick FROM posts WHERE usernick = ?
+                          ORDER BY timestamp DESC, id DESC LIMIT ?""", (author, config.TIMELINE_DEPTH))
+        fanout(cursor, cursor.fetchall())
+
+
+def rebuild_timeline(cursor, follower):
+    """Rebuild the timeline of follower from the posts of the users
+    they follow, eg. after they follow or unfollow someone"""
+
+    cursor.execute("DELETE FROM timelines WHERE follower = ?", (follower,))
+    cursor.execute("""INSERT INTO timelines (follower, post_id, timestamp)
+                      SELECT ?, id, timestamp FROM posts
+                      WHERE usernick IN (SELECT followed FROM follows WHERE follower = ?
+                                         EXCEPT SELECT nick FROM heavy_authors)
+                      ORDER BY timestamp DESC, id DESC LIMIT ?""",
+                   (follower, follower, config.TIMELINE_DEPTH))
+    cursor.execute("INSERT OR REPLACE INTO timeline_sizes (follower, size) VALUES (?, ?)",
+                   (follower, cursor.rowcount))
+
+
+def rebuild(db, followers=None, commit=True):
+    """Rebuild the timelines of followers (default all users who
+    follow anyone) from the posts of the users that they follow.
+    If commit is True each timeline is committed as it is done.
+    Return the number of timelines rebuilt"""
+
+    cursor = db.cursor()
+    find_heavy_authors(cursor)
+
+    if followers is None:
+        cursor.execute("SELECT DISTINCT follower FROM follows")
+        followers = [row[0] for row in cursor.fetchall()]
+
+    for follower in followers:
+        rebuild_timeline(cursor, follower)
+        if commit:
+            db.commit()
+
+    return len(followers)
+
+
+if __name__ == '__main__':
+    from database import COMP249Db
+
+    dbname = sys.argv[1] if len(sys.argv) > 1 else config.DB_NAME
+    db = COMP249Db(dbname)
+    print("rebuilt %d timelines" % rebuild(db, sys.argv[2:] or None))
+    db.close()
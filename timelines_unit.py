@@ -0,0 +1,111 @@
+"""
+Tests for materialised home timelines
+"""
+
+import unittest
+
+import config
+import interface
+import timelines
+from database import COMP249Db
+
+
+class TimelineTests(unittest.TestCase):
+
+    def setUp(self):
+        self.depth = config.TIMELINE_DEPTH
+        self.max_followers = config.FANOUT_MAX_FOLLOWERS
+
+        self.db = COMP249Db(':memory:')
+        self.db.create_tables()
+        self.db.sample_data(random=False)
+        # Bean follows Contrary and Mandible as well as themselves
+        self.follow('Bean', 'Contrary')
+        self.follow('Bean', 'Mandible')
+        timelines.rebuild(self.db, ['Bean'])
+
+    def tearDown(self):
+        config.TIMELINE_DEPTH = self.depth
+        config.FANOUT_MAX_FOLLOWERS = self.max_followers
+
+    def follow(self, follower, followed):
+        cursor = self.db.cursor()
+        cursor.execute("INSERT INTO follows (follower, followed) VALUES (?, ?)", (follower, followed))
+        self.db.commit()
+
+    def timeline_ids(self, nick, **kwargs):
+        return [p[0] for p in interface.post_list_home(self.db, nick, **kwargs)]
+
+    def test_rebuild(self):
+        """A rebuilt timeline has the posts of the followed users"""
+
+        self.assertEqual([1, 4, 5, 6, 8], self.timeline_ids('Bean'))
+        # everyone else only follows themselves
+        self.assertEqual([1, 5, 6], self.timeline_ids('Mandible'))
+
+    def test_fanout(self):
+        """New posts appear in followers' timelines without a rebuild"""
+
+        postid = interface.post_add(self.db, 'Contrary', 'hello followers')
+        self.assertEqual([postid, 1, 4, 5, 6, 8], self.timeline_ids('Bean'))
+        self.assertEqual([postid, 4, 8], self.timeline_ids('Contrary'))
+        self.assertEqual([1, 5, 6], self.timeline_ids('Mandible'))
+
+    def test_trim(self):
+        """Timelines are trimmed once they grow past the depth"""
+
+        config.TIMELINE_DEPTH = 4
+        ids = [interface.post_add(self.db, 'Contrary', 'post %d' % i) for i in range(6)]
+
+        cursor = self.db.cursor()
+        cursor.execute("SELECT count(*) FROM timelines WHERE follower = 'Bean'")
+        self.assertLessEqual(cursor.fetchone()[0], 4 * 5 // 4)
+        self.assertEqual(ids[::-1][:4], self.timeline_ids('Bean', limit=4))
+
+    def test_heavy_authors(self):
+        """Posts by heavy authors are merged in when the timeline is read"""
+
+        config.FANOUT_MAX_FOLLOWERS = 1
+        self.follow('Jimbulator', 'Contrary')
+        timelines.rebuild(self.db)
+
+        postid = interface.post_add(self.db, 'Contrary', 'too popular to fan out')
+        cursor = self.db.cursor()
+        cursor.execute("SELECT count(*) FROM timelines WHERE post_id = ?", (postid,))
+        self.assertEqual(0, cursor.fetchone()[0])
+
+        self.assertEqual([postid, 1, 4, 5, 6, 8], self.timeline_ids('Bean'))
+        self.assertEqual([postid, 3, 4, 8, 10], self.timeline_ids('Jimbulator'))
+
+        # paging works across the merged posts
+        self.assertEqual([postid, 1], self.timeline_ids('Bean', limit=2))
+        self.assertEqual([5, 6], self.timeline_ids('Bean', limit=2, before=('2015-02-19 23:14:27', 4)))
+        self.assertEqual([1, 4], self.timeline_ids('Bean', limit=2, after=('2015-02-19 22:24:14', 5)))
+
+
+    def test_heavy_follow(self):
+        """Following and unfollowing move an author on and off the
+        heavy list, without losing or repeating their posts"""
+
+        config.FANOUT_MAX_FOLLOWERS = 2
+        # Contrary and Bean follow Contrary
+        cursor = self.db.cursor()
+        self.assertFalse(timelines.is_heavy(cursor, 'Contrary'))
+
+        self.assertTrue(interface.follow_add(self.db, 'Jimbulator', 'Contrary'))
+        self.assertTrue(timelines.is_heavy(cursor, 'Contrary'))
+        cursor.execute("SELECT count(*) FROM timelines JOIN posts ON post_id = posts.id WHERE usernick = 'Contrary'")
+        self.assertEqual(0, cursor.fetchone()[0])
+        self.assertEqual([1, 4, 5, 6, 8], self.timeline_ids('Bean'))
+        self.assertEqual([3, 4, 8, 10], self.timeline_ids('Jimbulator'))
+
+        self.assertTrue(interface.follow_remove(self.db, 'Jimbulator', 'Contrary'))
+        self.assertFalse(timelines.is_heavy(cursor, 'Contrary'))
+        self.assertEqual([1, 4, 5, 6, 8], self.timeline_ids('Bean'))
+        self.assertEqual([3, 10], self.timeline_ids('Jimbulator'))
+        postid = interface.post_add(self.db, 'Contrary', 'fanned out again')
+        cursor.execute("SELECT count(*) FROM timelines WHERE post_id = ?", (postid,))
+        self.assertEqual(2, cursor.fetchone()[0])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,14 +2,107 @@
 @author:
 """
 
+import base64
+import hashlib
+import hmac
+import time
+import uuid
+
 import bottle
 
+import config
+import jobs
+import passwords
+import writer
+from cache import TTLCache
+
 # this variable MUST be used as the name for the cookie used by this application
 COOKIE_NAME = 'sessionid'
 
+# (dbname, sessionid) -> usernick for recently used sessions, kept
+# consistent with the sessions table by generate_session and delete_session
+# in this process; other processes' logouts are seen by session_user(db, cached=False)
+session_cache = TTLCache(config.SESSION_CACHE_SIZE, config.SESSION_CACHE_TTL)
+
+
+# hash checked when the user doesn't exist so that unknown users take
+# as long to refuse as wrong passwords
+_unknown_user_hash = None
+
+
 def check_login(db, usernick, password):
-    """returns True if password matches stored"""
+    """returns True if password matches stored
+
+    The password is checked on the password worker pool, if too many
+    checks are already waiting or it takes too long passwords.LoginBusy
+    is raised.
+    A stored hash made with an older method or lower cost than
+    configured is replaced after a successful check"""
+
+    global _unknown_user_hash
+
+    cursor = db.cursor()
+    cursor.execute("SELECT password FROM users WHERE nick = ?", (usernick,))
+    row = cursor.fetchone()
+    if row is None:
+        if _unknown_user_hash is None:
+            _unknown_user_hash = passwords.hash_password('')
+        passwords.run_in_pool(passwords.check_password, password, _unknown_user_hash)
+        return False
+
+    stored = row[0]
+    ok, hashed = passwords.run_in_pool(passwords.check_and_rehash, password, stored)
+    if hashed is not None:
+
+        def upgrade(cursor):
+            cursor.execute("UPDATE users SET password = ? WHERE nick = ? AND password = ?",
+                           (hashed, usernick, stored))
+
+        try:
+            writer.write(db, upgrade)
+        except writer.WriteTimeout:
+            # replaced at a later login instead
+            pass
+    return ok
+
+
+def _sign(payload):
+    """Return the HMAC signature of payload using the session secret"""
+
+    if not config.SESSION_SECRET:
+        raise RuntimeError("SESSION_SECRET must be set to use signed sessions")
+    return hmac.new(config.SESSION_SECRET.encode(), payload.encode(), hashlib.sha256).hexdigest()
+
+
+def make_signed_session(usernick, expires):
+    """Return a signed session cookie value for usernick valid until
+    the time expires"""
+
+    payload = "%s.%d" % (base64.urlsafe_b64encode(usernick.encode()).decode(), expires)
+    return payload + '.' + _sign(payload)
+
+
+def parse_signed_session(value):
+    """Return the usernick from a signed session cookie value or None
+    if the signature is wrong or the session has expired"""
 
+    try:
+        payload, signature = value.rsplit('.', 1)
+        nick, expires = payload.split('.')
+        if not hmac.compare_digest(signature, _sign(payload)):
+            return None
+        if int(expires) < time.time():
+            return None
+        return base64.urlsafe_b64decode(nick.encode()).decode()
+    except (ValueError, UnicodeError):
+        return None
+
+
+def _user_exists(db, usernick):
+
+    cursor = db.cursor()
+    cursor.execute("SELECT 1 FROM users WHERE nick = ?", (usernick,))
+    return cursor.fetchone() is not None
 
 
 def generate_session(db, usernick):
@@ -19,16 +112,112 @@ def generate_session(db, usernick):
     is already a session active, use the existing sessionid in the cookie
     """
 
+    if not _user_exists(db, usernick):
+        return None
+
+    now = time.time()
+    expires = now + config.SESSION_LIFETIME
+
+    if config.SESSION_MODE == 'signed':
+        sessionid = bottle.request.get_cookie(COOKIE_NAME)
+        if sessionid is None or parse_signed_session(sessionid) != usernick:
+            sessionid = make_signed_session(usernick, expires)
+    else:
+        def store(cursor):
+            cursor.execute("SELECT sessionid FROM sessions WHERE usernick = ? AND expires > ?", (usernick, now))
+            row = cursor.fetchone()
+            if row is not None:
+                sessionid = row[0]
+                cursor.execute("UPDATE sessions SET expires = ? WHERE sessionid = ?", (expires, sessionid))
+            else:
+                sessionid = uuid.uuid4().hex
+                cursor.execute("INSERT INTO sessions (sessionid, usernick, expires) VALUES (?, ?, ?)",
+                               (sessionid, usernick, expires))
+            return sessionid
+
+        sessionid = writer.write(db, store)
+        session_cache.set((db.dbname, sessionid), usernick)
+
+    bottle.response.set_cookie(COOKIE_NAME, sessionid, path='/', max_age=config.SESSION_LIFETIME, httponly=True)
+    return sessionid
 
 
 def delete_session(db, usernick):
     """remove all session table entries for this user"""
 
+    cursor = db.cursor()
+    cursor.execute("SELECT sessionid FROM sessions WHERE usernick = ?", (usernick,))
+    for (sessionid,) in cursor.fetchall():
+        session_cache.delete((db.dbname, sessionid))
+    writer.write(db, lambda cursor: cursor.execute("DELETE FROM sessions WHERE usernick = ?", (usernick,)))
+
+    bottle.response.delete_cookie(COOKIE_NAME, path='/')
 
 
-def session_user(db):
+def session_user(db, cached=True):
     """try to
     retrieve the user from the sessions table
-    return usernick or None if no valid session is present"""
+    return usernick or None if no valid session is present
+
+    If cached is False the table is read even if the session is
+    cached, as requests that change something must do: another
+    process may have ended the session since"""
+
+    sessionid = bottle.request.get_cookie(COOKIE_NAME)
+    if sessionid is None:
+        return None
+
+    if config.SESSION_MODE == 'signed':
+        return parse_signed_session(sessionid)
+
+    if cached:
+        usernick = session_cache.get((db.dbname, sessionid))
+        if usernick is not None:
+            return usernick
+
+    cursor = db.cursor()
+    cursor.execute("SELECT usernick, expires FROM sessions WHERE sessionid = ?", (sessionid,))
+    row = cursor.fetchone()
+    if row is None:
+        session_cache.delete((db.dbname, sessionid))
+        return None
+    usernick, expires = row
+    remaining = expires - time.time()
+    if remaining <= 0:
+        session_cache.delete((db.dbname, sessionid))
+        return None
+
+    session_cache.set((db.dbname, sessionid), usernick, min(remaining, session_cache.ttl))
+    return usernick
+
+
+def sweep_sessions(db, batch_size=None, now=None):
+    """Delete expired sessions in transactions of batch_size rows
+    (default config.SESSION_SWEEP_BATCH) so the sweeper never holds
+    the write lock for long.  Return the number deleted"""
+
+    if batch_size is None:
+        batch_size = config.SESSION_SWEEP_BATCH
+    if now is None:
+        now = time.time()
+
+    cursor = db.write_cursor()
+    total = 0
+    while True:
+        cursor.execute("""DELETE FROM sessions WHERE rowid IN
+                          (SELECT rowid FROM sessions WHERE expires < ? LIMIT ?)""", (now, batch_size))
+        deleted = cursor.rowcount
+        db.commit()
+        total += deleted
+        if deleted < batch_size:
+            return total
+
+
+class SessionSweeper(jobs.PeriodicJob):
+    """A background thread that runs sweep_sessions every interval
+    seconds (default config.SESSION_SWEEP_INTERVAL) until stop() is called"""
 
+    def __init__(self, dbname=config.DB_NAME, interval=None):
 
+        super().__init__('session-sweeper', sweep_sessions, dbname,
+                         config.SESSION_SWEEP_INTERVAL if interval is None else interval)
@@ -0,0 +1,117 @@
+"""
+Tests for session expiry, caching and signed sessions beyond those in level3_unit
+"""
+
+import time
+import unittest
+
+from bottle import request
+
+import config
+import users
+from database import COMP249Db
+
+
+class SessionTests(unittest.TestCase):
+
+    def setUp(self):
+        self.mode = config.SESSION_MODE
+        self.secret = config.SESSION_SECRET
+        self.db = COMP249Db(':memory:')
+        self.db.create_tables()
+        self.db.sample_data(random=False)
+        request.cookies.pop(users.COOKIE_NAME, None)
+        users.session_cache.clear()
+
+    def tearDown(self):
+        config.SESSION_MODE = self.mode
+        config.SESSION_SECRET = self.secret
+        request.cookies.pop(users.COOKIE_NAME, None)
+
+    def login(self, nick):
+        sessionid = users.generate_session(self.db, nick)
+        request.cookies[users.COOKIE_NAME] = sessionid
+        return sessionid
+
+    def test_cached_lookup(self):
+        """A session is found from the cache without reading the table"""
+
+        self.login('Bobalooba')
+        # remove the row behind the cache's back
+        cursor = self.db.cursor()
+        cursor.execute("DELETE FROM sessions")
+        self.assertEqual('Bobalooba', users.session_user(self.db))
+
+        # delete_session keeps the cache consistent
+        self.login('Contrary')
+        users.delete_session(self.db, 'Contrary')
+        self.assertIsNone(users.session_user(self.db))
+
+    def test_logout_elsewhere(self):
+        """A session ended by another process is refused where it matters"""
+
+        self.login('Bobalooba')
+        # as delete_session in another process would
+        cursor = self.db.cursor()
+        cursor.execute("DELETE FROM sessions WHERE usernick = 'Bobalooba'")
+        self.db.commit()
+
+        self.assertEqual('Bobalooba', users.session_user(self.db))
+        self.assertIsNone(users.session_user(self.db, cached=False))
+        # and the cached entry is dropped
+        self.assertIsNone(users.session_user(self.db))
+
+    def test_expired(self):
+        """Expired sessions are not valid and a new one is made on login"""
+
+        sessionid = self.login('Bobalooba')
+        users.session_cache.clear()
+        cursor = self.db.cursor()
+        cursor.execute("UPDATE sessions SET expires = ?", (time.time() - 1,))
+        self.db.commit()
+
+        self.assertIsNone(users.session_user(self.db))
+        self.assertNotEqual(sessionid, self.login('Bobalooba'))
+        self.assertEqual('Bobalooba', users.session_user(self.db))
+
+    def test_sweep(self):
+        """The sweeper deletes only expired sessions, in batches"""
+
+        cursor = self.db.cursor()
+        now = time.time()
+        for i in range(7):
+            cursor.execute("INSERT INTO sessions (sessionid, usernick, expires) VALUES (?, 'Bean', ?)",
+                           ('old%d' % i, now - 10))
+        self.db.commit()
+        self.login('Bobalooba')
+
+        self.assertEqual(7, users.sweep_sessions(self.db, batch_size=3))
+        cursor.execute("SELECT usernick FROM sessions")
+        self.assertEqual([('Bobalooba',)], cursor.fetchall())
+
+    def test_signed(self):
+        """Signed sessions need no database lookup"""
+
+        config.SESSION_MODE = 'signed'
+        config.SESSION_SECRET = 'not very secret'
+
+        sessionid = self.login('Bobalooba')
+        # the same cookie is kept for the same user
+        self.assertEqual(sessionid, self.login('Bobalooba'))
+
+        cursor = self.db.cursor()
+        cursor.execute("SELECT count(*) FROM sessions")
+        self.assertEqual(0, cursor.fetchone()[0])
+        self.assertEqual('Bobalooba', users.session_user(self.db))
+
+        # tampering breaks the signature
+        request.cookies[users.COOKIE_NAME] = sessionid[:-1] + ('0' if sessionid[-1] != '0' else '1')
+        self.assertIsNone(users.session_user(self.db))
+
+        # expired sessions are refused
+        request.cookies[users.COOKIE_NAME] = users.make_signed_session('Bobalooba', time.time() - 1)
+        self.assertIsNone(users.session_user(self.db))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,13 +3,28 @@
   <head>
 
     <title>{{title}}</title>
-      <link href="/static/style.css" rel="stylesheet">
+      <link href="{{static_url('style.css')}}" rel="stylesheet">
   </head>
 
   <body>
 
     <h1>{{title}}</h1>
 
+    <div class="login">
+    % if get('nick'):
+        <form id="logoutform" action="/logout" method="post">
+            Logged in as {{nick}}
+            <input type="submit" value="Logout">
+        </form>
+    % else:
+        <form id="loginform" action="/login" method="post">
+            <input type="text" name="nick" placeholder="nick">
+            <input type="password" name="password" placeholder="password">
+            <input type="submit" value="Login">
+        </form>
+    % end
+    </div>
+
     <div class="content">
 
         {{!base}}
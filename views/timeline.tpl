@@ -0,0 +1,74 @@
+% rebase('base.tpl')
+
+% if user:
+<div class="user">
+    <img src="{{user[1]}}" alt="{{user[0]}}" class="avatar">
+</div>
+% end
+
+<h2>{{heading}}</h2>
+
+% if get('nick'):
+<form id="postform" action="/post" method="post">
+    <textarea name="post" maxlength="150" placeholder="What's happening?"></textarea>
+    <input type="submit" value="Post">
+</form>
+% end
+
+<div class="posts">
+% for (id, timestamp, usernick, avatar, content), html in posts:
+    <div class="post">
+        <img src="{{avatar}}" alt="{{usernick}}" class="avatar">
+        <a href="/users/{{usernick}}" class="usernick">{{usernick}}</a>
+        <span class="timestamp">{{timestamp}}</span>
+        <p class="content">{{!html}}</p>
+    % if get('votes') is not None:
+        <span class="votes">{{votes.get(id, 0)}} votes</span>
+    % end
+    % if get('nick'):
+        <form class="vote" action="/vote" method="post">
+            <input type="hidden" name="post" value="{{id}}">
+            <input type="submit" value="+1">
+        </form>
+    % end
+    </div>
+% end
+</div>
+
+<div class="pages">
+% if newer:
+    <a href="?after={{newer}}" class="newer">Newer posts</a>
+% end
+% if older:
+    <a href="?before={{older}}" class="older">Older posts</a>
+% end
+</div>
+
+% if get('suggestions'):
+<div class="suggestions">
+    <h3>Who to follow</h3>
+    <ul>
+    % for other, avatar, in_common in suggestions:
+        <li>
+            <img src="{{avatar}}" alt="{{other}}" class="avatar">
+            <a href="/users/{{other}}">{{other}}</a> ({{in_common}} you follow)
+            <form class="follow" action="/follow" method="post">
+                <input type="hidden" name="nick" value="{{other}}">
+                <input type="submit" value="Follow">
+            </form>
+        </li>
+    % end
+    </ul>
+</div>
+% end
+
+% if trending:
+<div class="trending">
+    <h3>Trending</h3>
+    <ul>
+    % for tag, count in trending:
+        <li><a href="/tags/{{tag}}">#{{tag}}</a> ({{count}})</li>
+    % end
+    </ul>
+</div>
+% end
@@ -0,0 +1,156 @@
+"""
+Vote counts and the top posts ranking.
+
+Each user can vote for a post once (a unique index on votes).  The
+number of votes for each post is kept in vote_counts, updated in the
+same transaction as the vote, so showing a score is a key lookup
+rather than counting the votes.
+
+Top posts are ranked by a time-decayed score: a post's votes count
+for half as much for every config.TOP_POSTS_HALF_LIFE seconds that it
+is older than another.  Written as
+
+    score = log2(1 + votes) + posted / half_life
+
+(posted in seconds since the epoch) the score of a post only changes
+when its votes do, so the ranking in top_posts never has to be
+recomputed from scratch.  Votes list their post in vote_changes and
+refresh, run periodically by a RankingRefresher, re-scores just those
+posts and keeps the best config.TOP_POSTS_SIZE.
+
+To rebuild the counts and the ranking from the votes table run
+
+    python votes.py [dbname]
+"""
+
+import calendar
+import math
+import sys
+import time
+
+import config
+import jobs
+
+
+def score(count, timestamp, half_life=None):
+    """Return the ranking score of a post with count votes made at
+    timestamp ('YYYY-MM-DD HH:MM:SS' UTC)"""
+
+    if half_life is None:
+        half_life = config.TOP_POSTS_HALF_LIFE
+    posted = calendar.timegm(time.strptime(timestamp, '%Y-%m-%d %H:%M:%S'))
+    return math.log2(1 + count) + posted / half_life
+
+
+def add(cursor, post_id, usernick):
+    """Record usernick's vote for post_id, return False if they had
+    voted for it already.  The caller is responsible for committing"""
+
+    cursor.execute("INSERT OR IGNORE INTO votes (post, usernick) VALUES (?, ?)", (post_id, usernick))
+    if cursor.rowcount == 0:
+        return False
+    cursor.execute("""INSERT INTO vote_counts (post_id, count) VALUES (?, 1)
+                      ON CONFLICT (post_id) DO UPDATE SET count = count + 1""", (post_id,))
+    cursor.execute("INSERT OR IGNORE INTO vote_changes (post_id) VALUES (?)", (post_id,))
+    return True
+
+
+def remove(cursor, post_id, usernick):
+    """Remove usernick's vote for post_id, return False if there
+    wasn't one.  The caller is responsible for committing"""
+
+    cursor.execute("DELETE FROM votes WHERE post = ? AND usernick = ?", (post_id, usernick))
+    if cursor.rowcount == 0:
+        return False
+    cursor.execute("UPDATE vote_counts SET count = count - 1 WHERE post_id = ?", (post_id,))
+    cursor.execute("DELETE FROM vote_counts WHERE post_id = ? AND count <= 0", (post_id,))
+    cursor.execute("INSERT OR IGNORE INTO vote_changes (post_id) VALUES (?)", (post_id,))
+    return True
+
+
+def refresh(cursor, batch_size=None):
+    """Re-score up to batch_size (default config.TOP_POSTS_BATCH) posts
+    whose votes have changed and trim the ranking to the best
+    config.TOP_POSTS_SIZE posts.  Return the number re-scored.
+    The caller is responsible for committing"""
+
+    if batch_size is None:
+        batch_size = config.TOP_POSTS_BATCH
+
+    cursor.execute("""SELECT vote_changes.post_id, vote_counts.count, posts.timestamp
+                      FROM vote_changes
+                           LEFT JOIN vote_counts ON vote_counts.post_id = vote_changes.post_id
+                           LEFT JOIN posts ON posts.id = vote_changes.post_id
+                      LIMIT ?""", (batch_size,))
+    changed = cursor.fetchall()
+    if not changed:
+        return 0
+
+    ranked = [(post_id, score(count, timestamp)) for post_id, count, timestamp in changed
+              if count and timestamp is not None]
+    unranked = [(post_id,) for post_id, count, timestamp in changed if not count or timestamp is None]
+    cursor.executemany("INSERT OR REPLACE INTO top_posts (post_id, score) VALUES (?, ?)", ranked)
+    cursor.executemany("DELETE FROM top_posts WHERE post_id = ?", unranked)
+    cursor.executemany("DELETE FROM vote_changes WHERE post_id = ?", [(row[0],) for row in changed])
+
+    # posts that fall out are ranked again from their count if they get another vote
+    cursor.execute("SELECT score FROM top_posts ORDER BY score DESC LIMIT 1 OFFSET ?", (config.TOP_POSTS_SIZE,))
+    row = cursor.fetchone()
+    if row is not None:
+        cursor.execute("DELETE FROM top_posts WHERE score <= ?", row)
+    return len(changed)
+
+
+def clear(cursor):
+    """Remove all votes, counts and the ranking"""
+
+    for table in ('votes', 'vote_counts', 'vote_changes', 'top_posts'):
+        cursor.execute('DELETE FROM "%s"' % table)
+
+
+def rebuild(db, commit=True):
+    """Recount the votes for every post and rank them again"""
+
+    cursor = db.cursor()
+    for table in ('vote_counts', 'vote_changes', 'top_posts'):
+        cursor.execute('DELETE FROM "%s"' % table)
+    cursor.execute("""INSERT INTO vote_counts (post_id, count)
+                      SELECT CAST(post AS integer), count(*) FROM votes GROUP BY CAST(post AS integer)""")
+    cursor.execute("INSERT INTO vote_changes (post_id) SELECT post_id FROM vote_counts")
+    while refresh(cursor, 10000):
+        pass
+    if commit:
+        db.commit()
+
+
+def refresh_all(db):
+    """Re-score every post whose votes have changed, committing a
+    batch at a time so the write lock is never held for long"""
+
+    # imported here as database imports this module
+    import writer
+
+    while writer.write(db, refresh):
+        pass
+
+
+class RankingRefresher(jobs.PeriodicJob):
+    """A background thread that runs refresh_all every interval seconds
+    (default config.TOP_POSTS_INTERVAL) until stop() is called"""
+
+    def __init__(self, dbname=config.DB_NAME, interval=None):
+
+        super().__init__('ranking-refresher', refresh_all, dbname,
+                         config.TOP_POSTS_INTERVAL if interval is None else interval)
+
+
+if __name__ == '__main__':
+    from database import COMP249Db
+
+    dbname = sys.argv[1] if len(sys.argv) > 1 else config.DB_NAME
+    db = COMP249Db(dbname)
+    rebuild(db)
+    cursor = db.cursor()
+    cursor.execute("SELECT count(*) FROM top_posts")
+    print("ranked %d posts" % cursor.fetchone()[0])
+    db.close()
@@ -0,0 +1,154 @@
+"""
+Tests for vote counts and the top posts ranking
+"""
+
+import unittest
+
+from webtest import TestApp
+
+import config
+import interface
+import main
+import migrations
+import votes
+from database import COMP249Db
+
+
+class VoteTests(unittest.TestCase):
+
+    def setUp(self):
+        self.db = COMP249Db(':memory:')
+        self.db.create_tables()
+        self.db.sample_data(random=False)
+
+    def refresh(self):
+        cursor = self.db.cursor()
+        votes.refresh(cursor)
+        self.db.commit()
+
+    def test_one_vote_each(self):
+        """Votes are counted once per user and can be taken back"""
+
+        self.assertTrue(interface.vote_add(self.db, 3, 'Bean'))
+        self.assertFalse(interface.vote_add(self.db, 3, 'Bean'))
+        self.assertTrue(interface.vote_add(self.db, 3, 'Contrary'))
+        self.assertIsNone(interface.vote_add(self.db, 99, 'Bean'))
+        self.assertEqual({3: 2}, interface.vote_counts(self.db, [1, 3]))
+
+        self.assertTrue(interface.vote_remove(self.db, 3, 'Bean'))
+        self.assertFalse(interface.vote_remove(self.db, 3, 'Bean'))
+        self.assertEqual({3: 1}, interface.vote_counts(self.db, [3]))
+        interface.vote_remove(self.db, 3, 'Contrary')
+        self.assertEqual({}, interface.vote_counts(self.db, [3]))
+
+    def test_score(self):
+        """Votes count for half as much per half life of age"""
+
+        newer = votes.score(1, '2015-02-20 12:00:00', half_life=3600)
+        older = votes.score(3, '2015-02-20 11:00:00', half_life=3600)
+        self.assertAlmostEqual(newer, older)
+        self.assertGreater(votes.score(2, '2015-02-20 12:00:00', half_life=3600), newer)
+
+    def test_ranking(self):
+        """The ranking is refreshed from the posts whose votes changed"""
+
+        # posts 1 and 2 are 50 minutes apart, 10 is 7.5 hours older
+        for nick in ('Bean', 'Contrary', 'Barfoo'):
+            interface.vote_add(self.db, 2, nick)
+            interface.vote_add(self.db, 10, nick)
+        interface.vote_add(self.db, 1, 'Bean')
+        self.assertEqual([], interface.top_posts(self.db))
+
+        self.refresh()
+        self.assertEqual([2, 10, 1], [post[0] for post in interface.top_posts(self.db)])
+
+        interface.vote_add(self.db, 1, 'Contrary')
+        interface.vote_add(self.db, 1, 'Barfoo')
+        interface.vote_add(self.db, 1, 'Mandible')
+        # unchanged until the next refresh
+        self.assertEqual(2, interface.top_posts(self.db)[0][0])
+        self.refresh()
+        self.assertEqual([1, 2, 10], [post[0] for post in interface.top_posts(self.db)])
+
+        # a post with no votes left drops out
+        for nick in ('Bean', 'Contrary', 'Barfoo'):
+            interface.vote_remove(self.db, 10, nick)
+        self.refresh()
+        self.assertEqual([1, 2], [post[0] for post in interface.top_posts(self.db)])
+
+    def test_trim(self):
+        """Only the best TOP_POSTS_SIZE posts are kept"""
+
+        saved = config.TOP_POSTS_SIZE
+        config.TOP_POSTS_SIZE = 2
+        try:
+            for post_id in (1, 2, 3):
+                interface.vote_add(self.db, post_id, 'Bean')
+            self.refresh()
+            self.assertEqual([1, 2], [post[0] for post in interface.top_posts(self.db)])
+        finally:
+            config.TOP_POSTS_SIZE = saved
+
+    def test_migration(self):
+        """Duplicate votes are removed and existing votes counted"""
+
+        cursor = self.db.cursor()
+        cursor.execute("DROP INDEX votes_post_usernick_unique")
+        cursor.executemany("INSERT INTO votes (post, usernick) VALUES (?, ?)",
+                           [(4, 'Bean'), (4, 'Bean'), (4, 'Contrary'), (5, 'Bean')])
+        cursor.execute("DELETE FROM schema_version WHERE version >= 8")
+        self.db.commit()
+
+        self.assertIn(8, migrations.migrate(self.db))
+        self.assertEqual({4: 2, 5: 1}, interface.vote_counts(self.db, [4, 5]))
+        self.assertEqual([4, 5], [post[0] for post in interface.top_posts(self.db)])
+        self.assertFalse(interface.vote_add(self.db, 4, 'Bean'))
+
+
+class RouteTests(unittest.TestCase):
+
+    def setUp(self):
+        self.db = COMP249Db()
+        self.db.create_tables()
+        self.db.sample_data(random=False)
+        self.app = TestApp(main.application)
+
+    def tearDown(self):
+        self.db.close()
+
+    def test_vote(self):
+        """Logged in users vote with the form on each post, votes show on the top page"""
+
+        self.app.post('/vote', {'post': '3'}, status=403)
+
+        response = self.app.get('/')
+        form = response.forms['loginform']
+        form['nick'] = 'Bobalooba'
+        form['password'] = 'bob'
+        response = form.submit().follow()
+
+        vote_form = [form for form in response.forms.values() if form.action == '/vote'][0]
+        post_id = int(vote_form['post'].value)
+        vote_form.submit(status=303)
+        # back to the page voted on, only if it is on this site
+        response = self.app.post('/vote', {'post': str(post_id)},
+                                 headers={'Referer': 'http://localhost:80/users/Bean?before=x'}, status=303)
+        self.assertEqual('/users/Bean?before=x', response.headers['Location'])
+        for referer in ('http://evil.example/top', '//evil.example/top', 'javascript:alert(1)',
+                        'http://localhost:80//evil.example/'):
+            response = self.app.post('/vote', {'post': str(post_id)}, headers={'Referer': referer}, status=303)
+            self.assertEqual('/top', response.headers['Location'])
+        self.app.post('/vote', {'post': 'x'}, status=400)
+        self.app.post('/vote', {'post': '99'}, status=404)
+
+        cursor = self.db.cursor()
+        votes.refresh(cursor)
+        self.db.commit()
+        response = self.app.get('/top')
+        self.assertIn('1 votes', response)
+        self.assertEqual(1, len(response.html.find_all(class_='post')))
+        self.assertEqual({post_id: 1}, interface.vote_counts(self.db, [post_id]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,248 @@
+"""
+Writes to the database through one writer connection per database file.
+
+SQLite allows one writer at a time, so request threads that each
+commit their own writes queue on the write lock and, when they wait
+longer than the busy timeout, fail with 'database is locked'.  Instead
+a request hands its write to the database's Writer as a function of a
+cursor, eg.
+
+    post_id = writer.write(db, lambda cursor: insert_post(cursor, ...))
+
+and waits for its result.  The first thread waiting when no other is
+committing takes all the writes that have queued up (up to
+config.WRITE_BATCH_SIZE) and applies them in one transaction on the
+writer's connection, so a burst of writes costs one commit rather than
+one each, while a write on its own is committed by its own thread
+without waking another.  Each write runs in its own savepoint so that
+one failing only undoes its own changes.
+
+Each process has its own writer, so with several worker processes
+there is one writer per process rather than one per request thread
+competing for the lock.
+"""
+
+import collections
+import os
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+
+import config
+import metrics
+from database import connect
+
+
+class WriteTimeout(Exception):
+    """Raised when a write wasn't started within the timeout, it will
+    never be applied"""
+
+
+class Writer():
+    """The writes queued for one database file, applied in batches of
+    up to batch_size by the threads waiting for them, one at a time,
+    waiting up to delay seconds after the first write of a batch for
+    more to arrive"""
+
+    def __init__(self, dbname, batch_size=None, delay=None):
+
+        self.dbname = dbname
+        self.batch_size = config.WRITE_BATCH_SIZE if batch_size is None else batch_size
+        self.delay = config.WRITE_BATCH_DELAY if delay is None else delay
+        # (future, job, stats) for each write, stats the metrics.RequestStats
+        # of the request it is for
+        self.jobs = collections.deque()
+        # number of transactions committed, for tests and benchmarks
+        self.commits = 0
+        self.conn = None
+        self.inode = None
+        # True while a thread is applying a batch
+        self._busy = False
+        self._lock = threading.Lock()
+        # notified when a job is queued and when a batch has been applied
+        self._queued = threading.Condition(self._lock)
+        self._applied = threading.Condition(self._lock)
+
+    def submit(self, job):
+        """Queue job, a function taking a cursor, return a Future for
+        its result.  It is applied once a thread waits for it"""
+
+        future = Future()
+        with self._lock:
+            self.jobs.append((future, job, metrics.current()))
+            if self.delay:
+                self._queued.notify()
+        return future
+
+    def wait(self, future, timeout=None):
+        """Return the result of future, for a job submitted here,
+        applying the queued jobs in this thread if no other thread is.
+        Raise TimeoutError if it isn't done after timeout seconds"""
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while not future.done():
+                if not self._busy:
+                    self._busy = True
+                    try:
+                        self._flush()
+                    finally:
+                        self._busy = False
+                        self._applied.notify_all()
+                elif deadline is None:
+                    self._applied.wait()
+                elif not self._applied.wait(deadline - time.monotonic()):
+                    break
+        return future.result(0)
+
+    def _flush(self):
+        """Apply up to batch_size of the queued jobs, called with the
+        lock held, which is released while the database is used"""
+
+        self._lock.release()
+        try:
+            conn = self._connection()
+        finally:
+            self._lock.acquire()
+        if self.delay:
+            self._queued.wait_for(lambda: len(self.jobs) >= self.batch_size, self.delay)
+        batch = [self.jobs.popleft() for i in range(min(len(self.jobs), self.batch_size))]
+        self._lock.release()
+        try:
+            self.apply(conn, batch)
+        finally:
+            self._lock.acquire()
+
+    def _connection(self):
+        """Return the writer's connection, opened again if the database
+        file has been replaced, eg. by a new empty database"""
+
+        try:
+            current = os.stat(self.dbname).st_ino
+        except OSError:
+            current = None
+        if self.conn is None or current != self.inode:
+            if self.conn is not None:
+                self.conn.close()
+            self.conn = connect(self.dbname)
+            self.inode = os.stat(self.dbname).st_ino
+        return self.conn
+
+    def apply(self, conn, batch):
+        """Run the (future, job, stats) writes in batch in one
+        transaction and set their results once it is committed.  The
+        queries of each job are added to its request's stats, and the
+        time to begin and commit the transaction to all of them"""
+
+        # leave out any cancelled by a caller that gave up waiting
+        batch = [(future, job, stats) for future, job, stats in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        results = []
+        cursor = conn.cursor(metrics.TimedCursor) if config.METRICS else conn.cursor()
+        # this thread's own request
+        own = metrics.attribute(None)
+        shared = 0.0
+        try:
+            start = time.perf_counter()
+            cursor.execute("BEGIN IMMEDIATE")
+            shared += time.perf_counter() - start
+            for future, job, stats in batch:
+                metrics.attribute(stats)
+                cursor.execute("SAVEPOINT job")
+                try:
+                    results.append((future, True, job(cursor)))
+                    cursor.execute("RELEASE job")
+                except Exception as e:
+                    cursor.execute("ROLLBACK TO job")
+                    cursor.execute("RELEASE job")
+                    results.append((future, False, e))
+            metrics.attribute(None)
+            start = time.perf_counter()
+            conn.commit()
+            shared += time.perf_counter() - start
+            self.commits += 1
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            results = [(future, False, e) for future, job, stats in batch]
+        finally:
+            metrics.attribute(own)
+        for future, job, stats in batch:
+            if stats is not None:
+                stats.sql_seconds += shared
+
+        for future, ok, value in results:
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(dbname):
+    """Return the Writer for dbname, making it on first use"""
+
+    with _writers_lock:
+        if dbname not in _writers:
+            _writers[dbname] = Writer(dbname)
+        return _writers[dbname]
+
+
+def _forget_writers():
+    """A forked child mustn't use its parent's writer connections"""
+
+    global _writers, _writers_lock
+    _writers = {}
+    _writers_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_writers)
+
+
+def write(db, job, timeout=None):
+    """Apply job, a function taking a cursor, to the database of db and
+    return its result once committed, raising any exception it raised.
+
+    The write goes through the database's writer unless the queue is
+    turned off (config.WRITE_QUEUE), db is an in-memory database that
+    another connection can't see, or db has changes of its own not yet
+    committed which the writer would wait for; then it is applied and
+    committed on db's write_cursor.  Either way db's queries see the
+    change once this returns.
+
+    Raise WriteTimeout if the job hasn't been started after timeout
+    seconds (default config.WRITE_TIMEOUT)"""
+
+    if not config.WRITE_QUEUE or db.dbname == ':memory:' or db.pending():
+        # a failing job undoes its own changes, as in Writer.apply
+        cursor = db.write_cursor()
+        cursor.execute("SAVEPOINT job")
+        try:
+            result = job(cursor)
+            cursor.execute("RELEASE job")
+        except Exception:
+            cursor.execute("ROLLBACK TO job")
+            cursor.execute("RELEASE job")
+            raise
+        db.commit()
+        db.wrote()
+        return result
+
+    if timeout is None:
+        timeout = config.WRITE_TIMEOUT
+    database_writer = get_writer(db.dbname)
+    future = database_writer.submit(job)
+    try:
+        result = database_writer.wait(future, timeout)
+    except TimeoutError:
+        if future.cancel():
+            raise WriteTimeout("write to %s not started in %.1fs" % (db.dbname, timeout))
+        # started already, it will finish soon
+        result = future.result()
+    db.wrote()
+    return result
@@ -0,0 +1,173 @@
+"""
+Tests for the group-commit writer
+"""
+
+import os
+import tempfile
+import threading
+import unittest
+
+import config
+import interface
+import metrics
+import writer
+from database import COMP249Db
+
+
+class WriterTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.dbname = os.path.join(self.dir.name, 'test.db')
+        self.db = COMP249Db(self.dbname)
+        self.db.create_tables()
+        self.db.sample_data(random=False)
+
+    def tearDown(self):
+        self.db.close()
+        self.dir.cleanup()
+
+    def count_posts(self):
+        cursor = self.db.cursor()
+        cursor.execute("SELECT count(*) FROM posts")
+        return cursor.fetchone()[0]
+
+    def test_post_add(self):
+        """post_add returns the id of a post committed by the writer"""
+
+        before = self.count_posts()
+        post_id = interface.post_add(self.db, 'Bobalooba', 'written by the writer')
+        self.assertEqual(before + 1, self.count_posts())
+        post = interface.post_list(self.db, 'Bobalooba', limit=1)[0]
+        self.assertEqual(post_id, post[0])
+        self.assertIn('written by the writer', post)
+        self.assertGreater(writer.get_writer(self.dbname).commits, 0)
+
+    def test_group_commit(self):
+        """Writes queued together are committed in one transaction"""
+
+        queue = writer.Writer(self.dbname, batch_size=50, delay=0.5)
+        futures = [queue.submit(lambda cursor, i=i: cursor.execute(
+            "INSERT INTO posts (timestamp, usernick, content) VALUES ('2015-01-01', 'Bean', ?)", ('group %d' % i,)).lastrowid)
+            for i in range(20)]
+        ids = [queue.wait(future, 5) for future in futures]
+
+        self.assertEqual(1, queue.commits)
+        self.assertEqual(20, len(set(ids)))
+
+    def test_failed_write(self):
+        """A failing write raises in its caller and doesn't undo the others"""
+
+        queue = writer.Writer(self.dbname, delay=0.5)
+        good = queue.submit(lambda cursor: cursor.execute(
+            "INSERT INTO posts (timestamp, usernick, content) VALUES ('2015-01-01', 'Bean', 'good')").lastrowid)
+        bad = queue.submit(lambda cursor: cursor.execute("INSERT INTO nosuchtable VALUES (1)"))
+
+        self.assertIsNotNone(queue.wait(good, 5))
+        self.assertRaises(Exception, queue.wait, bad, 5)
+        cursor = self.db.cursor()
+        cursor.execute("SELECT count(*) FROM posts WHERE content = 'good'")
+        self.assertEqual(1, cursor.fetchone()[0])
+
+    def test_failed_write_inline(self):
+        """A failing write without the queue leaves nothing to be committed later"""
+
+        saved = config.WRITE_QUEUE
+        config.WRITE_QUEUE = 0
+        try:
+            def bad(cursor):
+                cursor.execute("INSERT INTO posts (timestamp, usernick, content) VALUES ('2015-01-01', 'Bean', 'bad')")
+                cursor.execute("INSERT INTO nosuchtable VALUES (1)")
+
+            self.assertRaises(Exception, writer.write, self.db, bad)
+            self.assertFalse(self.db.pending())
+            interface.post_add(self.db, 'Bean', 'good')
+        finally:
+            config.WRITE_QUEUE = saved
+
+        cursor = self.db.cursor()
+        cursor.execute("SELECT content FROM posts WHERE content IN ('good', 'bad')")
+        self.assertEqual([('good',)], cursor.fetchall())
+
+    def test_concurrent(self):
+        """Posts added from many threads at once are all written"""
+
+        before = self.count_posts()
+        ids = []
+
+        def add(i):
+            db = COMP249Db(self.dbname)
+            ids.append(interface.post_add(db, 'Bean', 'post %d' % i))
+            db.close()
+
+        threads = [threading.Thread(target=add, args=(i,)) for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(20, len(set(ids)))
+        self.assertNotIn(None, ids)
+        self.assertEqual(before + 20, self.count_posts())
+
+    def test_timeout(self):
+        """A write that isn't started in time is abandoned"""
+
+        queue = writer.Writer(self.dbname)
+        future = queue.submit(lambda cursor: 1)
+        self.assertTrue(future.cancel())
+        # cancelled writes are skipped
+        self.assertEqual(2, queue.wait(queue.submit(lambda cursor: 2), 5))
+
+        # one queued behind a batch taking too long isn't started
+        started = threading.Event()
+        release = threading.Event()
+
+        def block(cursor):
+            started.set()
+            release.wait(5)
+
+        thread = threading.Thread(target=queue.wait, args=(queue.submit(block), 5))
+        thread.start()
+        started.wait(5)
+        late = queue.submit(lambda cursor: 3)
+        try:
+            self.assertRaises(TimeoutError, queue.wait, late, 0.1)
+            self.assertTrue(late.cancel())
+        finally:
+            release.set()
+            thread.join()
+
+    def test_own_thread(self):
+        """A write with nothing else queued is applied by the thread waiting for it"""
+
+        queue = writer.Writer(self.dbname)
+        future = queue.submit(lambda cursor: threading.current_thread())
+        self.assertIs(threading.current_thread(), queue.wait(future, 5))
+
+
+    def test_metrics(self):
+        """Each write's queries are added to the metrics of the request
+        it was for, whichever thread applies it"""
+
+        queue = writer.Writer(self.dbname, delay=0.5)
+        insert = ("INSERT INTO posts (timestamp, usernick, content) VALUES ('2015-01-01', 'Bean', 'timed')",)
+        mine, other = metrics.RequestStats(), metrics.RequestStats()
+        metrics.attribute(other)
+        try:
+            theirs = queue.submit(lambda cursor: cursor.execute(*insert) and cursor.execute(*insert))
+            metrics.attribute(mine)
+            queue.wait(queue.submit(lambda cursor: cursor.execute(*insert)), 5)
+            queue.wait(theirs, 5)
+        finally:
+            metrics.attribute(None)
+
+        self.assertEqual(1, queue.commits)
+        # each in a savepoint
+        self.assertEqual((3, 4), (mine.queries, other.queries))
+        self.assertGreater(mine.sql_seconds, 0)
+        self.assertGreater(other.sql_seconds, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()